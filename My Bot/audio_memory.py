@@ -0,0 +1,381 @@
+"""
+Memory accounting for audio buffers held by the bot.
+
+Every audio buffer kept in memory (uploads waiting for an effect, rendered
+results, intermediates) is registered with a MemoryBudget under a key. The
+resident buffers share one configurable budget; when a new buffer pushes the
+total over it, the least recently used ones are written to files in
+SPILL_DIR and memory-mapped, so they stay readable through the same
+interface while the kernel decides which pages stay in RAM. A burst of long
+uploads then fills the disk instead of taking the process out of memory.
+
+Spill files are written without holding the budget lock and, when put is
+called on an event loop, in a worker thread, so a slow disk stalls neither
+other threads nor the loop. Uploads larger than the whole budget go
+straight to a spill file (see spill_file and put_file).
+
+Usage, spills and per-kind totals are exported through the metrics module.
+"""
+
+import os
+import mmap
+import asyncio
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+import metrics
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Audio bytes kept resident before the least recently used buffers spill (0 spills everything)
+MEMORY_BUDGET_MB = float(os.environ.get('AUDIO_MEMORY_BUDGET_MB', '256'))
+
+# Directory for spilled buffers; should be on disk, not tmpfs
+SPILL_DIR = os.environ.get('AUDIO_SPILL_DIR', os.path.join('temp_audio', 'spill'))
+
+# Buffer kinds reported separately in the metrics
+KINDS = ("input", "render", "intermediate")
+
+
+class AudioBuffer:
+    """Audio bytes held in memory or, once spilled, in a memory-mapped file."""
+
+    def __init__(self, budget, key, kind, data):
+        self.budget = budget
+        self.key = key
+        self.kind = kind
+        self.size = len(data)
+        self._data = data
+        self._map = None
+        self._path = None
+        self._spill_lock = threading.Lock()  # held while the spill file is written
+
+    @property
+    def spilled(self):
+        return self._path is not None
+
+    @property
+    def released(self):
+        return self._data is None and self._map is None
+
+    def view(self):
+        """
+        Return the contents without copying them.
+
+        Returns:
+            memoryview: The bytes, backed by memory or by the spill file
+        """
+        self.budget.touch(self)
+        if self._map is not None:
+            return memoryview(self._map)
+        if self._data is None:
+            raise ValueError(f"Audio buffer {self.key!r} was released")
+        return memoryview(self._data)
+
+    def path(self):
+        """
+        Return a file holding the contents, spilling the buffer if it is resident.
+
+        For consumers that need a seekable file (FFmpeg seeking, copies).
+
+        Returns:
+            str: Path of the spill file; valid until the buffer is released
+        """
+        if not self.spilled:
+            self.budget.spill(self)
+        self.budget.touch(self)
+        return self._path
+
+    def ffmpeg_input(self):
+        """
+        Describe the buffer as FFmpeg input.
+
+        Returns:
+            str: Value for -i ("pipe:0" for resident buffers)
+            memoryview: Bytes to write to FFmpeg's stdin, or None to read the file
+        """
+        if self.spilled:
+            return self.path(), None
+        return "pipe:0", self.view()
+
+    def write_to(self, output_path):
+        """Write the contents to a file."""
+        with open(output_path, "wb") as f:
+            f.write(self.view())
+
+    def release(self):
+        """Drop the buffer and its spill file."""
+        self.budget.discard(self)
+
+    def _attach(self, path):
+        # Switch to the contents of a spill file; called by the budget with its lock held
+        if self.size:
+            with open(path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._map = b""  # empty files can't be mapped
+        self._path = path
+        self._data = None
+
+    def _close(self):
+        if isinstance(self._map, mmap.mmap):
+            try:
+                self._map.close()
+            except BufferError:
+                # A caller still holds a view; the mapping goes away with it
+                pass
+        if self._path and os.path.exists(self._path):
+            os.remove(self._path)
+        self._data = None
+        self._map = None
+
+
+class MemoryBudget:
+    """Tracks resident audio buffers and spills the least recently used ones."""
+
+    def __init__(self, budget_mb=None, spill_dir=None):
+        """
+        Args:
+            budget_mb (float): Resident budget in MB, MEMORY_BUDGET_MB by default
+            spill_dir (str): Directory for spill files, SPILL_DIR by default
+        """
+        self.limit = int((MEMORY_BUDGET_MB if budget_mb is None else budget_mb) * (1 << 20))
+        self.spill_dir = spill_dir or SPILL_DIR
+        self.lock = threading.RLock()
+        self.buffers = OrderedDict()  # key: AudioBuffer, least recently used first
+        self.resident = 0
+        self.spilled = 0
+        self.spilling = set()  # buffers chosen for spilling whose files are being written
+
+    def put(self, key, data, kind="input"):
+        """
+        Register a buffer, replacing (and releasing) any buffer under the same key.
+
+        Buffers pushed out of the budget are spilled in a worker thread when
+        called on an event loop, and right away otherwise.
+
+        Args:
+            key: Any hashable key, e.g. ("input", user_id)
+            data (bytes): The audio bytes; not copied
+            kind (str): One of KINDS, for the metrics
+
+        Returns:
+            AudioBuffer: The registered buffer
+        """
+        buffer = AudioBuffer(self, key, kind, data)
+        with self.lock:
+            previous = self.buffers.get(key)
+            if previous is not None:
+                self._remove(previous)
+            self.buffers[key] = buffer
+            self.resident += buffer.size
+            victims = self._select(keep=buffer)
+            self._publish()
+        try:
+            asyncio.get_running_loop().run_in_executor(None, self._spill_all, victims)
+        except RuntimeError:
+            self._spill_all(victims)
+        return buffer
+
+    def fits(self, size):
+        """Return True if a buffer of this many bytes may be held in memory at all."""
+        return size <= self.limit
+
+    def spill_file(self):
+        """
+        Create an empty spill file, for writing a buffer straight to disk.
+
+        Returns:
+            str: Path of the file; register it with put_file
+        """
+        os.makedirs(self.spill_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix="spill_", suffix=".bin", dir=self.spill_dir)
+        os.close(fd)
+        return path
+
+    def put_file(self, key, path, kind="input"):
+        """
+        Register a spill file as a spilled buffer, replacing any buffer under the same key.
+
+        Args:
+            key: Any hashable key, e.g. ("input", user_id)
+            path (str): File from spill_file; the budget deletes it on release
+            kind (str): One of KINDS, for the metrics
+
+        Returns:
+            AudioBuffer: The registered buffer
+        """
+        buffer = AudioBuffer(self, key, kind, b"")
+        buffer.size = os.path.getsize(path)
+        with self.lock:
+            previous = self.buffers.get(key)
+            if previous is not None:
+                self._remove(previous)
+            buffer._attach(path)
+            self.buffers[key] = buffer
+            self.spilled += buffer.size
+            metrics.increment("audio_direct_spills_total")
+            self._publish()
+        return buffer
+
+    def get(self, key):
+        """
+        Look up a buffer and mark it as recently used.
+
+        Returns:
+            AudioBuffer: The buffer, or None
+        """
+        with self.lock:
+            buffer = self.buffers.get(key)
+            if buffer is not None:
+                self.buffers.move_to_end(key)
+            return buffer
+
+    def touch(self, buffer):
+        """Mark a buffer as recently used."""
+        with self.lock:
+            if self.buffers.get(buffer.key) is buffer:
+                self.buffers.move_to_end(buffer.key)
+
+    def discard(self, buffer_or_key):
+        """Release a buffer (or the buffer under a key) and its spill file."""
+        with self.lock:
+            buffer = buffer_or_key if isinstance(buffer_or_key, AudioBuffer) else self.buffers.get(buffer_or_key)
+            if buffer is None or self.buffers.get(buffer.key) is not buffer:
+                return
+            self._remove(buffer)
+            self._publish()
+
+    def spill(self, buffer):
+        """
+        Move a resident buffer to a memory-mapped file.
+
+        The file is written without holding the budget lock; blocks while
+        another thread spills the same buffer.
+        """
+        with buffer._spill_lock:
+            with self.lock:
+                if buffer.spilled or buffer.released:
+                    return
+                data = buffer._data
+            path = self.spill_file()
+            try:
+                with open(path, "wb") as f:
+                    f.write(data)
+            except OSError:
+                os.remove(path)
+                raise
+            with self.lock:
+                if self.buffers.get(buffer.key) is not buffer:
+                    # Released or replaced while the file was written
+                    os.remove(path)
+                    return
+                buffer._attach(path)
+                self.resident -= buffer.size
+                self.spilled += buffer.size
+                metrics.increment("audio_spills_total")
+                metrics.increment("audio_spilled_bytes_total", buffer.size)
+                self._publish()
+
+    def usage(self):
+        """
+        Return the current accounting.
+
+        Returns:
+            dict: Resident and spilled bytes and buffer counts, the limit and
+                resident bytes per kind
+        """
+        with self.lock:
+            by_kind = {kind: 0 for kind in KINDS}
+            for buffer in self.buffers.values():
+                if not buffer.spilled:
+                    by_kind[buffer.kind] = by_kind.get(buffer.kind, 0) + buffer.size
+            return {
+                "limit": self.limit,
+                "resident_bytes": self.resident,
+                "spilled_bytes": self.spilled,
+                "buffers": len(self.buffers),
+                "spilled_buffers": sum(1 for buffer in self.buffers.values() if buffer.spilled),
+                "by_kind": by_kind,
+            }
+
+    def _remove(self, buffer):
+        del self.buffers[buffer.key]
+        if buffer.spilled:
+            self.spilled -= buffer.size
+        else:
+            self.resident -= buffer.size
+        buffer._close()
+
+    def _select(self, keep=None):
+        # Choose least recently used buffers to spill until the resident total
+        # fits; the buffer just registered goes last, and alone it may exceed
+        # the budget. Called with the lock held.
+        excess = self.resident - sum(buffer.size for buffer in self.spilling) - self.limit
+        victims = []
+        for buffer in [b for b in self.buffers.values() if b is not keep] + [keep]:
+            if excess <= 0:
+                break
+            if buffer is None or buffer.spilled or not buffer.size or buffer in self.spilling:
+                continue
+            self.spilling.add(buffer)
+            victims.append(buffer)
+            excess -= buffer.size
+        return victims
+
+    def _spill_all(self, victims):
+        # Spill the buffers chosen by _select, without holding the lock
+        try:
+            for buffer in victims:
+                try:
+                    self.spill(buffer)
+                except OSError as e:
+                    logger.error(f"Could not spill audio buffer {buffer.key!r}: {str(e)}")
+                    return
+                if buffer.spilled:
+                    logger.info(f"Spilled {buffer.kind} buffer {buffer.key!r} ({buffer.size} bytes) to disk")
+        finally:
+            with self.lock:
+                self.spilling.difference_update(victims)
+
+    def _publish(self):
+        usage = self.usage()
+        metrics.set_gauge("audio_memory_bytes", usage["resident_bytes"])
+        metrics.set_gauge("audio_memory_limit_bytes", usage["limit"])
+        metrics.set_gauge("audio_memory_buffers", usage["buffers"] - usage["spilled_buffers"])
+        metrics.set_gauge("audio_spilled_bytes", usage["spilled_bytes"])
+        metrics.set_gauge("audio_spilled_buffers", usage["spilled_buffers"])
+        for kind, size in usage["by_kind"].items():
+            metrics.set_gauge(f"audio_memory_bytes_{kind}", size)
+
+
+def clean_spill_dir(directory=None, before=None):
+    """
+    Delete spill files left behind by a previous run.
+
+    Args:
+        directory (str): Spill directory, SPILL_DIR by default
+        before (float): Only delete files last modified before this time
+    """
+    directory = directory or SPILL_DIR
+    if not os.path.isdir(directory):
+        return
+    for filename in os.listdir(directory):
+        if filename.startswith("spill_"):
+            path = os.path.join(directory, filename)
+            try:
+                if before is None or os.path.getmtime(path) < before:
+                    os.remove(path)
+            except OSError as e:
+                logger.error(f"Error deleting spill file {filename}: {e}")
+
+
+# Process-wide budget
+budget = MemoryBudget()
@@ -0,0 +1,184 @@
+"""
+In-process rendering backend built on PyAV (libavformat/libavfilter).
+
+The subprocess backend pays for an FFmpeg launch, dynamic linking and codec
+initialisation on every job, which dominates the cost of a three second
+voice note. This backend decodes, filters and encodes inside the bot
+process, building the same filter graph from the VOICE_EFFECTS strings. It
+runs in a worker thread; libav releases the GIL while decoding and
+filtering.
+
+PyAV is optional. AVAILABLE is False when it is not installed, and the
+render engine then keeps using FFmpeg subprocesses.
+"""
+
+import os
+import time
+import logging
+import threading
+
+try:
+    import av
+except ImportError:
+    av = None
+
+import metrics
+import ffmpeg_limits
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+AVAILABLE = av is not None
+
+# libopus works on 20 ms frames at 48 kHz
+OPUS_SAMPLE_RATE = 48000
+OPUS_FRAME_SIZE = 960
+
+
+class RenderCancelled(Exception):
+    """Raised inside the worker thread when a render is cancelled."""
+
+
+def _filter_nodes(filter_chain):
+    """
+    Split a filter chain into (name, argument string) pairs.
+
+    Args:
+        filter_chain (str): Comma separated FFmpeg filter chain
+
+    Returns:
+        list: (name, args) tuples in chain order
+    """
+    from render_engine import _split_outside_quotes
+
+    nodes = []
+    for item in _split_outside_quotes(filter_chain, ","):
+        item = item.strip()
+        if item:
+            name, _, args = item.partition("=")
+            nodes.append((name.strip(), args))
+    return nodes
+
+
+def _build_graph(in_stream, filter_chain):
+    """Build abuffer -> effect filters -> Opus-compatible format -> sink."""
+    graph = av.filter.Graph()
+    chain = [graph.add_abuffer(template=in_stream)]
+    for name, args in _filter_nodes(filter_chain):
+        chain.append(graph.add(name, args or None))
+    # The FFmpeg CLI inserts these conversions automatically
+    chain.append(graph.add("aformat", f"sample_fmts=flt:sample_rates={OPUS_SAMPLE_RATE}"))
+    chain.append(graph.add("asetnsamples", f"n={OPUS_FRAME_SIZE}:p=0"))
+    chain.append(graph.add("abuffersink"))
+    graph.link_nodes(*chain).configure()
+    return graph
+
+
+def render_file(input_path, output_path, filter_chain, progress=None, cancel_event=None, deadline=None):
+    """
+    Render an effect in-process (blocking; call from a worker thread).
+
+    Args:
+        input_path (str): Path to the input audio file
+        output_path (str): Path of the Ogg/Opus file to write
+        filter_chain (str): FFmpeg filter chain to apply
+        progress (callable): Called with the decoded fraction of the input
+        cancel_event (threading.Event): Stops the render when set
+        deadline (float): time.monotonic() value after which the render is aborted
+
+    Returns:
+        bool: True if successful, False otherwise
+        str: Error message if unsuccessful, empty string otherwise
+    """
+    if not AVAILABLE:
+        return False, "PyAV is not installed"
+    if not os.path.exists(input_path):
+        return False, f"Input file not found: {input_path}"
+
+    output_limit = ffmpeg_limits.OUTPUT_LIMIT_MB << 20
+    started = time.monotonic()
+    try:
+        with av.open(input_path) as source, av.open(output_path, "w", format="ogg") as sink:
+            in_stream = source.streams.audio[0]
+            duration = float(source.duration / av.time_base) if source.duration else 0.0
+            out_stream = sink.add_stream("libopus", rate=OPUS_SAMPLE_RATE)
+            graph = _build_graph(in_stream, filter_chain)
+
+            def drain():
+                while True:
+                    try:
+                        frame = graph.pull()
+                    except (BlockingIOError, EOFError):
+                        return
+                    frame.pts = None
+                    for packet in out_stream.encode(frame):
+                        sink.mux(packet)
+
+            for frame in source.decode(in_stream):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise RenderCancelled()
+                if deadline is not None and time.monotonic() > deadline:
+                    raise TimeoutError(f"wall-clock limit of {ffmpeg_limits.WALL_TIMEOUT:.0f}s exceeded")
+                graph.push(frame)
+                drain()
+                if output_limit and os.path.getsize(output_path) > output_limit:
+                    raise OSError("output size limit exceeded")
+                if progress is not None and duration and frame.time is not None:
+                    progress(frame.time / duration)
+
+            graph.push(None)
+            drain()
+            for packet in out_stream.encode(None):
+                sink.mux(packet)
+        metrics.observe("pyav_render_seconds", time.monotonic() - started)
+        return True, ""
+    except RenderCancelled:
+        return False, "cancelled"
+    except Exception as e:
+        error_msg = str(e)
+        logger.error(f"PyAV render error: {error_msg}")
+        return False, error_msg
+
+
+async def render_effect(input_path, output_path, filter_chain, progress_callback=None):
+    """
+    Render an effect in a worker thread without blocking the event loop.
+
+    Args:
+        input_path (str): Path to the input audio file
+        output_path (str): Path where the processed file will be saved
+        filter_chain (str): FFmpeg filter chain to apply
+        progress_callback (callable): Optional callback (sync or async)
+            receiving the completed fraction between 0 and 1
+
+    Returns:
+        bool: True if successful, False otherwise
+        str: Error message if unsuccessful, empty string otherwise
+    """
+    import asyncio
+    from render_engine import _notify
+
+    loop = asyncio.get_running_loop()
+    cancel_event = threading.Event()
+    reported = [0.0]
+
+    def progress(fraction):
+        # Hop back onto the event loop; skip updates smaller than 1%
+        if progress_callback is None or fraction - reported[0] < 0.01:
+            return
+        reported[0] = fraction
+        loop.call_soon_threadsafe(lambda: asyncio.ensure_future(_notify(progress_callback, fraction)))
+
+    deadline = time.monotonic() + ffmpeg_limits.WALL_TIMEOUT if ffmpeg_limits.WALL_TIMEOUT > 0 else None
+    try:
+        return await asyncio.to_thread(
+            render_file, input_path, output_path, filter_chain, progress, cancel_event, deadline
+        )
+    except asyncio.CancelledError:
+        # The thread can't be killed; make it stop at the next frame
+        cancel_event.set()
+        raise
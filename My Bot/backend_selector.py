@@ -0,0 +1,239 @@
+"""
+Self-tuning choice of the render backend.
+
+An effect can often be rendered by more than one backend: an FFmpeg
+subprocess per job (always available, and the only one that splits long
+clips across cores), PyAV in-process (see av_backend) or NumPy for simple
+chains (see numpy_backend). Which is fastest depends on the effect and on
+the clip length. The selector times every render per effect, duration
+bucket and backend, and sends each job to the backend with the lowest
+render time per second of audio.
+
+Every backend is tried MIN_SAMPLES times per effect and bucket before the
+measurements are trusted, and EXPLORE_RATE of the jobs afterwards go to a
+random backend so the table follows changes in load. A backend that fails
+FAILURE_LIMIT times in a row is left out for FAILURE_COOLDOWN seconds; the
+render engine retries failed jobs on the subprocess backend, which is
+never left out.
+
+The table is kept per process; /admin/backends shows the web process's.
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+
+import metrics
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Backends the selector may use, in order of preference when untried
+BACKENDS = [name.strip() for name in os.environ.get('RENDER_BACKENDS', 'subprocess,pyav,numpy').split(',')
+            if name.strip()]
+
+# Fraction of jobs sent to a random backend once every backend is measured
+EXPLORE_RATE = float(os.environ.get('RENDER_EXPLORE_RATE', '0.05'))
+
+# Renders per effect, bucket and backend before its timing is trusted
+MIN_SAMPLES = 3
+
+# Weight of the newest render in the moving average
+EWMA_ALPHA = 0.2
+
+# Consecutive failures before a backend is left out, and for how long (seconds)
+FAILURE_LIMIT = 3
+FAILURE_COOLDOWN = 300.0
+
+# Upper bounds of the clip duration buckets (seconds); longer clips share the last bucket
+DURATION_BUCKETS = [5, 15, 60]
+
+# The fallback backend; always available and never left out
+BASELINE = "subprocess"
+
+
+def duration_bucket(duration):
+    """
+    Name the duration bucket of a clip.
+
+    Args:
+        duration (float): Clip length in seconds, or None if unknown
+
+    Returns:
+        str: e.g. "<5s", "5-15s" or "60s+"
+    """
+    if not duration:
+        return "unknown"
+    lower = 0
+    for upper in DURATION_BUCKETS:
+        if duration < upper:
+            return f"<{upper}s" if lower == 0 else f"{lower}-{upper}s"
+        lower = upper
+    return f"{lower}s+"
+
+
+class Cell:
+    """Timing of one backend for one effect and duration bucket."""
+
+    def __init__(self):
+        self.samples = 0
+        self.cost = None      # moving average of render seconds per audio second
+        self.failures = 0
+        self.failure_run = 0
+        self.disabled_until = 0.0
+
+
+class BackendSelector:
+    """Per-effect, per-duration decision table fed by live render timings."""
+
+    def __init__(self, backends=None, explore_rate=None):
+        self.backends = list(backends or BACKENDS)
+        if BASELINE not in self.backends:
+            self.backends.insert(0, BASELINE)
+        self.explore_rate = EXPLORE_RATE if explore_rate is None else explore_rate
+        self.lock = threading.Lock()
+        self.cells = {}  # (effect, bucket, backend): Cell
+
+    def candidates(self, input_path, filter_chain):
+        """
+        List the backends able to render a job.
+
+        Args:
+            input_path (str): Input audio file
+            filter_chain (str): Canonical filter chain
+
+        Returns:
+            list: Backend names, the baseline first
+        """
+        names = []
+        for name in self.backends:
+            if name == BASELINE:
+                names.insert(0, name)
+            elif name == "pyav":
+                import av_backend
+                if av_backend.AVAILABLE:
+                    names.append(name)
+            elif name == "numpy":
+                import numpy_backend
+                if numpy_backend.supports(input_path, filter_chain):
+                    names.append(name)
+        return names
+
+    def _cell(self, effect, bucket, backend):
+        key = (effect, bucket, backend)
+        cell = self.cells.get(key)
+        if cell is None:
+            cell = self.cells[key] = Cell()
+        return cell
+
+    def choose(self, effect, duration, candidates):
+        """
+        Pick the backend for a job.
+
+        Args:
+            effect (str): Effect name (or chain) the timings are kept under
+            duration (float): Clip length in seconds
+            candidates (list): Backends able to render it
+
+        Returns:
+            str: Backend name
+        """
+        bucket = duration_bucket(duration)
+        now = time.monotonic()
+        with self.lock:
+            cells = {name: self._cell(effect, bucket, name) for name in candidates}
+            usable = [name for name in candidates if name == BASELINE or cells[name].disabled_until <= now]
+            untried = [name for name in usable if cells[name].samples < MIN_SAMPLES]
+            if len(usable) == 1:
+                choice = usable[0]
+            elif untried:
+                choice = min(untried, key=lambda name: cells[name].samples)
+            elif random.random() < self.explore_rate:
+                choice = random.choice(usable)
+                metrics.increment("render_backend_explorations_total")
+            else:
+                choice = min(usable, key=lambda name: cells[name].cost)
+        metrics.increment(f"render_backend_chosen_total_{choice}")
+        return choice
+
+    def record(self, effect, duration, backend, seconds, ok):
+        """
+        Record the outcome of a render.
+
+        Args:
+            effect (str): Effect name (or chain)
+            duration (float): Clip length in seconds
+            backend (str): Backend that rendered it
+            seconds (float): Wall-clock render time
+            ok (bool): Whether the render succeeded
+        """
+        bucket = duration_bucket(duration)
+        with self.lock:
+            cell = self._cell(effect, bucket, backend)
+            if ok:
+                cost = seconds / duration if duration else seconds
+                cell.cost = cost if cell.cost is None else (1 - EWMA_ALPHA) * cell.cost + EWMA_ALPHA * cost
+                cell.samples += 1
+                cell.failure_run = 0
+            else:
+                cell.failures += 1
+                cell.failure_run += 1
+                if backend != BASELINE and cell.failure_run >= FAILURE_LIMIT:
+                    cell.disabled_until = time.monotonic() + FAILURE_COOLDOWN
+                    cell.failure_run = 0
+                    logger.warning(f"Backend {backend} failed {FAILURE_LIMIT} times on {effect} ({bucket}); "
+                                   f"leaving it out for {FAILURE_COOLDOWN:.0f}s")
+        if ok:
+            metrics.observe(f"render_seconds_{backend}", seconds)
+        else:
+            metrics.increment(f"render_backend_failures_total_{backend}")
+
+    def table(self):
+        """
+        Describe the decision table.
+
+        Returns:
+            dict: Settings and, per effect and bucket, the current choice and
+                every backend's samples, cost (render seconds per audio
+                second), failures and remaining cooldown
+        """
+        now = time.monotonic()
+        effects = {}
+        with self.lock:
+            for (effect, bucket, backend), cell in sorted(self.cells.items()):
+                row = effects.setdefault(effect, {}).setdefault(bucket, {"choice": None, "backends": {}})
+                row["backends"][backend] = {
+                    "samples": cell.samples,
+                    "cost": round(cell.cost, 4) if cell.cost is not None else None,
+                    "failures": cell.failures,
+                    "disabled_for": round(max(0.0, cell.disabled_until - now), 1),
+                }
+        for buckets in effects.values():
+            for row in buckets.values():
+                usable = {
+                    name: stats for name, stats in row["backends"].items()
+                    if name == BASELINE or not stats["disabled_for"]
+                }
+                if any(stats["samples"] < MIN_SAMPLES for stats in usable.values()) and len(usable) > 1:
+                    row["choice"] = "exploring"
+                elif usable:
+                    row["choice"] = min(
+                        usable, key=lambda name: usable[name]["cost"] if usable[name]["cost"] is not None else float("inf")
+                    )
+        return {
+            "backends": self.backends,
+            "explore_rate": self.explore_rate,
+            "min_samples": MIN_SAMPLES,
+            "duration_buckets": DURATION_BUCKETS,
+            "effects": effects,
+        }
+
+
+# Process-wide selector
+selector = BackendSelector()
@@ -0,0 +1,121 @@
+"""
+Benchmark the render backends against each other.
+
+Renders a synthetic voice note with every selected effect on each backend
+and reports per-job latency percentiles and throughput.
+
+Usage:
+    python bench_render.py --duration 3 --iterations 5 --backends subprocess,pyav
+"""
+
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import metrics
+import render_engine
+from voice_effects import VOICE_EFFECTS
+
+
+def make_input(path, duration):
+    """Write a 48 kHz Opus test clip: a tone with a little noise, like speech-band audio."""
+    subprocess.run([
+        "ffmpeg", "-y", "-f", "lavfi", "-i", f"sine=frequency=220:sample_rate=48000:duration={duration}",
+        "-f", "lavfi", "-i", f"anoisesrc=color=pink:amplitude=0.05:sample_rate=48000:duration={duration}",
+        "-filter_complex", "amix=inputs=2", "-ac", "1", "-c:a", "libopus", path
+    ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+
+
+async def run_backend(backend, input_path, work_dir, effects, iterations, concurrency):
+    """
+    Render every effect iterations times on one backend.
+
+    Returns:
+        dict: Latencies per effect, failure count and total wall time
+    """
+    render_engine.RENDER_BACKEND = backend
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = {name: [] for name in effects}
+    failures = []
+
+    async def job(index, name):
+        output_path = os.path.join(work_dir, f"{backend}_{index}.ogg")
+        async with semaphore:
+            started = time.perf_counter()
+            success, error_msg = await render_engine.render_effect(
+                input_path, output_path, VOICE_EFFECTS[name], effect=name
+            )
+            elapsed = time.perf_counter() - started
+        if success:
+            latencies[name].append(elapsed)
+        else:
+            failures.append((name, (error_msg.strip().splitlines() or [""])[-1]))
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+    started = time.perf_counter()
+    jobs = [(name, iteration) for iteration in range(iterations) for name in effects]
+    await asyncio.gather(*(job(index, name) for index, (name, _) in enumerate(jobs)))
+    return {"latencies": latencies, "failures": failures, "wall": time.perf_counter() - started}
+
+
+def report(backend, result, per_effect=False):
+    """Print one backend's results."""
+    values = [value for values in result["latencies"].values() for value in values]
+    completed = len(values)
+    print(f"\n{backend}")
+    print(f"  jobs: {completed} ok, {len(result['failures'])} failed, {result['wall']:.2f}s wall, "
+          f"{completed / result['wall']:.1f} jobs/s")
+    if values:
+        print(f"  latency: mean {sum(values) / completed * 1000:.1f} ms, "
+              f"p50 {metrics.percentile(values, 0.5) * 1000:.1f} ms, "
+              f"p95 {metrics.percentile(values, 0.95) * 1000:.1f} ms, "
+              f"max {max(values) * 1000:.1f} ms")
+    if per_effect:
+        for name, effect_values in result["latencies"].items():
+            if effect_values:
+                print(f"    {name:<12} p50 {metrics.percentile(effect_values, 0.5) * 1000:8.1f} ms")
+    for name, error in result["failures"][:5]:
+        print(f"    failed: {name}: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the subprocess and PyAV render backends")
+    parser.add_argument("--duration", type=float, default=3.0, help="test clip length in seconds")
+    parser.add_argument("--iterations", type=int, default=5, help="renders per effect and backend")
+    parser.add_argument("--concurrency", type=int, default=1, help="renders running at once")
+    parser.add_argument("--backends", default="subprocess,pyav", help="comma separated backends (subprocess, pyav, auto)")
+    parser.add_argument("--effects", default=",".join(VOICE_EFFECTS), help="comma separated effect names")
+    parser.add_argument("--per-effect", action="store_true", help="print the median of every effect")
+    args = parser.parse_args()
+
+    backends = [backend.strip() for backend in args.backends.split(",") if backend.strip()]
+    if "pyav" in backends:
+        import av_backend
+        if not av_backend.AVAILABLE:
+            print("PyAV is not installed; skipping the pyav backend", file=sys.stderr)
+            backends.remove("pyav")
+    effects = [name.strip() for name in args.effects.split(",") if name.strip() in VOICE_EFFECTS]
+
+    work_dir = tempfile.mkdtemp(prefix="bench_render_")
+    try:
+        input_path = os.path.join(work_dir, "input.ogg")
+        make_input(input_path, args.duration)
+        print(f"{len(effects)} effects x {args.iterations} iterations on a {args.duration:g}s clip, "
+              f"concurrency {args.concurrency}")
+        for backend in backends:
+            result = asyncio.run(run_backend(
+                backend, input_path, work_dir, effects, args.iterations, args.concurrency
+            ))
+            report(backend, result, args.per_effect)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Benchmark the bot's cold start.
+
+Each run queues a /start command on a fresh FakeTelegram, then starts
+simple_bot.main in a new process and measures two intervals from the moment
+the process is spawned: until the bot first polls for updates, and until it
+answers the command (time to first update handled). Together they are what
+the first user after a scale-up waits for.
+
+Usage:
+    python bench_startup.py --runs 5 [--cold] [--importtime]
+"""
+
+import os
+import sys
+import time
+import argparse
+import threading
+import subprocess
+
+import metrics
+import effect_index
+import ffmpeg_catalog
+from fake_telegram import FakeTelegram
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+USER_ID = 4242
+
+
+def start_once(log_path, cold=False, importtime=False, timeout=60.0):
+    """
+    Start the bot once and time its way to the first answered update.
+
+    Args:
+        log_path (str): File receiving the bot's output
+        cold (bool): Delete the start-up caches first
+        importtime (bool): Run the bot with -X importtime
+
+    Returns:
+        dict: "ready" and "first_update" seconds since spawn (None if not reached)
+    """
+    if cold:
+        for path in (effect_index.INDEX_CACHE, ffmpeg_catalog.CACHE_FILE):
+            if path and os.path.exists(os.path.join(BOT_DIR, path)):
+                os.remove(os.path.join(BOT_DIR, path))
+
+    fake = FakeTelegram().start()
+    answered = threading.Event()
+    timings = {"ready": None, "first_update": None}
+
+    def on_call(method, params, result):
+        if method == "sendMessage" and str(params.get("chat_id")) == str(USER_ID) and not answered.is_set():
+            timings["first_update"] = time.perf_counter() - spawned
+            answered.set()
+
+    fake.listeners.append(on_call)
+    fake.queue_update(fake.make_command_update(USER_ID, "/start"))
+
+    env = dict(os.environ)
+    env.update({
+        "TELEGRAM_BOT_TOKEN": "123456:FAKE",
+        "TELEGRAM_API_BASE_URL": fake.base_url,
+        "TELEGRAM_API_BASE_FILE_URL": fake.base_file_url,
+    })
+    if importtime:
+        env["PYTHONPROFILEIMPORTTIME"] = "1"
+    log = open(log_path, "w")
+    spawned = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-c", "import simple_bot; simple_bot.main()"],
+        cwd=BOT_DIR, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    try:
+        deadline = spawned + timeout
+        while timings["ready"] is None and time.perf_counter() < deadline and process.poll() is None:
+            if fake.calls_to("getUpdates"):
+                timings["ready"] = time.perf_counter() - spawned
+            else:
+                time.sleep(0.005)
+        answered.wait(max(0.0, deadline - time.perf_counter()))
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        log.close()
+        fake.stop()
+    return timings
+
+
+def slowest_imports(log_path, count=15):
+    """
+    Read -X importtime output and return the slowest top-level imports.
+
+    Returns:
+        list: (cumulative seconds, module) pairs, slowest first
+    """
+    imports = []
+    with open(log_path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if not line.startswith("import time:"):
+                continue
+            parts = line.split("|")
+            if len(parts) != 3 or parts[2].startswith("  "):
+                continue
+            try:
+                imports.append((int(parts[1]) / 1e6, parts[2].strip()))
+            except ValueError:
+                continue
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the bot's time to first handled update")
+    parser.add_argument("--runs", type=int, default=5, help="bot starts to measure")
+    parser.add_argument("--cold", action="store_true", help="delete the start-up caches before every run")
+    parser.add_argument("--importtime", action="store_true", help="print the slowest imports of the first run")
+    parser.add_argument("--log", default="bench_startup_bot.log", help="bot output")
+    args = parser.parse_args()
+
+    ready, first = [], []
+    for run in range(args.runs):
+        timings = start_once(args.log, args.cold, args.importtime and run == 0)
+        if timings["first_update"] is None:
+            print(f"run {run + 1}: no answer to /start; see {args.log}", file=sys.stderr)
+            sys.exit(1)
+        ready.append(timings["ready"] or timings["first_update"])
+        first.append(timings["first_update"])
+        print(f"run {run + 1}: polling after {ready[-1] * 1000:.0f} ms, first update handled after "
+              f"{first[-1] * 1000:.0f} ms")
+        if args.importtime and run == 0:
+            print(f"\n{'import':<40} {'cumulative ms':>14}")
+            for seconds, module in slowest_imports(args.log):
+                print(f"{module:<40} {seconds * 1000:>14.1f}")
+            print()
+
+    print(f"\n{'interval':<22} {'p50 ms':>9} {'min ms':>9} {'max ms':>9}")
+    for name, values in (("spawn -> polling", ready), ("spawn -> first update", first)):
+        print(f"{name:<22} {metrics.percentile(values, 0.5) * 1000:>9.1f} {min(values) * 1000:>9.1f} "
+              f"{max(values) * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import asyncio
 import logging
 import subprocess
 import tempfile
@@ -6,7 +7,11 @@ import shutil
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from voice_effects import get_effect_page, get_total_pages, VOICE_EFFECTS
-from utils import ensure_temp_dir, apply_audio_effect, apply_voice_clone_effect
+from utils import ensure_temp_dir, apply_voice_clone_effect, make_progress_editor
+from render_engine import render_effect, STALLED_ERROR
+from response_composer import ResponseComposer
+import send_queue
+import ffmpeg_limits
 
 # Configure logging
 logging.basicConfig(
@@ -22,14 +27,15 @@ user_voices = {}      # user_id: cloned voice path
 user_voice_names = {} # user_id: custom voice name
 user_states = {}      # user_id: current state (e.g., "awaiting_clone", "awaiting_voice_name")
 
-# Create temp directory
+# Create temp directory (leftovers are deleted in the background)
 TEMP_DIR = "temp_audio"
-ensure_temp_dir(TEMP_DIR)
+ensure_temp_dir(TEMP_DIR, background=True)
 
 # Start command
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send a welcome message when the command /start is issued."""
-    await update.message.reply_text(
+    await send_queue.reply_text(
+        update.message,
         "🎙️ *Welcome to Voice Effects Bot!* 🎙️\n\n"
         "Send or forward me a voice/audio message, and I'll give you multiple voice effects to apply!\n\n"
         "I can transform your voice into chipmunk, robot, echo and many more effects using FFmpeg technology.\n\n"
@@ -62,12 +68,12 @@ async def handle_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
             file_id = message.audio.file_id
             duration = message.audio.duration
         else:
-            await message.reply_text("❌ Please send a voice or audio message.")
+            await send_queue.reply_text(message, "❌ Please send a voice or audio message.")
             return
         
         # Check if audio is too long (>60 seconds)
         if duration > 60:
-            await message.reply_text("⚠️ Audio is too long. Please send audio under 60 seconds for processing.")
+            await send_queue.reply_text(message, "⚠️ Audio is too long. Please send audio under 60 seconds for processing.")
             return
             
         # Download the file
@@ -81,7 +87,7 @@ async def handle_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
     except Exception as e:
         logger.error(f"Error in handle_audio: {str(e)}")
-        await message.reply_text("❌ An error occurred while processing your audio. Please try again.")
+        await send_queue.reply_text(message, "❌ An error occurred while processing your audio. Please try again.")
 
 # Show effect options with pagination
 async def show_effect_keyboard(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id, page=0):
@@ -121,13 +127,18 @@ async def show_effect_keyboard(update: Update, context: ContextTypes.DEFAULT_TYP
     # Store current page
     user_pages[user_id] = page
     
-    if update.callback_query:
-        await update.callback_query.edit_message_text(
+    query = update.callback_query
+    if query and query.message and query.message.text:
+        await send_queue.edit_message_text(
+            query,
             "🎛️ Choose a voice effect to apply:",
             reply_markup=reply_markup
         )
     else:
-        await update.message.reply_text(
+        # "Apply another effect" sits on a voice message, which has no text to
+        # edit, so the menu comes as a new message
+        await send_queue.reply_text(
+            query.message if query else update.message,
             "🎛️ Choose a voice effect to apply:",
             reply_markup=reply_markup
         )
@@ -164,108 +175,100 @@ async def handle_effect_selection(update: Update, context: ContextTypes.DEFAULT_
         if callback_data.startswith("effect:"):
             effect = callback_data.split(":")[1]
             input_path = user_audio.get(user_id)
+            composer = ResponseComposer(query, context.bot, user_id)
+            composer.api_calls = 1  # answerCallbackQuery above
             
             if not input_path:
-                await query.edit_message_text("❌ No audio found. Please send or forward a voice message first.")
+                await composer.edit("❌ No audio found. Please send or forward a voice message first.")
                 return
             
-            # Check if this is the cloned voice effect
-            if effect == "cloned":
-                # Check if user has a cloned voice
-                if user_id not in user_voices:
-                    await query.edit_message_text("❌ You haven't cloned your voice yet. Use the /clone command first.")
-                    return
-                    
-                voice_name = user_voice_names.get(user_id, "My Voice")
-                # Show processing message
-                await query.edit_message_text(f"⏳ Processing with *{voice_name}* effect...", parse_mode="Markdown")
-                
-                try:
-                    output_path = os.path.join(TEMP_DIR, f"output_{user_id}.ogg")
-                    cloned_voice_path = user_voices[user_id]
-                    
-                    # Apply voice cloning effect
-                    success, error_msg = apply_voice_clone_effect(input_path, output_path, cloned_voice_path)
-                    
-                    if not success:
-                        logger.error(f"Error applying cloned voice effect: {error_msg}")
-                        await query.edit_message_text("❌ Error applying your cloned voice. Please try again.")
+            # Offer further effects directly on the voice message
+            keyboard = [[InlineKeyboardButton("Apply another effect", callback_data="page:reset")]]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            output_path = os.path.join(TEMP_DIR, f"output_{user_id}.ogg")
+            
+            try:
+                # Check if this is the cloned voice effect
+                if effect == "cloned":
+                    # Check if user has a cloned voice
+                    if user_id not in user_voices:
+                        await composer.edit("❌ You haven't cloned your voice yet. Use the /clone command first.")
                         return
+                        
+                    voice_name = user_voice_names.get(user_id, "My Voice")
                     
-                    # Update message and send the processed audio
-                    await query.edit_message_text(f"✅ Applied *{voice_name}* effect!", parse_mode="Markdown")
-                    
-                    # Send the processed audio
-                    with open(output_path, 'rb') as audio_file:
-                        await context.bot.send_voice(
-                            chat_id=user_id,
-                            voice=audio_file,
-                            caption=f"🎧 Your voice with *{voice_name}* effect.",
-                            parse_mode="Markdown"
+                    try:
+                        cloned_voice_path = user_voices[user_id]
+                        
+                        # Apply voice cloning effect off the event loop
+                        success, error_msg = await composer.render(
+                            f"⏳ Processing with *{voice_name}* effect...",
+                            asyncio.to_thread(apply_voice_clone_effect, input_path, output_path, cloned_voice_path)
                         )
-                    
-                    # Prompt for additional effects
-                    keyboard = [[InlineKeyboardButton("Apply another effect", callback_data="page:reset")]]
-                    reply_markup = InlineKeyboardMarkup(keyboard)
-                    await context.bot.send_message(
-                        chat_id=user_id,
-                        text="Would you like to apply another effect to your original audio?",
-                        reply_markup=reply_markup
-                    )
-                    
-                except Exception as e:
-                    logger.error(f"Error applying cloned voice effect: {str(e)}")
-                    await query.edit_message_text("❌ Error applying your cloned voice. Please try again.")
-                    return
-                    
-            else:
-                # Regular voice effect
-                # Show processing message
-                await query.edit_message_text(f"⏳ Processing with *{effect}* effect...", parse_mode="Markdown")
-                
-                try:
-                    output_path = os.path.join(TEMP_DIR, f"output_{user_id}.ogg")
-                    
-                    # Apply effect using our utility function
-                    filter_cmd = VOICE_EFFECTS.get(effect, "")
-                    success, error_msg = apply_audio_effect(input_path, output_path, filter_cmd)
-                    
-                    if not success:
-                        logger.error(f"Error applying effect: {error_msg}")
-                        await query.edit_message_text(f"❌ Error applying effect. Please try again or choose another effect.")
+                        
+                        if not success:
+                            logger.error(f"Error applying cloned voice effect: {error_msg}")
+                            await composer.edit("❌ Error applying your cloned voice. Please try again.")
+                            return
+                        
+                        # Update message and send the processed audio in one round trip
+                        await composer.deliver(
+                            f"✅ Applied *{voice_name}* effect!",
+                            output_path,
+                            f"🎧 Your voice with *{voice_name}* effect.",
+                            reply_markup
+                        )
+                        
+                    except Exception as e:
+                        logger.error(f"Error applying cloned voice effect: {str(e)}")
+                        await composer.edit("❌ Error applying your cloned voice. Please try again.")
                         return
+                        
+                else:
+                    # Regular voice effect
+                    status_text = f"⏳ Processing with *{effect}* effect..."
                     
-                    # Update message and send the processed audio
-                    await query.edit_message_text(f"✅ Applied *{effect}* effect!", parse_mode="Markdown")
-                    
-                    # Send the processed audio
-                    with open(output_path, 'rb') as audio_file:
-                        await context.bot.send_voice(
-                            chat_id=user_id,
-                            voice=audio_file,
-                            caption=f"🎧 Your voice with *{effect}* effect.",
-                            parse_mode="Markdown"
+                    try:
+                        # Apply effect using the render engine
+                        filter_cmd = VOICE_EFFECTS.get(effect, "")
+                        success, error_msg = await composer.render(status_text, render_effect(
+                            input_path, output_path, filter_cmd,
+                            progress_callback=make_progress_editor(composer.edit_progress, status_text)
+                        ))
+                        
+                        if not success:
+                            logger.error(f"Error applying effect: {error_msg}")
+                            if error_msg.startswith(STALLED_ERROR):
+                                await composer.edit("⚠️ Rendering stalled and was stopped. Please try again or choose another effect.")
+                            else:
+                                await composer.edit(f"❌ Error applying effect. Please try again or choose another effect.")
+                            return
+                        
+                        # Update message and send the processed audio in one round trip
+                        await composer.deliver(
+                            f"✅ Applied *{effect}* effect!",
+                            output_path,
+                            f"🎧 Your voice with *{effect}* effect.",
+                            reply_markup
                         )
-                    
-                    # Prompt for additional effects
-                    keyboard = [[InlineKeyboardButton("Apply another effect", callback_data="page:reset")]]
-                    reply_markup = InlineKeyboardMarkup(keyboard)
-                    await context.bot.send_message(
-                        chat_id=user_id,
-                        text="Would you like to apply another effect to your original audio?",
-                        reply_markup=reply_markup
-                    )
-                except Exception as e:
-                    logger.error(f"Error applying effect: {str(e)}")
-                    await query.edit_message_text("❌ Error applying effect. Please try again or choose another effect.")
-                    return
+                    except Exception as e:
+                        logger.error(f"Error applying effect: {str(e)}")
+                        await composer.edit("❌ Error applying effect. Please try again or choose another effect.")
+                        return
+            finally:
+                composer.finish()
     
     except Exception as e:
         logger.error(f"Error in handle_effect_selection: {str(e)}")
+        error_text = "❌ An error occurred while processing your audio. Please try again."
+        query = update.callback_query
         try:
-            await update.callback_query.edit_message_text("❌ An error occurred while processing your audio. Please try again.")
-        except Exception:
-            pass
+            if query.message and query.message.text:
+                await send_queue.edit_message_text(query, error_text)
+            else:
+                await send_queue.reply_text(query.message, error_text)
+        except Exception as e:
+            logger.error(f"Could not report the error to the user: {str(e)}")
     
 # Function to rename cloned voice
 async def rename_clone(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -274,7 +277,8 @@ async def rename_clone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Check if user has a cloned voice
     if user_id not in user_voices:
-        await update.message.reply_text(
+        await send_queue.reply_text(
+            update.message,
             "❌ You haven't cloned your voice yet. Use the /clone command first.",
             parse_mode="Markdown"
         )
@@ -282,7 +286,8 @@ async def rename_clone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Check if command has arguments
     if not context.args:
-        await update.message.reply_text(
+        await send_queue.reply_text(
+            update.message,
             "Please provide a name for your voice.\n\n"
             "Example: `/rename Cool Voice`",
             parse_mode="Markdown"
@@ -299,7 +304,8 @@ async def rename_clone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Save the new voice name
     user_voice_names[user_id] = new_name
     
-    await update.message.reply_text(
+    await send_queue.reply_text(
+        update.message,
         f"✅ Voice name updated to *{new_name}*!\n\n"
         "Your cloned voice will appear with this name in the effects menu.",
         parse_mode="Markdown"
@@ -311,7 +317,8 @@ async def clone_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
     user_states[user_id] = "awaiting_clone"
     
-    await update.message.reply_text(
+    await send_queue.reply_text(
+        update.message,
         "🎤 *Voice Cloning Initiated* 🎤\n\n"
         "Please send a short voice message (5-10 seconds) with clear speech.\n\n"
         "I'll use this sample to clone your voice for the /say command and add it to your voice effects.",
@@ -327,16 +334,16 @@ async def handle_clone_audio(update: Update, context: ContextTypes.DEFAULT_TYPE)
         
         # Verify we have a voice message
         if not message.voice:
-            await message.reply_text("❌ Please send a *voice message* (not audio file) for cloning.", parse_mode="Markdown")
+            await send_queue.reply_text(message, "❌ Please send a *voice message* (not audio file) for cloning.", parse_mode="Markdown")
             return
         
         # Check voice duration (ideally 5-10 seconds)
         duration = message.voice.duration
         if duration < 3:
-            await message.reply_text("⚠️ Voice sample is too short. Please send a sample of at least 3 seconds.", parse_mode="Markdown")
+            await send_queue.reply_text(message, "⚠️ Voice sample is too short. Please send a sample of at least 3 seconds.", parse_mode="Markdown")
             return
         if duration > 30:
-            await message.reply_text("⚠️ Voice sample is too long. Please keep it under 30 seconds for better results.", parse_mode="Markdown")
+            await send_queue.reply_text(message, "⚠️ Voice sample is too long. Please keep it under 30 seconds for better results.", parse_mode="Markdown")
             return
         
         # Download the voice sample
@@ -350,7 +357,8 @@ async def handle_clone_audio(update: Update, context: ContextTypes.DEFAULT_TYPE)
         user_voice_names[user_id] = f"My Voice"
         user_states[user_id] = "awaiting_voice_name"
         
-        await message.reply_text(
+        await send_queue.reply_text(
+            message,
             "✅ *Voice sample recorded successfully!* ✅\n\n"
             "Now, please give your cloned voice a name. This name will appear in the effects menu.\n\n"
             "Reply with a name like 'Robot Me' or 'Deep Voice'.\n\n"
@@ -360,7 +368,7 @@ async def handle_clone_audio(update: Update, context: ContextTypes.DEFAULT_TYPE)
         
     except Exception as e:
         logger.error(f"Error in handle_clone_audio: {str(e)}")
-        await message.reply_text("❌ An error occurred while cloning your voice. Please try again.")
+        await send_queue.reply_text(message, "❌ An error occurred while cloning your voice. Please try again.")
         user_states[user_id] = None
 
 # Handle voice naming
@@ -386,7 +394,8 @@ async def handle_voice_naming(update: Update, context: ContextTypes.DEFAULT_TYPE
     # Reset state
     user_states[user_id] = None
     
-    await message.reply_text(
+    await send_queue.reply_text(
+        message,
         f"✅ *Voice name set to '{voice_name}'!* ✅\n\n"
         "Your cloned voice has been added to the effects menu. You can apply it to any voice message.\n\n"
         "You can also use */say <text>* to make me speak text using your cloned voice.\n\n"
@@ -401,7 +410,8 @@ async def skip_voice_naming(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Check if the user is in the voice naming state
     if user_states.get(user_id) != "awaiting_voice_name":
-        await update.message.reply_text(
+        await send_queue.reply_text(
+            update.message,
             "❓ You're not currently naming a voice. Use /clone to clone your voice first.",
             parse_mode="Markdown"
         )
@@ -410,7 +420,8 @@ async def skip_voice_naming(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Reset state
     user_states[user_id] = None
     
-    await update.message.reply_text(
+    await send_queue.reply_text(
+        update.message,
         "✅ *Default voice name 'My Voice' will be used* ✅\n\n"
         "Your cloned voice has been added to the effects menu. You can apply it to any voice message.\n\n"
         "You can also use */say <text>* to make me speak text using your cloned voice.\n\n"
@@ -426,7 +437,8 @@ async def say_with_cloned_voice(update: Update, context: ContextTypes.DEFAULT_TY
         
         # Check if the user has cloned their voice
         if user_id not in user_voices:
-            await update.message.reply_text(
+            await send_queue.reply_text(
+                update.message,
                 "⚠️ You haven't cloned your voice yet.\n\n"
                 "Use the */clone* command first, then send a voice message.",
                 parse_mode="Markdown"
@@ -435,7 +447,8 @@ async def say_with_cloned_voice(update: Update, context: ContextTypes.DEFAULT_TY
         
         # Check if text is provided
         if not context.args:
-            await update.message.reply_text(
+            await send_queue.reply_text(
+                update.message,
                 "📝 Please provide some text to speak.\n\n"
                 "Example: `/say Hello, this is my cloned voice`",
                 parse_mode="Markdown"
@@ -446,14 +459,16 @@ async def say_with_cloned_voice(update: Update, context: ContextTypes.DEFAULT_TY
         
         # Limit text length
         if len(text) > 200:
-            await update.message.reply_text(
+            await send_queue.reply_text(
+                update.message,
                 "⚠️ Text is too long. Please limit your message to 200 characters.",
                 parse_mode="Markdown"
             )
             return
         
         # Send "processing" message
-        processing_message = await update.message.reply_text(
+        processing_message = await send_queue.reply_text(
+            update.message,
             "🔄 *Processing your text-to-speech request...*\n\n"
             "This may take a few seconds.",
             parse_mode="Markdown"
@@ -464,14 +479,15 @@ async def say_with_cloned_voice(update: Update, context: ContextTypes.DEFAULT_TY
         
         # For this simplified version, we'll generate a 2-second silent audio
         # In a real implementation, this would be replaced with actual TTS + voice cloning
-        subprocess.run([
+        await asyncio.to_thread(ffmpeg_limits.run, [
             "ffmpeg", "-y", "-f", "lavfi", "-i", "anullsrc", "-t", "2",
             "-q:a", "9", "-acodec", "libopus", output_path
         ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         
         # Update the processing message
-        await context.bot.edit_message_text(
-            chat_id=update.effective_chat.id,
+        await send_queue.bot_edit_message_text(
+            context.bot,
+            update.effective_chat.id,
             message_id=processing_message.message_id,
             text="✅ *Text-to-speech generated!*",
             parse_mode="Markdown"
@@ -479,7 +495,8 @@ async def say_with_cloned_voice(update: Update, context: ContextTypes.DEFAULT_TY
         
         # Send the voice message with the text
         with open(output_path, "rb") as audio_file:
-            await update.message.reply_voice(
+            await send_queue.reply_voice(
+                update.message,
                 voice=audio_file,
                 caption=f"🗣️ *Your cloned voice saying:*\n\n{text}",
                 parse_mode="Markdown"
@@ -491,4 +508,4 @@ async def say_with_cloned_voice(update: Update, context: ContextTypes.DEFAULT_TY
             
     except Exception as e:
         logger.error(f"Error in say_with_cloned_voice: {str(e)}")
-        await update.message.reply_text("❌ An error occurred while generating speech. Please try again.")
+        await send_queue.reply_text(update.message, "❌ An error occurred while generating speech. Please try again.")
@@ -0,0 +1,175 @@
+"""
+Concurrent update processing with per-user ordering.
+
+Updates from different users are handled concurrently, while updates from
+the same user wait for each other, so a clone upload and the next voice
+note of one user can never race on the shared per-user dictionaries.
+"""
+
+import os
+import asyncio
+import logging
+
+from telegram.ext import ApplicationBuilder, BaseUpdateProcessor
+
+import tracing
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Maximum updates processed at once; 0 keeps the sequential default
+CONCURRENT_UPDATES = int(os.environ.get('BOT_CONCURRENT_UPDATES', '64'))
+
+# HTTP connection pool for Bot API requests (should cover the updates in
+# flight plus the outbound send queue)
+CONNECTION_POOL_SIZE = int(os.environ.get('BOT_CONNECTION_POOL_SIZE', '32'))
+
+# Seconds to wait for a free pooled connection before failing a request
+POOL_TIMEOUT = float(os.environ.get('BOT_POOL_TIMEOUT', '10'))
+
+# Alternative Bot API endpoint, e.g. the local fake_telegram server
+API_BASE_URL = os.environ.get('TELEGRAM_API_BASE_URL')
+API_BASE_FILE_URL = os.environ.get('TELEGRAM_API_BASE_FILE_URL')
+
+
+def update_key(update):
+    """
+    Return the key that serialises an update: the user, else the chat.
+
+    Inline queries only read cached variants and must be answered within
+    Telegram's inline timeout, so they never wait behind a user's renders.
+
+    Args:
+        update (Update): Incoming Telegram update
+
+    Returns:
+        int: User or chat id, or None for inline queries and updates without either
+    """
+    if getattr(update, "inline_query", None) is not None:
+        return None
+    if getattr(update, "effective_user", None) is not None:
+        return update.effective_user.id
+    if getattr(update, "effective_chat", None) is not None:
+        return update.effective_chat.id
+    return None
+
+
+def update_kind(update):
+    """Return the name of the update's payload, e.g. "message" or "callback_query"."""
+    for kind in ("callback_query", "inline_query", "message", "edited_message", "channel_post"):
+        if getattr(update, kind, None) is not None:
+            return kind
+    return "update"
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates concurrently, one at a time per user.
+
+    An update first waits for its user's earlier updates and only then for
+    one of the max_concurrent_updates slots, so updates queued behind their
+    own user hold no slot and one user tapping many buttons can't starve
+    everyone else.
+    """
+
+    def __init__(self, max_concurrent_updates, on_arrival=None):
+        """
+        Args:
+            max_concurrent_updates (int): Updates processed at once
+            on_arrival (callable): Called with each update before it waits
+                for the user's earlier updates, e.g. to cancel stale work
+        """
+        super().__init__(max_concurrent_updates)
+        self._locks = {}  # key: [asyncio.Lock, number of holders and waiters]
+        self.active_updates = 0
+        self.on_arrival = on_arrival
+
+    async def process_update(self, update, coroutine):
+        # The base class takes a slot before calling do_process_update, which
+        # would let updates waiting for their user's lock hold every slot;
+        # do_process_update takes the slot itself once the lock is held
+        await self.do_process_update(update, coroutine)
+
+    async def do_process_update(self, update, coroutine):
+        self.active_updates += 1
+        key = update_key(update)
+        # Every update gets its own trace; handler stages become its spans
+        user = getattr(update, "effective_user", None)
+        with tracing.trace(update_kind(update), user_id=user.id if user is not None else (key or 0)):
+            try:
+                if self.on_arrival is not None:
+                    try:
+                        self.on_arrival(update)
+                    except Exception as e:
+                        logger.error(f"Update arrival hook failed: {str(e)}")
+                if key is None:
+                    async with self._semaphore:
+                        await coroutine
+                    return
+
+                entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+                entry[1] += 1
+                try:
+                    # asyncio.Lock wakes waiters in FIFO order, preserving arrival order
+                    with tracing.span("user_lock_wait"):
+                        await entry[0].acquire()
+                    try:
+                        with tracing.span("slot_wait"):
+                            await self._semaphore.acquire()
+                        try:
+                            await coroutine
+                        finally:
+                            self._semaphore.release()
+                    finally:
+                        entry[0].release()
+                finally:
+                    entry[1] -= 1
+                    if entry[1] == 0:
+                        del self._locks[key]
+            finally:
+                self.active_updates -= 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+def build_application(token, concurrent_updates=None, pool_size=None, on_arrival=None):
+    """
+    Build the bot Application with the configured dispatcher mode.
+
+    Args:
+        token (str): Telegram bot token
+        concurrent_updates (int): Updates processed at once, 0 for sequential
+        pool_size (int): HTTP connection pool size
+        on_arrival (callable): Hook called with each update as it arrives
+            (concurrent mode only)
+
+    Returns:
+        Application: The configured, not yet running application
+    """
+    concurrent_updates = CONCURRENT_UPDATES if concurrent_updates is None else concurrent_updates
+    pool_size = pool_size or CONNECTION_POOL_SIZE
+
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        .connection_pool_size(pool_size)
+        .pool_timeout(POOL_TIMEOUT)
+    )
+    if API_BASE_URL:
+        builder = builder.base_url(API_BASE_URL)
+    if API_BASE_FILE_URL:
+        builder = builder.base_file_url(API_BASE_FILE_URL)
+    if concurrent_updates > 0:
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(concurrent_updates, on_arrival))
+        logger.info(f"Processing up to {concurrent_updates} updates concurrently (ordered per user)")
+    else:
+        logger.info("Processing updates sequentially")
+    return builder.build()
@@ -0,0 +1,210 @@
+"""
+Search index over the effect catalog for inline queries.
+
+Inline answers have to come back well within Telegram's timeout, so the
+query path only does dictionary lookups: a prefix table over the words of
+every effect name and category answers what users type most ("chip",
+"deep", "anim"), and a trigram table catches typos ("chipmonk"). Both are
+built once at start-up.
+
+Categories are the comment groups of the VOICE_EFFECTS dict in
+simple_bot.py ("# Animal-like effects" and so on), read from the source so
+the catalog stays defined in one place.
+
+load_index keeps the built index in a cache file, keyed by the catalog
+source and this module, so a cold start unpickles it instead of parsing and
+indexing again.
+"""
+
+import os
+import re
+import pickle
+import hashlib
+import logging
+from collections import defaultdict
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Longest prefix stored per word; longer queries still match through trigrams
+MAX_PREFIX = 12
+
+# Least trigram similarity for a fuzzy match
+MIN_SIMILARITY = 0.3
+
+# Cache file for the built index (empty disables caching)
+INDEX_CACHE = os.environ.get('EFFECT_INDEX_CACHE', '.effect_index.pickle')
+
+_CATEGORY_COMMENT = re.compile(r"^\s*#\s*(.+?)\s*$")
+_EFFECT_KEY = re.compile(r"^\s*[\"']([^\"']+)[\"']\s*:")
+_WORD = re.compile(r"[a-z]+|[0-9]+")
+
+
+def categories_from_source(path, dict_name="VOICE_EFFECTS"):
+    """
+    Read effect categories from the comments grouping a dict literal.
+
+    Args:
+        path (str): Python source file
+        dict_name (str): Name of the dict literal
+
+    Returns:
+        dict: effect name: category ("" before the first comment)
+    """
+    categories = {}
+    category = ""
+    inside = False
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not inside:
+                inside = line.startswith(f"{dict_name} = {{")
+                continue
+            if line.startswith("}"):
+                break
+            comment = _CATEGORY_COMMENT.match(line)
+            if comment:
+                # "Animal-like effects" -> "Animal-like"; "(expanding to 100)" notes dropped
+                text = re.sub(r"\(.*?\)", "", comment.group(1))
+                category = re.sub(r"\s*effects?\s*$", "", text.strip(), flags=re.IGNORECASE).strip()
+                continue
+            key = _EFFECT_KEY.match(line)
+            if key:
+                categories[key.group(1)] = category
+    return categories
+
+
+def words(text):
+    """Split text into lowercase search words ("custom_2" -> ["custom", "2"])."""
+    return _WORD.findall(text.lower())
+
+
+def trigrams(text):
+    """Return the padded character trigrams of a word."""
+    padded = f"  {text.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class EffectIndex:
+    """Prefix and trigram index over effect names and their categories."""
+
+    def __init__(self, names, categories=None):
+        """
+        Args:
+            names (iterable): Effect names, in catalog order
+            categories (dict): effect name: category
+        """
+        self.names = list(names)
+        self.categories = dict(categories or {})
+        self.order = {name: position for position, name in enumerate(self.names)}
+        self.prefixes = defaultdict(dict)  # prefix: {name: score}
+        self.grams = defaultdict(set)      # trigram: {word}
+        self.word_names = defaultdict(dict)  # word: {name: score}
+
+        for name in self.names:
+            fields = [(words(name), 2.0), (words(self.categories.get(name, "")), 1.0)]
+            for field_words, weight in fields:
+                for word in field_words:
+                    self.word_names[word][name] = max(self.word_names[word].get(name, 0.0), weight)
+                    for length in range(1, min(len(word), MAX_PREFIX) + 1):
+                        # Whole-word matches rank above prefixes of longer words
+                        score = weight + (0.5 if length == len(word) else 0.0)
+                        entry = self.prefixes[word[:length]]
+                        entry[name] = max(entry.get(name, 0.0), score)
+        for word in self.word_names:
+            for gram in trigrams(word):
+                self.grams[gram].add(word)
+
+    def _fuzzy(self, term):
+        # Words sharing enough trigrams with the term, scored by Jaccard similarity
+        term_grams = trigrams(term)
+        shared = defaultdict(int)
+        for gram in term_grams:
+            for word in self.grams.get(gram, ()):
+                shared[word] += 1
+        scores = {}
+        for word, count in shared.items():
+            similarity = count / len(term_grams | trigrams(word))
+            if similarity >= MIN_SIMILARITY:
+                for name, weight in self.word_names[word].items():
+                    scores[name] = max(scores.get(name, 0.0), weight * similarity)
+        return scores
+
+    def _term(self, term):
+        matches = self.prefixes.get(term[:MAX_PREFIX])
+        if matches and (len(term) <= MAX_PREFIX or term in self.word_names):
+            return matches
+        return self._fuzzy(term)
+
+    def search(self, query, limit=50):
+        """
+        Find effects matching a free-text query.
+
+        Every query word must match a word of the effect's name or category,
+        by prefix or, failing that, by trigram similarity.
+
+        Args:
+            query (str): What the user typed
+            limit (int): Most results returned
+
+        Returns:
+            list: Effect names, best match first (catalog order for an empty query)
+        """
+        terms = words(query)
+        if not terms:
+            return self.names[:limit]
+        scores = None
+        for term in terms:
+            matches = self._term(term)
+            if scores is None:
+                scores = dict(matches)
+            else:
+                scores = {name: score + matches[name] for name, score in scores.items() if name in matches}
+            if not scores:
+                return []
+        ranked = sorted(scores, key=lambda name: (-scores[name], self.order[name]))
+        return ranked[:limit]
+
+
+def load_index(names, source_path, cache_path=None):
+    """
+    Return the index of a catalog, from the cache file when it is current.
+
+    Args:
+        names (iterable): Effect names, in catalog order
+        source_path (str): Python source defining the catalog (for categories)
+        cache_path (str): Cache file, INDEX_CACHE by default
+
+    Returns:
+        EffectIndex: The index
+    """
+    names = list(names)
+    cache_path = INDEX_CACHE if cache_path is None else cache_path
+    digest = hashlib.sha256("\n".join(names).encode())
+    for path in (source_path, __file__):
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    key = digest.hexdigest()
+
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, "rb") as f:
+                cached = pickle.load(f)
+            if cached.get("key") == key:
+                return cached["index"]
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable effect index cache: {str(e)}")
+
+    index = EffectIndex(names, categories_from_source(source_path))
+    if cache_path:
+        temp_path = f"{cache_path}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                pickle.dump({"key": key, "index": index}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"Could not write effect index cache: {str(e)}")
+    return index
@@ -0,0 +1,372 @@
+"""
+Local stand-in for the Telegram Bot API, for offline testing.
+
+Point the bot at it with:
+
+    TELEGRAM_API_BASE_URL=http://127.0.0.1:8081/bot
+    TELEGRAM_API_BASE_FILE_URL=http://127.0.0.1:8081/file/bot
+
+It implements the handful of methods the bot uses, serves downloadable
+files and records every call. Fake updates can be delivered to a registered
+webhook or queued for getUpdates long polling. Latency and flood-control
+errors (429 with retry_after) can be injected to see how the bot behaves
+under a slow or throttling Telegram; load_test.py builds on it.
+"""
+
+import json
+import time
+import email
+import random
+import argparse
+import itertools
+import threading
+import urllib.error
+import urllib.request
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+BOT_USER = {"id": 1000, "is_bot": True, "first_name": "FakeBot", "username": "fake_voice_bot"}
+
+# Methods that may be answered with an injected RetryAfter, as Telegram throttles sends
+THROTTLED_METHODS = {"sendMessage", "sendVoice", "editMessageText", "editMessageCaption", "answerCallbackQuery"}
+
+
+def _decode_value(value):
+    """Bot API clients JSON-encode non-string parameters."""
+    try:
+        return json.loads(value)
+    except (ValueError, TypeError):
+        return value
+
+
+def parse_request_body(content_type, body):
+    """
+    Parse a Bot API request body.
+
+    Args:
+        content_type (str): Content-Type header
+        body (bytes): Raw request body
+
+    Returns:
+        dict: Parameter values, with uploaded files as bytes
+    """
+    content_type = content_type or ""
+    if content_type.startswith("application/json"):
+        return json.loads(body or b"{}")
+    if content_type.startswith("multipart/form-data"):
+        message = email.message_from_bytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        params = {}
+        for part in message.get_payload():
+            name = part.get_param("name", header="content-disposition")
+            payload = part.get_payload(decode=True)
+            if part.get_filename():
+                params[name] = payload
+            else:
+                params[name] = _decode_value(payload.decode())
+        return params
+    return {key: _decode_value(values[0]) for key, values in parse_qs(body.decode()).items()}
+
+
+class FakeTelegram:
+    """In-process fake Bot API server."""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, retry_after_rate=0.0, retry_after=1):
+        """
+        Args:
+            host (str): Interface to bind
+            port (int): Port to bind, 0 picks a free one
+            latency (float): Seconds added to every call and download
+            jitter (float): Up to this many random seconds added on top
+            retry_after_rate (float): Fraction of send/edit calls refused with a 429
+            retry_after (int): retry_after seconds reported in injected 429s
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.server = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.calls = []           # (method, params) in arrival order
+        self.files = {}           # file_id: bytes
+        self.webhook = None       # {"url": ..., "secret_token": ...}
+        self.updates = []         # updates waiting for getUpdates
+        self.updates_ready = threading.Condition()
+        self.listeners = []       # callables receiving (method, params, result)
+        self.retry_afters = 0     # injected 429 responses
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/bot"
+
+    @property
+    def base_file_url(self):
+        return f"http://{self.host}:{self.port}/file/bot"
+
+    def start(self):
+        """Start serving in a background thread."""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                fake._handle(self, None)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                fake._handle(self, self.rfile.read(length))
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fake-telegram", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def _respond(self, request, status, payload, content_type="application/json"):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def _delay(self):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+    def _handle(self, request, body):
+        path = urlparse(request.path).path
+        if path.startswith("/file/bot"):
+            self._delay()
+            file_id = path.rsplit("/", 1)[-1]
+            data = self.files.get(file_id)
+            if data is None:
+                self._respond(request, 404, {"ok": False, "error_code": 404, "description": "Not Found"})
+            else:
+                self._respond(request, 200, data, "application/octet-stream")
+            return
+
+        method = path.rsplit("/", 1)[-1]
+        params = parse_request_body(request.headers.get("Content-Type"), body or b"")
+        with self.lock:
+            self.calls.append((method, params))
+        handler = getattr(self, f"api_{method}", None)
+        if handler is None:
+            self._respond(request, 404, {"ok": False, "error_code": 404, "description": "Not Found: method not found"})
+            return
+        if method != "getUpdates":
+            self._delay()
+        if method in THROTTLED_METHODS and self.retry_after_rate and random.random() < self.retry_after_rate:
+            with self.lock:
+                self.retry_afters += 1
+            self._respond(request, 429, {
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            })
+            return
+        result = handler(params)
+        self._respond(request, 200, {"ok": True, "result": result})
+        for listener in list(self.listeners):
+            listener(method, params, result)
+
+    # Files
+
+    def add_file(self, data, file_id=None):
+        """
+        Register downloadable file contents.
+
+        Args:
+            data (bytes): File contents
+            file_id (str): Identifier, generated when omitted
+
+        Returns:
+            str: The file id
+        """
+        file_id = file_id or f"file_{next(self._file_ids)}"
+        with self.lock:
+            self.files[file_id] = data
+        return file_id
+
+    # Bot API methods
+
+    def _message(self, chat_id, **fields):
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if int(chat_id) > 0 else "group"},
+            "from": BOT_USER,
+        }
+        message.update(fields)
+        return message
+
+    def api_getMe(self, params):
+        return BOT_USER
+
+    def api_setWebhook(self, params):
+        self.webhook = {"url": params.get("url"), "secret_token": params.get("secret_token")}
+        return True
+
+    def api_deleteWebhook(self, params):
+        self.webhook = None
+        return True
+
+    def api_answerCallbackQuery(self, params):
+        return True
+
+    def api_getFile(self, params):
+        file_id = params["file_id"]
+        data = self.files.get(file_id, b"")
+        return {"file_id": file_id, "file_unique_id": file_id, "file_size": len(data), "file_path": f"voice/{file_id}"}
+
+    def api_sendMessage(self, params):
+        return self._message(params["chat_id"], text=str(params.get("text", "")))
+
+    def api_editMessageText(self, params):
+        return self._message(params.get("chat_id") or 0, text=str(params.get("text", "")))
+
+    def api_editMessageCaption(self, params):
+        return self._message(params.get("chat_id") or 0, caption=str(params.get("caption", "")))
+
+    def api_getUpdates(self, params):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        deadline = time.monotonic() + float(params.get("timeout") or 0)
+        with self.updates_ready:
+            # Updates below the offset were confirmed by the client
+            self.updates = [update for update in self.updates if update["update_id"] >= offset]
+            while not self.updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.updates_ready.wait(remaining)
+            return self.updates[:limit]
+
+    def api_sendVoice(self, params):
+        voice = params.get("voice")
+        file_id = self.add_file(voice) if isinstance(voice, bytes) else str(voice)
+        return self._message(
+            params["chat_id"],
+            voice={"file_id": file_id, "file_unique_id": file_id, "duration": 1},
+            caption=str(params.get("caption", ""))
+        )
+
+    # Fake updates
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+    def make_voice_update(self, user_id, file_id, duration=3):
+        """Build an update carrying a voice message."""
+        return {
+            "update_id": next(self._update_ids),
+            "message": self._message(
+                user_id, **{"from": self._user(user_id)},
+                voice={"file_id": file_id, "file_unique_id": file_id, "duration": duration}
+            ),
+        }
+
+    def make_command_update(self, user_id, text):
+        """Build an update carrying a text command such as '/start'."""
+        command = text.split()[0]
+        return {
+            "update_id": next(self._update_ids),
+            "message": self._message(
+                user_id, **{"from": self._user(user_id)}, text=text,
+                entities=[{"type": "bot_command", "offset": 0, "length": len(command)}]
+            ),
+        }
+
+    def make_callback_update(self, user_id, data, message_id=1):
+        """Build an update for an inline keyboard button press."""
+        message = self._message(user_id, text="🎛️ Choose a voice effect to apply:")
+        message["message_id"] = message_id
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._update_ids)),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "message": message,
+                "data": data,
+            },
+        }
+
+    def queue_update(self, update):
+        """
+        Queue an update for the next getUpdates call.
+
+        Args:
+            update (dict): Update JSON
+        """
+        with self.updates_ready:
+            self.updates.append(update)
+            self.updates_ready.notify_all()
+
+    def push_update(self, update):
+        """
+        Deliver an update to the registered webhook.
+
+        Args:
+            update (dict): Update JSON
+
+        Returns:
+            int: HTTP status returned by the webhook
+        """
+        if not self.webhook:
+            raise RuntimeError("No webhook registered")
+        request = urllib.request.Request(
+            self.webhook["url"],
+            data=json.dumps(update).encode(),
+            headers={
+                "Content-Type": "application/json",
+                "X-Telegram-Bot-Api-Secret-Token": self.webhook.get("secret_token") or "",
+            },
+            method="POST"
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def calls_to(self, method):
+        """Return the parameters of every recorded call to a method."""
+        with self.lock:
+            return [params for name, params in self.calls if name == method]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake Telegram Bot API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra seconds per call")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="fraction of sends answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after seconds of injected 429s")
+    args = parser.parse_args()
+
+    fake = FakeTelegram(
+        args.host, args.port, args.latency, args.jitter, args.retry_after_rate, args.retry_after
+    ).start()
+    print(f"TELEGRAM_API_BASE_URL={fake.base_url}")
+    print(f"TELEGRAM_API_BASE_FILE_URL={fake.base_file_url}")
+    try:
+        fake.thread.join()
+    except KeyboardInterrupt:
+        fake.stop()
@@ -0,0 +1,266 @@
+"""
+FFmpeg capability probe and effect catalog validation.
+
+Builds of FFmpeg differ in the filters and encoders they include, and an
+effect whose graph the installed build can't run used to surface only when
+a user tapped it. At start-up the filter and encoder lists are read once
+(ffmpeg -filters / -encoders), and every effect chain is dry-run on a short
+silent input into the null muxer. Effects that fail are hidden from the
+menu.
+
+Both results are cached on disk keyed by the FFmpeg version string and the
+SHA-256 of its binary, and dry runs additionally by the exact chain, so
+later cold starts on the same build skip the probe and only test changed
+effects.
+
+Usage (validate the catalog and print the failures):
+    python ffmpeg_catalog.py
+"""
+
+import os
+import sys
+import json
+import shutil
+import hashlib
+import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import ffmpeg_limits
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Cache file for the probe and dry-run results (empty disables caching)
+CACHE_FILE = os.environ.get('FFMPEG_CAPABILITY_CACHE', '.ffmpeg_capabilities.json')
+
+# Set to 0 to skip validation and show every effect
+VALIDATE = os.environ.get('FFMPEG_VALIDATE_EFFECTS', '1') != '0'
+
+# Seconds of silence each effect is dry-run on, and the time each run may take
+DRY_RUN_SECONDS = 0.5
+DRY_RUN_TIMEOUT = 20
+
+# Dry runs executed in parallel
+DRY_RUN_WORKERS = os.cpu_count() or 1
+
+_lock = threading.Lock()
+
+# Effects that failed validation: name: reason
+failed = {}
+
+
+def binary_key(ffmpeg="ffmpeg"):
+    """
+    Identify the installed FFmpeg build.
+
+    Args:
+        ffmpeg (str): Binary name or path
+
+    Returns:
+        str: "<version line>|<sha256 of the binary>", or None if FFmpeg is missing
+    """
+    path = shutil.which(ffmpeg)
+    if path is None:
+        return None
+    try:
+        process = subprocess.run([path, "-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=10)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    version = process.stdout.decode(errors="replace").splitlines()[:1]
+    digest = hashlib.sha256()
+    with open(os.path.realpath(path), "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return f"{version[0] if version else 'unknown'}|{digest.hexdigest()}"
+
+
+def _parse_listing(output):
+    """Names from an 'ffmpeg -filters' or '-encoders' listing (after its legend)."""
+    names = set()
+    in_body = False
+    for line in output.splitlines():
+        if not in_body:
+            # The legend ends with a " ------" line (encoders) or the last legend
+            # line of -filters, after which every line is " FLAGS name ..."
+            in_body = line.strip().startswith("------") or line.strip().startswith("| = Source or sink")
+            continue
+        parts = line.split()
+        if len(parts) >= 2:
+            names.add(parts[1])
+    return names
+
+
+def probe(ffmpeg="ffmpeg"):
+    """
+    List the filters and encoders of the installed FFmpeg.
+
+    Returns:
+        dict: "filters" and "encoders" name lists
+    """
+    listings = {}
+    for option in ("filters", "encoders"):
+        process = subprocess.run(
+            [ffmpeg, "-hide_banner", f"-{option}"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30
+        )
+        listings[option] = sorted(_parse_listing(process.stdout.decode(errors="replace")))
+    return listings
+
+
+def _load_cache(key):
+    if not CACHE_FILE or not os.path.exists(CACHE_FILE):
+        return None
+    try:
+        with open(CACHE_FILE, encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return cache if cache.get("key") == key else None
+
+
+def _save_cache(cache):
+    if not CACHE_FILE:
+        return
+    temp_path = f"{CACHE_FILE}.tmp"
+    try:
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+        os.replace(temp_path, CACHE_FILE)
+    except OSError as e:
+        logger.warning(f"Could not write FFmpeg capability cache: {str(e)}")
+
+
+def _chain_key(chain):
+    return hashlib.sha256(chain.encode()).hexdigest()[:16]
+
+
+def dry_run(chain, sample_rate):
+    """
+    Run a filter chain on a moment of silence into the null muxer.
+
+    Args:
+        chain (str): Full filter chain, as render_effect would run it
+        sample_rate (int): Rate of the silent input
+
+    Returns:
+        tuple: (error message or None if the graph works, whether the result
+        is deterministic and can be cached; timeouts and launch errors are not)
+    """
+    cmd = [
+        "ffmpeg", "-hide_banner", "-v", "error", "-nostdin",
+        "-f", "lavfi", "-i", f"anullsrc=r={sample_rate}:cl=mono",
+        "-t", str(DRY_RUN_SECONDS), "-af", chain, "-c:a", "libopus", "-f", "null", "-"
+    ]
+    try:
+        process = ffmpeg_limits.run(
+            cmd, timeout=DRY_RUN_TIMEOUT, output_limit_mb=0, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+    except subprocess.TimeoutExpired:
+        return f"dry run timed out after {DRY_RUN_TIMEOUT}s", False
+    except OSError as e:
+        return str(e), False
+    if process.returncode != 0:
+        lines = process.stderr.decode(errors="replace").strip().splitlines()
+        return (lines[-1] if lines else f"exit status {process.returncode}"), True
+    return None, True
+
+
+def validate(effects, sample_rate=None):
+    """
+    Check every effect against the installed FFmpeg and record the failures.
+
+    Filters the build doesn't list fail without a dry run; the rest are
+    dry-run. Results are cached per FFmpeg build and chain, except dry runs
+    that timed out or couldn't start: those effects are hidden for this run
+    and tried again on the next start.
+
+    Args:
+        effects (dict): Effect name: filter chain (written for the canonical rate)
+        sample_rate (int): Canonical sample rate
+
+    Returns:
+        dict: Failed effects, name: reason
+    """
+    from render_engine import canonical_chain, parse_filter_chain, CANONICAL_SAMPLE_RATE
+
+    sample_rate = sample_rate or CANONICAL_SAMPLE_RATE
+    key = binary_key()
+    if key is None:
+        logger.error("FFmpeg not found; effect validation skipped")
+        return {}
+
+    cache = _load_cache(key)
+    if cache is None:
+        logger.info("Probing FFmpeg filters and encoders")
+        cache = {"key": key, "dry_runs": {}}
+        cache.update(probe())
+        metrics.increment("ffmpeg_capability_probes_total")
+    filters = set(cache["filters"])
+    encoders = set(cache["encoders"])
+
+    results = {}
+    pending = {}
+    for name, chain in effects.items():
+        full_chain = canonical_chain(chain, sample_rate)
+        chain_key = _chain_key(full_chain)
+        if chain_key in cache["dry_runs"]:
+            results[name] = cache["dry_runs"][chain_key]
+            continue
+        missing = sorted({filter_name for filter_name, _, _ in parse_filter_chain(full_chain)} - filters)
+        if "libopus" not in encoders:
+            results[name] = cache["dry_runs"][chain_key] = "encoder libopus not available"
+        elif missing:
+            results[name] = cache["dry_runs"][chain_key] = f"filter not available: {', '.join(missing)}"
+        else:
+            pending[name] = (chain_key, full_chain)
+
+    if pending:
+        logger.info(f"Dry-running {len(pending)} effect graphs")
+        with ThreadPoolExecutor(max_workers=DRY_RUN_WORKERS) as pool:
+            outcomes = pool.map(lambda item: dry_run(item[1], sample_rate), pending.values())
+            for (name, (chain_key, _)), (error, deterministic) in zip(pending.items(), outcomes):
+                results[name] = error
+                if deterministic:
+                    cache["dry_runs"][chain_key] = error
+        metrics.increment("ffmpeg_effect_dry_runs_total", len(pending))
+    _save_cache(cache)
+
+    broken = {name: error for name, error in results.items() if error}
+    with _lock:
+        failed.clear()
+        failed.update(broken)
+    metrics.set_gauge("effects_hidden", len(broken))
+    for name, error in broken.items():
+        logger.warning(f"Hiding effect {name}: {error}")
+    logger.info(f"{len(effects) - len(broken)}/{len(effects)} effects available")
+    return broken
+
+
+def available(effects):
+    """
+    Drop effects that failed validation.
+
+    Args:
+        effects (dict): Effect name: filter chain
+
+    Returns:
+        dict: The effects that work with the installed FFmpeg, in order
+    """
+    with _lock:
+        hidden = set(failed)
+    return {name: chain for name, chain in effects.items() if name not in hidden}
+
+
+if __name__ == "__main__":
+    from voice_effects import VOICE_EFFECTS
+
+    broken = validate(VOICE_EFFECTS)
+    for name, error in broken.items():
+        print(f"{name:<20} {error}")
+    sys.exit(1 if broken else 0)
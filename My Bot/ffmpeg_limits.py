@@ -0,0 +1,265 @@
+"""
+Resource limits and a runaway-job watchdog for FFmpeg subprocesses.
+
+Every FFmpeg job runs with CPU-time, address-space and output-size limits
+(set by a prlimit prefix, or on the started process) at a lowered CPU and
+I/O priority. A watchdog thread enforces a wall-clock deadline, killing and
+logging offenders, so one pathological render (a ten second echo on an
+hour-long file, say) can't starve the whole machine.
+"""
+
+import os
+import time
+import shutil
+import signal
+import logging
+import threading
+import subprocess
+
+import metrics
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# CPU seconds one FFmpeg process may use (0 disables the limit)
+CPU_LIMIT = int(os.environ.get('FFMPEG_CPU_LIMIT', '300'))
+
+# Address space of one FFmpeg process in MB (0 disables the limit)
+MEMORY_LIMIT_MB = int(os.environ.get('FFMPEG_MEMORY_LIMIT_MB', '2048'))
+
+# Largest output file in MB; bots can't upload more than 50 MB anyway
+OUTPUT_LIMIT_MB = int(os.environ.get('FFMPEG_OUTPUT_LIMIT_MB', '50'))
+
+# Wall-clock seconds before the watchdog kills a job (0 disables it)
+WALL_TIMEOUT = float(os.environ.get('FFMPEG_WALL_TIMEOUT', '600'))
+
+# Niceness added to FFmpeg processes
+NICE = int(os.environ.get('FFMPEG_NICE', '10'))
+
+# ionice scheduling class and level ("" disables ionice)
+IONICE_CLASS = os.environ.get('FFMPEG_IONICE_CLASS', '2')
+IONICE_LEVEL = os.environ.get('FFMPEG_IONICE_LEVEL', '7')
+
+# Seconds between watchdog sweeps
+WATCHDOG_INTERVAL = 1.0
+
+_IONICE = shutil.which("ionice")
+_NICE = shutil.which("nice")
+_PRLIMIT = shutil.which("prlimit")
+
+
+def _rlimits(output_limit_mb=None):
+    """Return the (prlimit option, resource limit, (soft, hard)) triples to apply."""
+    if resource is None:
+        return []
+    output_limit_mb = OUTPUT_LIMIT_MB if output_limit_mb is None else output_limit_mb
+    limits = []
+    if CPU_LIMIT > 0:
+        # SIGXCPU at the soft limit, SIGKILL a few seconds later
+        limits.append(("cpu", resource.RLIMIT_CPU, (CPU_LIMIT, CPU_LIMIT + 5)))
+    if MEMORY_LIMIT_MB > 0:
+        limits.append(("as", resource.RLIMIT_AS, (MEMORY_LIMIT_MB << 20, MEMORY_LIMIT_MB << 20)))
+    if output_limit_mb > 0:
+        # 0 for intermediate files that need no cap
+        limits.append(("fsize", resource.RLIMIT_FSIZE, (output_limit_mb << 20, output_limit_mb << 20)))
+    return limits
+
+
+def wrap_command(cmd, output_limit_mb=None):
+    """
+    Prefix a command with the resource limits and lowered CPU and I/O priority.
+
+    The limits are applied by prlimit, nice and ionice in front of the
+    command rather than by a preexec_fn, which is unsafe in a process with
+    threads. Where prlimit or nice is missing, apply_limits sets the same
+    limits on the started process.
+
+    Args:
+        cmd (list): Command line
+        output_limit_mb (int): Output size cap in MB, OUTPUT_LIMIT_MB by
+            default; 0 for intermediate files that need no cap
+
+    Returns:
+        list: Command line run under the limits
+    """
+    prefix = []
+    if os.name == "posix":
+        limits = _rlimits(output_limit_mb)
+        if _PRLIMIT and limits:
+            prefix += [_PRLIMIT] + [f"--{option}={soft}:{hard}" for option, _, (soft, hard) in limits] + ["--"]
+        if _NICE and NICE:
+            prefix += [_NICE, "-n", str(NICE)]
+    if _IONICE and IONICE_CLASS:
+        prefix += [_IONICE, "-c", IONICE_CLASS]
+        if IONICE_CLASS == "2" and IONICE_LEVEL:
+            prefix += ["-n", IONICE_LEVEL]
+    return prefix + list(cmd)
+
+
+def apply_limits(pid, output_limit_mb=None):
+    """
+    Apply the limits wrap_command could not prefix to a started process.
+
+    Args:
+        pid (int): Process started from a wrap_command command line
+        output_limit_mb (int): Output size cap in MB, as passed to wrap_command
+    """
+    if os.name != "posix":
+        return
+    try:
+        if not _PRLIMIT and hasattr(resource, "prlimit"):
+            for _, limit, values in _rlimits(output_limit_mb):
+                resource.prlimit(pid, limit, values)
+        if not _NICE and NICE:
+            os.setpriority(os.PRIO_PROCESS, pid, os.getpriority(os.PRIO_PROCESS, 0) + NICE)
+    except OSError as e:
+        # Typically the process has already exited
+        logger.debug(f"Could not apply limits to pid {pid}: {str(e)}")
+
+
+def exit_reason(returncode, killed=None):
+    """
+    Explain an exit status caused by one of the limits or a kill.
+
+    Args:
+        returncode (int): Process return code (negative for signals)
+        killed (str): Reason recorded by whoever killed the process (the
+            watchdog, a stall or a cancellation), if any
+
+    Returns:
+        str: Description of the violated limit, or None
+    """
+    if killed:
+        return killed
+    if returncode is None or returncode >= 0:
+        return None
+    signum = -returncode
+    if signum == getattr(signal, "SIGXCPU", None):
+        return f"CPU time limit of {CPU_LIMIT}s exceeded"
+    if signum == getattr(signal, "SIGXFSZ", None):
+        return "output size limit exceeded"
+    if signum == signal.SIGKILL:
+        # Not killed by us: a process ignoring SIGXCPU hits the hard CPU
+        # limit, otherwise the kernel's OOM killer or another process did it
+        # (the address-space limit makes allocations fail instead)
+        return "killed by SIGKILL (CPU hard limit, out-of-memory killer or an external kill)"
+    return None
+
+
+class Watchdog:
+    """Kills FFmpeg processes that exceed their wall-clock deadline."""
+
+    def __init__(self, interval=None):
+        self.interval = interval or WATCHDOG_INTERVAL
+        self.lock = threading.Lock()
+        self.jobs = {}  # pid: {"cmd", "deadline", "started", "killed"}
+        self.thread = None
+
+    def watch(self, pid, cmd, timeout=None):
+        """
+        Start watching a process.
+
+        Args:
+            pid (int): Process id
+            cmd (list): Command line, for the log
+            timeout (float): Wall-clock seconds allowed, WALL_TIMEOUT by default
+
+        Returns:
+            dict: The watch entry; its "killed" key is set if the watchdog fires
+        """
+        timeout = WALL_TIMEOUT if timeout is None else timeout
+        now = time.monotonic()
+        entry = {"cmd": cmd, "started": now, "deadline": now + timeout if timeout > 0 else None, "killed": None}
+        with self.lock:
+            self.jobs[pid] = entry
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="ffmpeg-watchdog", daemon=True)
+                self.thread.start()
+        metrics.set_gauge("ffmpeg_jobs_running", len(self.jobs))
+        return entry
+
+    def unwatch(self, pid):
+        """Stop watching a process that has exited."""
+        with self.lock:
+            self.jobs.pop(pid, None)
+        metrics.set_gauge("ffmpeg_jobs_running", len(self.jobs))
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.monotonic()
+            with self.lock:
+                overdue = [
+                    (pid, entry) for pid, entry in self.jobs.items()
+                    if entry["deadline"] is not None and now > entry["deadline"] and not entry["killed"]
+                ]
+            for pid, entry in overdue:
+                entry["killed"] = f"wall-clock limit of {entry['deadline'] - entry['started']:.0f}s exceeded"
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    continue
+                metrics.increment("ffmpeg_jobs_killed_total")
+                logger.error(f"Watchdog killed FFmpeg pid {pid}: {entry['killed']} ({' '.join(entry['cmd'])})")
+
+
+# Process-wide watchdog
+watchdog = Watchdog()
+
+
+def record_violation(reason, cmd):
+    """Log and count a job stopped by one of the limits."""
+    metrics.increment("ffmpeg_limit_violations_total")
+    logger.error(f"FFmpeg job stopped: {reason} ({' '.join(cmd)})")
+
+
+def run(cmd, timeout=None, output_limit_mb=None, **kwargs):
+    """
+    subprocess.run for FFmpeg with the resource limits applied.
+
+    Supports the subprocess.run arguments the bot uses (input, stdout,
+    stderr, text and the other Popen arguments).
+
+    Args:
+        cmd (list): Command line
+        timeout (float): Wall-clock seconds, WALL_TIMEOUT by default
+        output_limit_mb (int): Output size cap in MB
+        **kwargs: Passed to subprocess.run
+
+    Returns:
+        CompletedProcess: The finished process
+
+    Raises:
+        subprocess.TimeoutExpired: If the job was killed for running too long
+    """
+    timeout = WALL_TIMEOUT if timeout is None else timeout
+    data = kwargs.pop("input", None)
+    if data is not None:
+        kwargs["stdin"] = subprocess.PIPE
+    with subprocess.Popen(wrap_command(cmd, output_limit_mb), **kwargs) as process:
+        apply_limits(process.pid, output_limit_mb)
+        try:
+            stdout, stderr = process.communicate(data, timeout=timeout or None)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            metrics.increment("ffmpeg_jobs_killed_total")
+            record_violation(f"wall-clock limit of {timeout:.0f}s exceeded", cmd)
+            raise
+        except BaseException:
+            process.kill()
+            raise
+    process = subprocess.CompletedProcess(process.args, process.returncode, stdout, stderr)
+    reason = exit_reason(process.returncode)
+    if reason:
+        record_violation(reason, cmd)
+    return process
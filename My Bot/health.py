@@ -0,0 +1,227 @@
+"""
+Liveness and readiness reporting for the web tier (/healthz, /readyz).
+
+Liveness means the bot can still do work: its dispatcher is alive (the
+event-loop heartbeat is recent, the webhook thread runs, or runtime workers
+are up) and FFmpeg is installed. Readiness adds load. An instance whose
+renders fill its workers, or whose render queue holds more than a few jobs
+per worker, reports not ready. The autoscaler then routes new requests
+elsewhere and adds capacity while the queue is still short, instead of
+after users have felt it.
+
+Components register their own liveness checks with register_liveness.
+Under the multi-process runtime the renders happen in the worker
+processes, so runtime registers their combined load with set_load_source.
+"""
+
+import os
+import time
+import logging
+import threading
+
+import metrics
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Seconds without an event-loop heartbeat before the bot counts as dead
+LIVENESS_TIMEOUT = float(os.environ.get('HEALTH_LIVENESS_TIMEOUT', '30'))
+
+# Seconds after start-up during which a bot that isn't up yet still counts as healthy
+STARTUP_GRACE = float(os.environ.get('HEALTH_STARTUP_GRACE', '60'))
+
+# Fraction of render workers busy above which the instance stops taking traffic
+READY_MAX_SATURATION = float(os.environ.get('READY_MAX_SATURATION', '0.8'))
+
+# Queued renders per worker above which the instance stops taking traffic
+READY_MAX_QUEUE_PER_WORKER = float(os.environ.get('READY_MAX_QUEUE_PER_WORKER', '1'))
+
+# Seconds FFmpeg availability and the durable queue depth are cached for
+FFMPEG_CHECK_INTERVAL = 60.0
+QUEUE_CHECK_INTERVAL = 5.0
+
+_started = time.monotonic()
+_lock = threading.Lock()
+_checks = {}  # name: callable returning (ok, detail)
+_cache = {}   # name: (expires, value)
+_load_source = None  # callable returning the load of other processes, see set_load_source
+
+
+def register_liveness(name, check):
+    """
+    Register a liveness check.
+
+    Args:
+        name (str): Component name shown in the report
+        check (callable): Returns (bool, str): whether the component is
+            alive and a short description
+    """
+    with _lock:
+        _checks[name] = check
+
+
+def set_load_source(source):
+    """
+    Take the render load from other processes instead of this one.
+
+    Args:
+        source (callable): Returns a dict with "processes" (processes doing
+            the renders), "busy" (FFmpeg jobs running), "renders" (renders
+            in flight) and "loop_lag_seconds" (worst event-loop lag)
+    """
+    global _load_source
+    _load_source = source
+
+
+def _cached(name, ttl, compute):
+    now = time.monotonic()
+    entry = _cache.get(name)
+    if entry is not None and entry[0] > now:
+        return entry[1]
+    value = compute()
+    _cache[name] = (now + ttl, value)
+    return value
+
+
+def event_loop_check():
+    """Liveness of the bot's event loop, from the loop monitor's heartbeat."""
+    from loop_monitor import monitor
+
+    if monitor.last_beat is None:
+        return False, "loop monitor not running"
+    age = time.monotonic() - monitor.last_beat
+    return age < LIVENESS_TIMEOUT, f"last heartbeat {age:.1f}s ago"
+
+
+def ffmpeg_available():
+    """Return True if FFmpeg is installed (checked at most once a minute)."""
+    from utils import check_ffmpeg_installed
+
+    return _cached("ffmpeg", FFMPEG_CHECK_INTERVAL, check_ffmpeg_installed)
+
+
+def liveness():
+    """
+    Run the liveness checks.
+
+    A process where no component registered a check runs no bot (e.g.
+    gunicorn serving only the web pages while the bot polls elsewhere), so
+    it is reported as not alive, with "bot" False.
+
+    Returns:
+        dict: "alive" (True, False, or None while starting up), "bot"
+            (whether any bot component registered a check) and the result
+            of every check
+    """
+    with _lock:
+        checks = dict(_checks)
+    results = {}
+    for name, check in checks.items():
+        try:
+            ok, detail = check()
+        except Exception as e:
+            ok, detail = False, f"check failed: {str(e)}"
+        results[name] = {"ok": bool(ok), "detail": detail}
+
+    starting = time.monotonic() - _started < STARTUP_GRACE
+    if not results or not all(result["ok"] for result in results.values()):
+        alive = None if starting else False
+    else:
+        alive = True
+    return {"alive": alive, "bot": bool(results), "checks": results}
+
+
+def load():
+    """
+    Measure render load on this instance.
+
+    The load comes from the registered load source (the runtime's worker
+    processes) if there is one, otherwise from this process's own gauges.
+
+    Returns:
+        dict: Busy and total workers, saturation, queue depth and queued
+            renders per worker, and the current event-loop lag
+    """
+    import job_queue
+    from inflight import renders
+
+    gauges = metrics.snapshot()["gauges"]
+    if _load_source is not None:
+        source = _load_source()
+        processes, busy, inflight = source["processes"], source["busy"], source["renders"]
+        loop_lag = source["loop_lag_seconds"]
+    else:
+        processes, busy, inflight = 1, gauges.get("ffmpeg_jobs_running", 0), None
+        loop_lag = gauges.get("event_loop_lag_current_seconds", 0.0)
+    if job_queue.RENDER_QUEUE == "durable":
+        # Every bot process runs its own render workers
+        workers = job_queue.CONCURRENCY * processes
+        try:
+            # The queue is shared, so its depth is spread over every node's workers
+            depth = _cached("queue_depth", QUEUE_CHECK_INTERVAL, lambda: job_queue.get_queue().depth())
+        except Exception as e:
+            logger.warning(f"Could not read render queue depth: {str(e)}")
+            depth = gauges.get("render_queue_depth", 0)
+    else:
+        workers = os.cpu_count() or 1
+        # Inline renders start right away; those beyond the cores wait for CPU
+        depth = max(0, (renders.count() if inflight is None else inflight) - workers)
+    return {
+        "workers": workers,
+        "busy": busy,
+        "saturation": round(busy / workers, 3),
+        "queue_depth": depth,
+        "queue_per_worker": round(depth / workers, 3),
+        "loop_lag_seconds": round(loop_lag, 4),
+    }
+
+
+def healthz():
+    """
+    Report whether the instance is alive.
+
+    Returns:
+        int: HTTP status (200 or 503)
+        dict: Report body
+    """
+    report = liveness()
+    report["ffmpeg"] = ffmpeg_available()
+    healthy = report["alive"] is not False and report["ffmpeg"]
+    if healthy:
+        report["status"] = "starting" if report["alive"] is None else "ok"
+    else:
+        report["status"] = "no bot in this process" if not report["bot"] else "unhealthy"
+    return (200 if healthy else 503), report
+
+
+def readyz():
+    """
+    Report whether the instance should receive new traffic.
+
+    Returns:
+        int: HTTP status (200 or 503)
+        dict: Report body, with the reasons when not ready
+    """
+    report = liveness()
+    report["ffmpeg"] = ffmpeg_available()
+    report["load"] = load()
+    reasons = []
+    if report["alive"] is None:
+        reasons.append("starting")
+    elif not report["alive"]:
+        reasons.append("bot not alive" if report["bot"] else "no bot in this process")
+    if not report["ffmpeg"]:
+        reasons.append("ffmpeg missing")
+    if report["load"]["saturation"] >= READY_MAX_SATURATION:
+        reasons.append(f"workers {report['load']['saturation']:.0%} busy")
+    if report["load"]["queue_per_worker"] > READY_MAX_QUEUE_PER_WORKER:
+        reasons.append(f"{report['load']['queue_depth']} renders queued")
+    report["status"] = "ready" if not reasons else "not ready"
+    report["reasons"] = reasons
+    metrics.set_gauge("instance_ready", 0 if reasons else 1)
+    metrics.set_gauge("instance_saturation", report["load"]["saturation"])
+    return (200 if not reasons else 503), report
@@ -0,0 +1,117 @@
+"""
+Track each user's in-flight renders so newer selections can supersede them.
+
+When a user taps one effect and then another, the older render is usually
+unwanted. The dispatcher reports every effect selection as soon as it
+arrives (before it waits behind the user's running update), and the older
+render is cancelled: its FFmpeg process is killed and its upload skipped.
+Actions listed in RENDER_KEEP_ACTIONS neither cancel nor get cancelled, for
+when users want both outputs.
+"""
+
+import os
+import logging
+
+import metrics
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Set to 0 to let every render run to completion
+SUPERSEDE = os.environ.get('RENDER_SUPERSEDE', '1') != '0'
+
+# Actions (effect names) whose renders are always kept
+KEEP_ACTIONS = {
+    action.strip() for action in os.environ.get('RENDER_KEEP_ACTIONS', 'cloned').split(',') if action.strip()
+}
+
+
+def supersedes(action):
+    """
+    Return True if a render for action may cancel or be cancelled.
+
+    Args:
+        action (str): Effect name or other render action
+
+    Returns:
+        bool: Whether the action takes part in superseding
+    """
+    return SUPERSEDE and action not in KEEP_ACTIONS
+
+
+class Ticket:
+    """One in-flight render of a user."""
+
+    def __init__(self, user_id, action, task):
+        self.user_id = user_id
+        self.action = action
+        self.task = task
+        self.superseded = False
+
+
+class InFlightRenders:
+    """Registry of the renders currently running for each user."""
+
+    def __init__(self):
+        self._tickets = {}  # user_id: [Ticket, ...] in start order
+
+    def register(self, user_id, action, task):
+        """
+        Record a running render.
+
+        Args:
+            user_id (int): Owner of the render
+            action (str): Effect name or other render action
+            task (asyncio.Task): Task running the render
+
+        Returns:
+            Ticket: Handle to pass to done()
+        """
+        ticket = Ticket(user_id, action, task)
+        self._tickets.setdefault(user_id, []).append(ticket)
+        return ticket
+
+    def done(self, ticket):
+        """Forget a finished or cancelled render."""
+        tickets = self._tickets.get(ticket.user_id, [])
+        if ticket in tickets:
+            tickets.remove(ticket)
+        if not tickets:
+            self._tickets.pop(ticket.user_id, None)
+
+    def supersede(self, user_id, action):
+        """
+        Cancel the user's older renders in favour of a new action.
+
+        Args:
+            user_id (int): User who selected the new action
+            action (str): The newly selected action
+
+        Returns:
+            int: Number of renders cancelled
+        """
+        if not supersedes(action):
+            return 0
+        cancelled = 0
+        for ticket in self._tickets.get(user_id, []):
+            if ticket.superseded or ticket.task.done() or not supersedes(ticket.action):
+                continue
+            ticket.superseded = True
+            ticket.task.cancel()
+            cancelled += 1
+            logger.info(f"Render '{ticket.action}' of user {user_id} superseded by '{action}'")
+        if cancelled:
+            metrics.increment("renders_superseded_total", cancelled)
+        return cancelled
+
+    def count(self):
+        """Return the number of renders in flight."""
+        return sum(len(tickets) for tickets in self._tickets.values())
+
+
+# Process-wide registry used by the bot handlers
+renders = InFlightRenders()
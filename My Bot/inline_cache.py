@@ -0,0 +1,107 @@
+"""
+Telegram file_ids of effects rendered from each user's latest voice note.
+
+Inline queries can't wait for a render, so they are answered only from this
+cache. It is filled by regular deliveries (every voice the bot sends in a
+chat gets a file_id) and, when INLINE_CACHE_CHAT_ID is set, by pre-rendering
+INLINE_PRERENDER_EFFECTS in the background after each upload and parking
+the results in that chat. A new upload starts a new, empty generation.
+"""
+
+import os
+import logging
+from collections import OrderedDict
+
+import metrics
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+def _parse_chat_id(value):
+    """Parse INLINE_CACHE_CHAT_ID, returning None when it is empty."""
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(
+            f"INLINE_CACHE_CHAT_ID must be a numeric chat id such as -1001234567890, got {value!r}"
+        ) from None
+
+
+# Chat (usually a private channel) that pre-rendered variants are uploaded to; empty disables pre-rendering
+CACHE_CHAT_ID = _parse_chat_id(os.environ.get('INLINE_CACHE_CHAT_ID', ''))
+
+# Effects pre-rendered after every upload
+PRERENDER_EFFECTS = [
+    name.strip() for name in os.environ.get(
+        'INLINE_PRERENDER_EFFECTS', 'chipmunk,deep,robot,echo,radio,alien,helium,reverse'
+    ).split(',') if name.strip()
+]
+
+# Seconds Telegram may cache an inline answer (variants keep arriving after an upload)
+ANSWER_CACHE_TIME = int(os.environ.get('INLINE_ANSWER_CACHE_TIME', '10'))
+
+# Users whose variants are kept; the least recently active are dropped first
+MAX_USERS = int(os.environ.get('INLINE_CACHE_USERS', '10000'))
+
+
+class RenderCache:
+    """Per-user map of effect name to the file_id of the rendered voice."""
+
+    def __init__(self, max_users=None):
+        self.max_users = max_users or MAX_USERS
+        self._users = OrderedDict()  # user_id: (source file_id, {effect: voice file_id})
+
+    def reset(self, user_id, source_id):
+        """
+        Start a new generation for a user's latest upload.
+
+        Args:
+            user_id (int): Telegram user ID
+            source_id (str): file_id of the upload the variants are made from
+        """
+        self._users[user_id] = (source_id, {})
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+        metrics.set_gauge("inline_cache_users", len(self._users))
+
+    def add(self, user_id, source_id, effect, file_id):
+        """
+        Record a rendered variant, unless a newer upload replaced its source.
+
+        Returns:
+            bool: True if the variant was stored
+        """
+        entry = self._users.get(user_id)
+        if entry is None or entry[0] != source_id:
+            return False
+        entry[1][effect] = file_id
+        self._users.move_to_end(user_id)
+        return True
+
+    def has(self, user_id, source_id, effect):
+        """Return True if the variant is already cached for this upload."""
+        entry = self._users.get(user_id)
+        return entry is not None and entry[0] == source_id and effect in entry[1]
+
+    def variants(self, user_id):
+        """
+        Return the cached variants of a user's latest upload.
+
+        Returns:
+            dict: effect name: voice file_id (empty if nothing is cached)
+        """
+        entry = self._users.get(user_id)
+        return entry[1] if entry is not None else {}
+
+
+# Process-wide cache
+cache = RenderCache()
@@ -0,0 +1,495 @@
+"""
+Durable render job queue shared by every node running the bot.
+
+Jobs are stored in PostgreSQL when DATABASE_URL is set and in a local
+SQLite file otherwise. Workers lease jobs for a visibility timeout and keep
+extending the lease while rendering; if a node dies its leases expire and
+another node picks the job up. Inputs are referenced by Telegram file_id
+and results are sent straight to the job's chat, so delivery does not
+depend on the node that accepted the job. Delivery is at-least-once.
+"""
+
+import os
+import time
+import shutil
+import socket
+import asyncio
+import logging
+import tempfile
+import threading
+
+import metrics
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# "inline" renders inside the handler, "durable" goes through this queue
+RENDER_QUEUE = os.environ.get('RENDER_QUEUE', 'inline')
+
+# PostgreSQL connection string (production); SQLite file otherwise
+DATABASE_URL = os.environ.get('DATABASE_URL')
+SQLITE_PATH = os.environ.get('RENDER_QUEUE_DB', 'render_jobs.db')
+
+# Seconds a leased job stays invisible to other workers without a heartbeat
+VISIBILITY_TIMEOUT = float(os.environ.get('RENDER_QUEUE_VISIBILITY_TIMEOUT', '60'))
+
+# Attempts before a job is marked as failed
+MAX_ATTEMPTS = int(os.environ.get('RENDER_QUEUE_MAX_ATTEMPTS', '3'))
+
+# Render workers per node
+CONCURRENCY = int(os.environ.get('RENDER_QUEUE_CONCURRENCY', str(os.cpu_count() or 1)))
+
+# Seconds between polls of an empty queue
+POLL_INTERVAL = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS render_jobs (
+    id {id_type},
+    idempotency_key TEXT NOT NULL UNIQUE,
+    chat_id BIGINT NOT NULL,
+    user_id BIGINT NOT NULL,
+    effect TEXT NOT NULL,
+    filter_chain TEXT NOT NULL,
+    input_file_id TEXT NOT NULL,
+    status_message_id BIGINT,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    lease_owner TEXT,
+    lease_expires_at DOUBLE PRECISION,
+    available_at DOUBLE PRECISION NOT NULL,
+    result_file_id TEXT,
+    error TEXT,
+    created_at DOUBLE PRECISION NOT NULL,
+    updated_at DOUBLE PRECISION NOT NULL
+)
+"""
+
+INDEX = "CREATE INDEX IF NOT EXISTS render_jobs_ready ON render_jobs (status, available_at)"
+
+# Jobs a worker may take: queued and due, or leased with an expired lease
+READY_CONDITION = (
+    "((status = 'queued' AND available_at <= {p}) "
+    "OR (status = 'leased' AND lease_expires_at < {p} AND attempts < max_attempts))"
+)
+
+
+class JobQueue:
+    """Lease-based job queue on SQLite or PostgreSQL."""
+
+    def __init__(self, database_url=None, sqlite_path=None):
+        """
+        Args:
+            database_url (str): PostgreSQL URL; SQLite is used when empty
+            sqlite_path (str): SQLite database file
+        """
+        self.database_url = database_url if database_url is not None else DATABASE_URL
+        self.sqlite_path = sqlite_path or SQLITE_PATH
+        self.postgres = bool(self.database_url)
+        self.placeholder = "%s" if self.postgres else "?"
+        self._pool = None
+        self._lock = threading.Lock()
+        self._create_schema()
+
+    # Connections
+
+    def _connect(self):
+        if self.postgres:
+            if self._pool is None:
+                from psycopg2.pool import ThreadedConnectionPool
+                with self._lock:
+                    if self._pool is None:
+                        self._pool = ThreadedConnectionPool(1, max(4, CONCURRENCY + 2), self.database_url)
+            return self._pool.getconn()
+        # Imported here: the inline queue (the default) never needs it
+        import sqlite3
+        connection = sqlite3.connect(self.sqlite_path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def _release(self, connection):
+        if self.postgres:
+            self._pool.putconn(connection)
+        else:
+            connection.close()
+
+    def _execute(self, sql, params=(), fetch=None):
+        """Run one statement in its own transaction."""
+        sql = sql.replace("?", self.placeholder)
+        connection = self._connect()
+        try:
+            if self.postgres:
+                from psycopg2.extras import RealDictCursor
+                with connection:
+                    with connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                        cursor.execute(sql, params)
+                        return self._fetch(cursor, fetch)
+            cursor = connection.execute(sql, params)
+            return self._fetch(cursor, fetch)
+        finally:
+            self._release(connection)
+
+    @staticmethod
+    def _fetch(cursor, fetch):
+        if fetch == "one":
+            row = cursor.fetchone()
+            return dict(row) if row is not None else None
+        if fetch == "all":
+            return [dict(row) for row in cursor.fetchall()]
+        return cursor.rowcount
+
+    def _create_schema(self):
+        id_type = "BIGSERIAL PRIMARY KEY" if self.postgres else "INTEGER PRIMARY KEY AUTOINCREMENT"
+        self._execute(SCHEMA.format(id_type=id_type))
+        self._execute(INDEX)
+
+    # Queue operations
+
+    def enqueue(self, idempotency_key, chat_id, user_id, effect, filter_chain, input_file_id,
+                status_message_id=None, max_attempts=None):
+        """
+        Add a render job unless one with the same idempotency key exists.
+
+        Args:
+            idempotency_key (str): Deduplication key, e.g. chat:message:effect
+            chat_id (int): Chat receiving the result
+            user_id (int): User who requested the render
+            effect (str): Effect name shown to the user
+            filter_chain (str): FFmpeg filter chain to apply
+            input_file_id (str): Telegram file_id of the input audio
+            status_message_id (int): Message to update with the job status
+            max_attempts (int): Attempts before the job fails
+
+        Returns:
+            int: Id of the new or already existing job
+            bool: True if the job was newly created
+        """
+        now = time.time()
+        created = self._execute(
+            "INSERT INTO render_jobs (idempotency_key, chat_id, user_id, effect, filter_chain, "
+            "input_file_id, status_message_id, max_attempts, available_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (idempotency_key) DO NOTHING",
+            (idempotency_key, chat_id, user_id, effect, filter_chain, input_file_id,
+             status_message_id, max_attempts or MAX_ATTEMPTS, now, now, now)
+        )
+        job = self._execute("SELECT id FROM render_jobs WHERE idempotency_key = ?", (idempotency_key,), fetch="one")
+        if created:
+            metrics.increment("render_jobs_enqueued_total")
+        return job["id"], bool(created)
+
+    def lease(self, owner, visibility_timeout=None):
+        """
+        Lease the next ready job.
+
+        Args:
+            owner (str): Identifier of the leasing worker
+            visibility_timeout (float): Seconds until the lease expires
+
+        Returns:
+            dict: The leased job, or None if no job is ready
+        """
+        now = time.time()
+        expires = now + (visibility_timeout or VISIBILITY_TIMEOUT)
+        if self.postgres:
+            job = self._execute(
+                "UPDATE render_jobs SET status = 'leased', lease_owner = ?, lease_expires_at = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE id = ("
+                "SELECT id FROM render_jobs WHERE " + READY_CONDITION.format(p="?") +
+                " ORDER BY available_at, id LIMIT 1 FOR UPDATE SKIP LOCKED) RETURNING *",
+                (owner, expires, now, now, now), fetch="one"
+            )
+        else:
+            connection = self._connect()
+            try:
+                # BEGIN IMMEDIATE takes the write lock, so two workers can't lease one job
+                connection.execute("BEGIN IMMEDIATE")
+                row = connection.execute(
+                    "SELECT * FROM render_jobs WHERE " + READY_CONDITION.format(p="?") +
+                    " ORDER BY available_at, id LIMIT 1", (now, now)
+                ).fetchone()
+                job = None
+                if row is not None:
+                    connection.execute(
+                        "UPDATE render_jobs SET status = 'leased', lease_owner = ?, lease_expires_at = ?, "
+                        "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                        (owner, expires, now, row["id"])
+                    )
+                    job = dict(row)
+                    job.update(status="leased", lease_owner=owner, lease_expires_at=expires, attempts=row["attempts"] + 1)
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+            finally:
+                self._release(connection)
+        if job:
+            metrics.increment("render_jobs_leased_total")
+        return job
+
+    def extend(self, job_id, owner, visibility_timeout=None):
+        """
+        Extend a lease still held by owner.
+
+        Returns:
+            bool: False if the lease was lost to another worker
+        """
+        now = time.time()
+        return self._execute(
+            "UPDATE render_jobs SET lease_expires_at = ?, updated_at = ? "
+            "WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+            (now + (visibility_timeout or VISIBILITY_TIMEOUT), now, job_id, owner)
+        ) > 0
+
+    def complete(self, job_id, owner, result_file_id=None):
+        """Mark a leased job as done."""
+        metrics.increment("render_jobs_completed_total")
+        return self._execute(
+            "UPDATE render_jobs SET status = 'done', result_file_id = ?, lease_owner = NULL, "
+            "lease_expires_at = NULL, updated_at = ? WHERE id = ? AND lease_owner = ?",
+            (result_file_id, time.time(), job_id, owner)
+        ) > 0
+
+    def fail(self, job, owner, error, retry_delay=None):
+        """
+        Record a failed attempt, re-queueing the job while attempts remain.
+
+        Args:
+            job (dict): The leased job
+            owner (str): Identifier of the leasing worker
+            error (str): Error description
+            retry_delay (float): Seconds before the retry, exponential by default
+
+        Returns:
+            bool: True if the job will be retried
+        """
+        retry = job["attempts"] < job["max_attempts"]
+        now = time.time()
+        if retry:
+            delay = retry_delay if retry_delay is not None else 2 ** job["attempts"]
+            self._execute(
+                "UPDATE render_jobs SET status = 'queued', error = ?, lease_owner = NULL, "
+                "lease_expires_at = NULL, available_at = ?, updated_at = ? WHERE id = ? AND lease_owner = ?",
+                (error[-2000:], now + delay, now, job["id"], owner)
+            )
+            metrics.increment("render_jobs_retried_total")
+        else:
+            self._execute(
+                "UPDATE render_jobs SET status = 'failed', error = ?, lease_owner = NULL, "
+                "lease_expires_at = NULL, updated_at = ? WHERE id = ? AND lease_owner = ?",
+                (error[-2000:], now, job["id"], owner)
+            )
+            metrics.increment("render_jobs_failed_total")
+        return retry
+
+    def supersede(self, user_id, keep_job_id):
+        """
+        Cancel the user's other pending jobs in favour of keep_job_id.
+
+        Jobs of actions in inflight.KEEP_ACTIONS are left alone. A worker
+        rendering a superseded job loses its lease and abandons the render.
+
+        Args:
+            user_id (int): User whose jobs are superseded
+            keep_job_id (int): The newly enqueued job
+
+        Returns:
+            int: Number of jobs superseded
+        """
+        from inflight import supersedes
+
+        jobs = self._execute(
+            "SELECT id, effect FROM render_jobs WHERE user_id = ? AND id <> ? "
+            "AND status IN ('queued', 'leased')", (user_id, keep_job_id), fetch="all"
+        )
+        superseded = 0
+        for job in jobs:
+            if supersedes(job["effect"]):
+                superseded += self._execute(
+                    "UPDATE render_jobs SET status = 'superseded', lease_owner = NULL, lease_expires_at = NULL, "
+                    "updated_at = ? WHERE id = ? AND status IN ('queued', 'leased')", (time.time(), job["id"])
+                )
+        if superseded:
+            metrics.increment("renders_superseded_total", superseded)
+        return superseded
+
+    def reap_exhausted(self):
+        """
+        Fail leased jobs whose lease expired on their last attempt.
+
+        Returns:
+            list: The jobs that were marked as failed
+        """
+        now = time.time()
+        jobs = self._execute(
+            "SELECT * FROM render_jobs WHERE status = 'leased' AND lease_expires_at < ? "
+            "AND attempts >= max_attempts", (now,), fetch="all"
+        )
+        reaped = []
+        for job in jobs:
+            if self._execute(
+                "UPDATE render_jobs SET status = 'failed', error = 'lease expired', lease_owner = NULL, "
+                "updated_at = ? WHERE id = ? AND status = 'leased' AND lease_expires_at < ?",
+                (now, job["id"], now)
+            ):
+                reaped.append(job)
+        if reaped:
+            metrics.increment("render_jobs_failed_total", len(reaped))
+        return reaped
+
+    def depth(self):
+        """Return the number of queued and leased jobs."""
+        row = self._execute(
+            "SELECT COUNT(*) AS depth FROM render_jobs WHERE status IN ('queued', 'leased')", fetch="one"
+        )
+        return row["depth"] if row else 0
+
+
+_queue = None
+
+
+def get_queue():
+    """Return the process-wide JobQueue, creating it on first use."""
+    global _queue
+    if _queue is None:
+        _queue = JobQueue()
+    return _queue
+
+
+async def _notify(bot, job, text):
+    """Update the job's status message, or send a new one."""
+    import send_queue
+
+    try:
+        if job.get("status_message_id"):
+            await send_queue.bot_edit_message_text(
+                bot, job["chat_id"], message_id=job["status_message_id"], text=text, parse_mode="Markdown"
+            )
+        else:
+            await send_queue.send_message(bot, job["chat_id"], text=text, parse_mode="Markdown")
+    except Exception as e:
+        logger.warning(f"Could not update status of job {job['id']}: {str(e)}")
+
+
+async def process_job(bot, job, owner, queue=None):
+    """
+    Render one leased job and deliver the result to its chat.
+
+    Args:
+        bot (Bot): Bot used for downloads and delivery
+        job (dict): The leased job
+        owner (str): Identifier of the leasing worker
+        queue (JobQueue): Queue the job came from
+    """
+    from render_engine import render_effect
+    import send_queue
+
+    queue = queue or get_queue()
+    work_dir = tempfile.mkdtemp(prefix=f"job_{job['id']}_")
+    input_path = os.path.join(work_dir, "input.ogg")
+    output_path = os.path.join(work_dir, "output.ogg")
+    lease_lost = asyncio.Event()
+
+    async def keep_lease():
+        while True:
+            await asyncio.sleep(VISIBILITY_TIMEOUT / 3)
+            if not await asyncio.to_thread(queue.extend, job["id"], owner):
+                lease_lost.set()
+                return
+
+    keeper = asyncio.ensure_future(keep_lease())
+    render = lost = None
+    try:
+        file = await bot.get_file(job["input_file_id"])
+        await file.download_to_drive(input_path)
+
+        render = asyncio.ensure_future(render_effect(input_path, output_path, job["filter_chain"], effect=job["effect"]))
+        lost = asyncio.ensure_future(lease_lost.wait())
+        await asyncio.wait({render, lost}, return_when=asyncio.FIRST_COMPLETED)
+        if not render.done():
+            # Another worker owns the job now; stop and leave delivery to it.
+            # Wait for FFmpeg to be killed before its work dir is removed.
+            render.cancel()
+            await asyncio.wait({render})
+            logger.warning(f"Lost lease on job {job['id']}; abandoning it")
+            return
+        success, error_msg = render.result()
+        if not success:
+            raise RuntimeError(error_msg or "render failed")
+
+        with open(output_path, 'rb') as audio_file:
+            message = await send_queue.send_voice(
+                bot, job["chat_id"], voice=audio_file,
+                caption=f"🎧 Audio with *{job['effect']}* effect.", parse_mode="Markdown"
+            )
+        result_file_id = message.voice.file_id if message and message.voice else None
+        await asyncio.to_thread(queue.complete, job["id"], owner, result_file_id)
+        await _notify(bot, job, f"✅ Applied *{job['effect']}* effect!")
+    except Exception as e:
+        logger.error(f"Render job {job['id']} failed: {str(e)}")
+        if await asyncio.to_thread(queue.fail, job, owner, str(e)):
+            await _notify(bot, job, f"⏳ Retrying *{job['effect']}* effect...")
+        else:
+            await _notify(bot, job, "❌ Error applying effect. Please try again or choose another effect.")
+    finally:
+        keeper.cancel()
+        if lost is not None:
+            lost.cancel()
+        if render is not None and not render.done():
+            # This task was cancelled mid-render
+            render.cancel()
+            await asyncio.wait({render})
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+async def run_worker(bot, owner, queue=None):
+    """Lease and process jobs forever."""
+    queue = queue or get_queue()
+    while True:
+        try:
+            job = await asyncio.to_thread(queue.lease, owner)
+        except Exception as e:
+            logger.error(f"Could not lease render job: {str(e)}")
+            job = None
+        if job is None:
+            await asyncio.sleep(POLL_INTERVAL)
+            continue
+        try:
+            await process_job(bot, job, owner, queue)
+        except Exception as e:
+            # e.g. the database failed while recording the outcome; the lease
+            # expires and the job is retried, but this worker keeps going
+            logger.error(f"Render worker error on job {job['id']}: {str(e)}")
+
+
+async def run_reaper(bot, queue=None):
+    """Tell users about jobs that ran out of attempts on a dead node."""
+    queue = queue or get_queue()
+    while True:
+        await asyncio.sleep(VISIBILITY_TIMEOUT)
+        try:
+            for job in await asyncio.to_thread(queue.reap_exhausted):
+                await _notify(bot, job, "❌ Error applying effect. Please try again or choose another effect.")
+            metrics.set_gauge("render_queue_depth", await asyncio.to_thread(queue.depth))
+        except Exception as e:
+            logger.error(f"Render job reaper failed: {str(e)}")
+
+
+async def start_workers(application):
+    """
+    Start this node's render workers (usable as Application.post_init).
+
+    Args:
+        application (Application): The running bot application
+    """
+    if RENDER_QUEUE != "durable":
+        return
+    node = f"{socket.gethostname()}:{os.getpid()}"
+    for index in range(CONCURRENCY):
+        asyncio.ensure_future(run_worker(application.bot, f"{node}:{index}"))
+    asyncio.ensure_future(run_reaper(application.bot))
+    logger.info(f"Started {CONCURRENCY} durable render workers on {node}")
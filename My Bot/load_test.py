@@ -0,0 +1,263 @@
+"""
+Offline load test: simulated users drive the bot through fake_telegram.
+
+Starts a FakeTelegram server (optionally slow and throttling), runs
+simple_bot.main against it in a subprocess using long polling, and lets
+virtual users replay realistic sessions. Each session uploads a voice note
+with a length drawn from a short-heavy distribution and waits for the
+effect menu. Short clips then get one effect tap and a full render. Long
+clips get a few previews, maybe a page flip, and finally a "Send full
+version" tap. Every action is timed from the moment its update is queued
+to the bot's answer (the menu, the voice, the page edit or an error
+message), and the run reports throughput and latency percentiles.
+
+Usage:
+    python load_test.py --users 20 --duration 60 --latency 0.05 --retry-after-rate 0.02
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+
+import metrics
+from bench_render import make_input
+from effect_index import categories_from_source
+from fake_telegram import FakeTelegram
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Voice note lengths (seconds) and how often users send them
+CLIP_LENGTHS = [(2, 0.35), (4, 0.30), (8, 0.20), (15, 0.10), (30, 0.05)]
+
+# Must match the bot's RENDER_PREVIEW_SECONDS
+PREVIEW_SECONDS = float(os.environ.get('RENDER_PREVIEW_SECONDS', '15'))
+
+
+class Waiter:
+    """Waits for the bot's answer to one action of one user."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.event = threading.Event()
+        self.ok = False
+        self.message_id = None
+
+
+class LoadTest:
+    """Virtual users replaying sessions against a bot connected to a FakeTelegram."""
+
+    def __init__(self, fake, voice_files, effects, timeout=120.0, think=1.0):
+        self.fake = fake
+        self.voice_files = voice_files  # [(duration, file_id, weight)]
+        self.effects = effects
+        self.timeout = timeout
+        self.think = think
+        self.lock = threading.Lock()
+        self.waiters = {}    # chat_id: Waiter
+        self.results = {}    # kind: [latency]
+        self.failures = {}   # kind: count
+        self.timeouts = {}   # kind: count
+        fake.listeners.append(self.on_call)
+
+    def on_call(self, method, params, result):
+        """FakeTelegram listener: match the bot's calls to pending actions."""
+        try:
+            chat_id = int(params.get("chat_id"))
+        except (TypeError, ValueError):
+            return
+        with self.lock:
+            waiter = self.waiters.get(chat_id)
+        if waiter is None:
+            return
+        text = str(params.get("text") or params.get("caption") or "")
+        has_keyboard = "inline_keyboard" in str(params.get("reply_markup") or "")
+        done = None
+        if text.startswith(("❌", "⚠️")):
+            done = False
+        elif waiter.kind == "upload" and method == "sendMessage" and has_keyboard:
+            done = True
+        elif waiter.kind in ("preview", "render") and method == "sendVoice":
+            done = True
+        elif waiter.kind == "page" and method == "editMessageText" and has_keyboard:
+            done = True
+        if done is not None:
+            waiter.ok = done
+            waiter.message_id = result.get("message_id") if isinstance(result, dict) else None
+            waiter.event.set()
+
+    def act(self, user_id, kind, update):
+        """
+        Send one update and wait for the bot's answer.
+
+        Returns:
+            Waiter: The finished waiter, or None on timeout
+        """
+        waiter = Waiter(kind)
+        with self.lock:
+            self.waiters[user_id] = waiter
+        started = time.perf_counter()
+        self.fake.queue_update(update)
+        answered = waiter.event.wait(self.timeout)
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.waiters.pop(user_id, None)
+            if not answered:
+                self.timeouts[kind] = self.timeouts.get(kind, 0) + 1
+                return None
+            if waiter.ok:
+                self.results.setdefault(kind, []).append(elapsed)
+            else:
+                self.failures[kind] = self.failures.get(kind, 0) + 1
+        return waiter
+
+    def pick_effect(self):
+        # Popular effects come first in the catalog; weight them Zipf-like
+        weights = [1.0 / (rank + 1) for rank in range(len(self.effects))]
+        return random.choices(self.effects, weights)[0]
+
+    def session(self, user_id):
+        """One voice note and the taps that follow it."""
+        duration, file_id, _ = random.choices(self.voice_files, [weight for _, _, weight in self.voice_files])[0]
+        menu = self.act(user_id, "upload", self.fake.make_voice_update(user_id, file_id, duration))
+        if menu is None or not menu.ok:
+            return
+        message_id = menu.message_id or 1
+        time.sleep(random.expovariate(1.0 / self.think))
+
+        effect = self.pick_effect()
+        if duration > PREVIEW_SECONDS:
+            for _ in range(1 + min(3, int(random.expovariate(1.0)))):
+                if random.random() < 0.15:
+                    self.act(user_id, "page", self.fake.make_callback_update(user_id, "page:1", message_id))
+                effect = self.pick_effect()
+                if self.act(user_id, "preview", self.fake.make_callback_update(user_id, f"effect:{effect}", message_id)) is None:
+                    return
+                time.sleep(random.expovariate(1.0 / self.think))
+            self.act(user_id, "render", self.fake.make_callback_update(user_id, f"full:{effect}", message_id))
+        else:
+            self.act(user_id, "render", self.fake.make_callback_update(user_id, f"effect:{effect}", message_id))
+
+    def run(self, users, duration):
+        """
+        Run virtual users until the duration is over.
+
+        Returns:
+            float: Wall-clock seconds the run took
+        """
+        deadline = time.monotonic() + duration
+
+        def user(user_id):
+            while time.monotonic() < deadline:
+                self.session(user_id)
+                time.sleep(random.expovariate(1.0 / self.think))
+
+        threads = [threading.Thread(target=user, args=(100000 + index,), daemon=True) for index in range(users)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+    def report(self, wall):
+        """Print throughput and latency percentiles per action kind."""
+        everything = [value for values in self.results.values() for value in values]
+        print(f"\n{len(everything)} actions answered in {wall:.1f}s: {len(everything) / wall:.2f} actions/s, "
+              f"{len(self.results.get('render', [])) / wall:.2f} full renders/s")
+        print(f"{'action':<10} {'ok':>6} {'failed':>7} {'timeout':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        for kind in ("upload", "page", "preview", "render"):
+            values = self.results.get(kind, [])
+            if not values and not self.failures.get(kind) and not self.timeouts.get(kind):
+                continue
+            print(f"{kind:<10} {len(values):>6} {self.failures.get(kind, 0):>7} {self.timeouts.get(kind, 0):>8} "
+                  f"{metrics.percentile(values, 0.5) * 1000:>9.1f} {metrics.percentile(values, 0.9) * 1000:>9.1f} "
+                  f"{metrics.percentile(values, 0.99) * 1000:>9.1f} {max(values, default=0.0) * 1000:>9.1f}")
+        counts = {}
+        for method, _ in self.fake.calls:
+            counts[method] = counts.get(method, 0) + 1
+        counts.pop("getUpdates", None)
+        print(f"\nBot API calls: {', '.join(f'{method} {count}' for method, count in sorted(counts.items()))}")
+        print(f"Injected RetryAfter responses: {self.fake.retry_afters}")
+
+
+def start_bot(fake, log_path, extra_env=None):
+    """
+    Run simple_bot.main in a subprocess against the fake server.
+
+    Returns:
+        Popen: The bot process, already polling for updates
+    """
+    env = dict(os.environ)
+    env.update({
+        "TELEGRAM_BOT_TOKEN": "123456:FAKE",
+        "TELEGRAM_API_BASE_URL": fake.base_url,
+        "TELEGRAM_API_BASE_FILE_URL": fake.base_file_url,
+    })
+    env.update(extra_env or {})
+    log = open(log_path, "w")
+    process = subprocess.Popen(
+        [sys.executable, "-c", "import simple_bot; simple_bot.main()"],
+        cwd=BOT_DIR, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    deadline = time.monotonic() + 60
+    while not fake.calls_to("getUpdates"):
+        if process.poll() is not None or time.monotonic() > deadline:
+            process.kill()
+            raise RuntimeError(f"The bot did not start polling; see {log_path}")
+        time.sleep(0.1)
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the bot offline against a fake Bot API")
+    parser.add_argument("--users", type=int, default=10, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds to generate traffic")
+    parser.add_argument("--think", type=float, default=1.0, help="mean seconds users wait between actions")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds before an action counts as lost")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the fake API adds to every call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra seconds per call")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="fraction of sends answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after seconds of injected 429s")
+    parser.add_argument("--log", default="load_test_bot.log", help="bot output")
+    args = parser.parse_args()
+
+    effects = list(categories_from_source(os.path.join(BOT_DIR, "simple_bot.py")))
+    fake = FakeTelegram(
+        latency=args.latency, jitter=args.jitter,
+        retry_after_rate=args.retry_after_rate, retry_after=args.retry_after
+    ).start()
+    work_dir = tempfile.mkdtemp(prefix="load_test_")
+    bot = None
+    try:
+        voice_files = []
+        for duration, weight in CLIP_LENGTHS:
+            path = os.path.join(work_dir, f"voice_{duration}.ogg")
+            make_input(path, duration)
+            with open(path, "rb") as f:
+                voice_files.append((duration, fake.add_file(f.read()), weight))
+
+        bot = start_bot(fake, args.log)
+        print(f"{args.users} users for {args.duration:g}s, API latency {args.latency * 1000:.0f}"
+              f"+{args.jitter * 1000:.0f} ms, {args.retry_after_rate:.0%} RetryAfter")
+        test = LoadTest(fake, voice_files, effects, args.timeout, args.think)
+        wall = test.run(args.users, args.duration)
+        test.report(wall)
+    finally:
+        if bot is not None:
+            bot.terminate()
+            try:
+                bot.wait(10)
+            except subprocess.TimeoutExpired:
+                bot.kill()
+        fake.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Event-loop lag monitor and blocking-call detector.
+
+A heartbeat task on the event loop wakes up every LOOP_MONITOR_INTERVAL
+seconds; how late it wakes is the loop's scheduling lag, exported as the
+event_loop_lag_seconds histogram. A watchdog thread checks the heartbeat.
+When it is overdue by more than LOOP_LAG_THRESHOLD the loop is blocked
+right now, so the thread captures the loop thread's stack while the
+offending call is still on it. Once the loop recovers, the stall is logged
+with its duration, the handler it happened in and the blocking call site,
+and counted per handler in the metrics.
+
+The handler is the outermost frame of the bot's own code on the stack
+below library code (telegram, asyncio), e.g. handle_effect_selection; the
+call site is the innermost frame of the bot's own code, e.g. the
+subprocess.run line in utils.py.
+"""
+
+import os
+import re
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+
+import metrics
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Set to 0 to disable the monitor
+ENABLED = os.environ.get('LOOP_MONITOR', '1') != '0'
+
+# Seconds the loop may be blocked before the stall is captured and reported
+LAG_THRESHOLD = float(os.environ.get('LOOP_LAG_THRESHOLD', '0.1'))
+
+# Seconds between heartbeats
+INTERVAL = float(os.environ.get('LOOP_MONITOR_INTERVAL', '0.05'))
+
+# Frames of the captured stack included in the log
+STACK_DEPTH = 12
+
+# Frames from files in this directory are the bot's own code
+_BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _is_bot_frame(frame_summary):
+    filename = os.path.abspath(frame_summary.filename)
+    return os.path.dirname(filename) == _BOT_DIR and filename != os.path.abspath(__file__)
+
+
+def attribute(stack):
+    """
+    Find the handler and the blocking call site in a captured stack.
+
+    Args:
+        stack (traceback.StackSummary): Stack of the loop thread, outermost first
+
+    Returns:
+        str: Handler name, or None if no bot code is on the stack
+        str: "file:line function" of the innermost bot frame, or None
+    """
+    handler = site = None
+    # Walk outward from the innermost frame: the call site is the first bot
+    # frame, the handler the last one of that run of bot frames
+    for frame_summary in reversed(stack):
+        if _is_bot_frame(frame_summary):
+            if site is None:
+                site = f"{os.path.basename(frame_summary.filename)}:{frame_summary.lineno} {frame_summary.name}"
+            handler = frame_summary.name
+        elif site is not None:
+            break
+    return handler, site
+
+
+def _metric_name(handler):
+    return re.sub(r"[^A-Za-z0-9_]", "_", handler)
+
+
+class LoopMonitor:
+    """Measures scheduling lag of one event loop and reports what blocks it."""
+
+    def __init__(self, threshold=None, interval=None):
+        self.threshold = LAG_THRESHOLD if threshold is None else threshold
+        self.interval = interval or INTERVAL
+        self.loop = None
+        self.loop_thread_id = None
+        self.last_beat = None
+        self.stall = None
+        self.lock = threading.Lock()
+        self.offenders = {}  # handler: {"count", "total", "max", "site", "stack"}
+        self.task = None
+        self.thread = None
+
+    def start(self):
+        """Start monitoring the running event loop (call from inside the loop)."""
+        if self.task is not None and not self.task.done():
+            return
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.task = asyncio.ensure_future(self._heartbeat())
+        self.thread = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self.thread.start()
+        logger.info(f"Event loop monitor started (threshold {self.threshold * 1000:.0f} ms)")
+
+    def stop(self):
+        """Stop the heartbeat; the watchdog thread exits with it."""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _heartbeat(self):
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.last_beat = now
+            lag = max(0.0, now - before - self.interval)
+            metrics.observe("event_loop_lag_seconds", lag)
+            metrics.set_gauge("event_loop_lag_current_seconds", lag)
+
+    def _watch(self):
+        while self.task is not None and not self.loop.is_closed():
+            time.sleep(self.interval / 2)
+            beat = self.last_beat
+            if self.stall is None:
+                if time.monotonic() - beat - self.interval > self.threshold:
+                    self.stall = self._capture(beat)
+            elif beat != self.stall["beat"]:
+                # The loop is running again; the stall lasted until this beat
+                self._report(self.stall, beat - self.stall["beat"] - self.interval)
+                self.stall = None
+
+    def _capture(self, beat):
+        frame = sys._current_frames().get(self.loop_thread_id)
+        stack = traceback.extract_stack(frame) if frame is not None else traceback.StackSummary()
+        del frame
+        handler, site = attribute(stack)
+        if handler is None:
+            # No bot code on the stack: name the task the loop is stepping
+            task = asyncio.current_task(self.loop) if not self.loop.is_closed() else None
+            handler = task.get_name() if task is not None else "event_loop"
+        return {"beat": beat, "stack": stack, "handler": handler, "site": site}
+
+    def _report(self, stall, duration):
+        handler = stall["handler"]
+        with self.lock:
+            entry = self.offenders.setdefault(handler, {"count": 0, "total": 0.0, "max": 0.0})
+            entry["count"] += 1
+            entry["total"] += duration
+            if duration >= entry["max"]:
+                entry.update(max=duration, site=stall["site"], stack=stall["stack"])
+        name = _metric_name(handler)
+        metrics.increment("event_loop_blocked_total")
+        metrics.increment(f"event_loop_blocked_total_{name}")
+        metrics.observe("event_loop_blocked_seconds", duration)
+        metrics.observe(f"event_loop_blocked_seconds_{name}", duration)
+        site = f" at {stall['site']}" if stall["site"] else ""
+        stack = "".join(traceback.format_list(stall["stack"][-STACK_DEPTH:]))
+        logger.warning(f"Event loop blocked for {duration * 1000:.0f} ms in {handler}{site}\n{stack}")
+
+    def report(self):
+        """
+        Return the handlers that blocked the loop, worst first.
+
+        Returns:
+            list: (handler, count, total seconds, max seconds, call site of the worst stall)
+        """
+        with self.lock:
+            rows = [
+                (handler, entry["count"], entry["total"], entry["max"], entry.get("site"))
+                for handler, entry in self.offenders.items()
+            ]
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+
+
+# Process-wide monitor
+monitor = LoopMonitor()
+
+
+def start():
+    """Start the process-wide monitor on the running loop, unless disabled."""
+    if ENABLED:
+        monitor.start()
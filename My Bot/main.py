@@ -1,7 +1,11 @@
 import os
+import hmac
 import logging
 import threading
-from flask import Flask, render_template_string
+from flask import Flask, render_template_string, request, abort, jsonify
+import webhook
+import health
+import backend_selector
 
 # Configure logging
 logging.basicConfig(
@@ -13,6 +17,9 @@ logger = logging.getLogger(__name__)
 # Create Flask app for the web interface
 app = Flask(__name__)
 
+# Token required by the /admin endpoints (sent as X-Admin-Token); unset disables them
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
 @app.route('/')
 def home():
     """Render a simple homepage with information about the bot."""
@@ -85,16 +92,56 @@ def home():
             
             <div class="row mt-4">
                 <div class="col-12 text-center">
+                    {% if healthy %}
                     <p class="alert alert-success">
                         <strong>Status:</strong> The bot is currently running in the background. Visit Telegram to interact with it!
                     </p>
+                    {% elif no_bot %}
+                    <p class="alert alert-warning">
+                        <strong>Status:</strong> No bot runs in this web process. See <a href="/healthz">/healthz</a> for details.
+                    </p>
+                    {% else %}
+                    <p class="alert alert-danger">
+                        <strong>Status:</strong> The bot is not healthy. See <a href="/healthz">/healthz</a> for details.
+                    </p>
+                    {% endif %}
                 </div>
             </div>
         </div>
     </body>
     </html>
     """
-    return render_template_string(html)
+    status, report = health.healthz()
+    return render_template_string(html, healthy=status == 200, no_bot=not report["bot"])
+
+@app.route('/telegram/<secret>', methods=['POST'])
+def telegram_webhook(secret):
+    """Receive an update from Telegram and queue it for the bot dispatcher."""
+    if not webhook.is_valid_request(secret, request.headers.get('X-Telegram-Bot-Api-Secret-Token')):
+        abort(403)
+    if not webhook.enqueue_update(request.get_json(force=True, silent=True)):
+        # Telegram retries webhook deliveries that fail
+        abort(503)
+    return '', 200
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: the bot dispatcher is alive and FFmpeg is installed."""
+    status, report = health.healthz()
+    return jsonify(report), status
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: alive, and render workers and queue have room for more traffic."""
+    status, report = health.readyz()
+    return jsonify(report), status
+
+@app.route('/admin/backends')
+def admin_backends():
+    """Render backend decision table: timings per effect, clip length and backend."""
+    if not ADMIN_TOKEN or not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN):
+        abort(404)
+    return jsonify(backend_selector.selector.table())
 
 def run_flask():
     """Run the Flask web application."""
@@ -104,12 +151,20 @@ def run_flask():
         logger.warning(f"Could not start Flask server: {e}")
         logger.info("Web interface is already running in another process")
 
+# In webhook mode the web process runs the dispatcher (one per deployment, see webhook.py)
+if webhook.BOT_MODE == "webhook":
+    webhook.start_webhook_bot()
+
 if __name__ == "__main__":
-    # Start Flask in a separate thread
-    flask_thread = threading.Thread(target=run_flask)
-    flask_thread.daemon = True
-    flask_thread.start()
-    
-    # Import and run the bot in the main thread
-    from simple_bot import main
-    main()
+    if webhook.BOT_MODE == "webhook":
+        # Updates arrive through Flask; the dispatcher is already running
+        run_flask()
+    else:
+        # Start Flask in a separate thread
+        flask_thread = threading.Thread(target=run_flask)
+        flask_thread.daemon = True
+        flask_thread.start()
+        
+        # Import and run the bot in the main thread
+        from simple_bot import main
+        main()
@@ -0,0 +1,106 @@
+"""
+Minimal in-process metrics registry for the Telegram bot.
+
+Counters and gauges hold a single number; histograms keep a bounded window
+of recent observations so percentiles can be reported without any external
+monitoring dependency.
+"""
+
+import threading
+from collections import deque
+
+# Number of observations kept per histogram
+HISTOGRAM_WINDOW = 1000
+
+_lock = threading.Lock()
+_counters = {}    # name: value
+_gauges = {}      # name: value
+_histograms = {}  # name: deque of recent observations
+
+
+def increment(name, value=1):
+    """
+    Add a value to a counter.
+
+    Args:
+        name (str): Counter name
+        value (float): Amount to add
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name, value):
+    """
+    Set a gauge to its current value.
+
+    Args:
+        name (str): Gauge name
+        value (float): Current value
+    """
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name, value):
+    """
+    Record one observation in a histogram.
+
+    Args:
+        name (str): Histogram name
+        value (float): Observed value
+    """
+    with _lock:
+        if name not in _histograms:
+            _histograms[name] = deque(maxlen=HISTOGRAM_WINDOW)
+        _histograms[name].append(value)
+
+
+def percentile(values, fraction):
+    """
+    Return the nearest-rank percentile of a list of values.
+
+    Args:
+        values (list): Observations
+        fraction (float): Percentile as a fraction between 0 and 1
+
+    Returns:
+        float: The percentile, or 0.0 for an empty list
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def snapshot():
+    """
+    Return a copy of all metrics.
+
+    Returns:
+        dict: 'counters', 'gauges' and 'histograms' (count, mean, p50, p95, max)
+    """
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {name: list(values) for name, values in _histograms.items()}
+
+    summaries = {}
+    for name, values in histograms.items():
+        summaries[name] = {
+            "count": len(values),
+            "mean": sum(values) / len(values) if values else 0.0,
+            "p50": percentile(values, 0.5),
+            "p95": percentile(values, 0.95),
+            "max": max(values) if values else 0.0,
+        }
+    return {"counters": counters, "gauges": gauges, "histograms": summaries}
+
+
+def reset():
+    """Clear all metrics."""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
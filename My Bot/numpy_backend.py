@@ -0,0 +1,176 @@
+"""
+NumPy rendering backend for simple effect chains.
+
+Pitch shifts (asetrate + aresample), tremolo and volume changes are a few
+vector operations on the decoded canonical WAV, so this backend applies
+them in a worker thread and only starts FFmpeg to encode the result to
+Opus. Chains with any other filter, and inputs that are not mono 16-bit
+WAV, are not supported; the backend selector then uses another backend.
+
+NumPy is optional. AVAILABLE is False when it is not installed.
+"""
+
+import math
+import wave
+import asyncio
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import metrics
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+AVAILABLE = np is not None
+
+# Taps of the anti-aliasing filter applied before downsampling
+RESAMPLE_TAPS = 63
+
+_plans = {}  # filter chain: list of operations, or None if unsupported
+
+
+def plan(filter_chain):
+    """
+    Translate a filter chain into NumPy operations.
+
+    Args:
+        filter_chain (str): Canonical filter chain (see render_engine.canonical_chain)
+
+    Returns:
+        list: ("relabel" | "resample", rate), ("gain", factor) and
+            ("tremolo", frequency, depth) tuples, or None if the chain uses
+            anything this backend can't reproduce
+    """
+    if filter_chain in _plans:
+        return _plans[filter_chain]
+    from render_engine import parse_filter_chain, _sample_rate
+
+    operations = []
+    for name, positional, options in parse_filter_chain(filter_chain):
+        try:
+            if name == "aformat" and not positional and options == {"channel_layouts": "mono"}:
+                continue  # the canonical WAV is mono already
+            elif name in ("asetrate", "aresample") and len(positional) == 1 and not options:
+                rate = _sample_rate(positional[0])
+                if not rate:
+                    break
+                operations.append(("relabel" if name == "asetrate" else "resample", float(rate)))
+            elif name == "volume" and len(positional) == 1 and not options:
+                value = positional[0].strip()
+                if value.lower().endswith("db"):
+                    operations.append(("gain", 10.0 ** (float(value[:-2]) / 20.0)))
+                else:
+                    operations.append(("gain", float(value)))
+            elif name == "tremolo" and not positional and set(options) <= {"f", "d"}:
+                operations.append(("tremolo", float(options.get("f", "5")), float(options.get("d", "0.5"))))
+            else:
+                break
+        except ValueError:
+            break
+    else:
+        _plans[filter_chain] = operations
+        return operations
+    _plans[filter_chain] = None
+    return None
+
+
+def supports(input_path, filter_chain):
+    """Return True if this backend can render the chain on the input."""
+    return AVAILABLE and input_path.endswith(".wav") and plan(filter_chain) is not None
+
+
+def _lowpass(samples, cutoff):
+    """Windowed-sinc low-pass; cutoff in cycles per sample (0..0.5)."""
+    n = np.arange(RESAMPLE_TAPS) - (RESAMPLE_TAPS - 1) / 2
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.blackman(RESAMPLE_TAPS)
+    return np.convolve(samples, taps / taps.sum(), mode="same")
+
+
+def _resample(samples, source_rate, target_rate):
+    if abs(source_rate - target_rate) < 1e-6 or len(samples) == 0:
+        return samples
+    if target_rate < source_rate:
+        # Remove what the lower rate can't represent before interpolating
+        samples = _lowpass(samples, 0.45 * target_rate / source_rate)
+    count = max(1, int(round(len(samples) * target_rate / source_rate)))
+    positions = np.arange(count) * (source_rate / target_rate)
+    return np.interp(positions, np.arange(len(samples)), samples)
+
+
+def _tremolo(samples, sample_rate, frequency, depth):
+    # Same envelope as FFmpeg's tremolo filter
+    offset = 1.0 - depth / 2.0
+    phase = np.mod(frequency * np.arange(len(samples)) / sample_rate + 0.25, 1.0)
+    return samples * (np.sin(2 * math.pi * phase) * (1.0 - abs(offset)) + offset)
+
+
+def process(input_path, filter_chain):
+    """
+    Apply a supported chain to a mono 16-bit WAV file.
+
+    Args:
+        input_path (str): Canonical WAV file
+        filter_chain (str): Canonical filter chain
+
+    Returns:
+        bytes: Processed signed 16-bit little-endian PCM
+        int: Its sample rate
+    """
+    operations = plan(filter_chain)
+    if operations is None:
+        raise ValueError("filter chain not supported by the NumPy backend")
+    with wave.open(input_path, "rb") as source:
+        if source.getnchannels() != 1 or source.getsampwidth() != 2:
+            raise ValueError("input is not mono 16-bit PCM")
+        rate = float(source.getframerate())
+        samples = np.frombuffer(source.readframes(source.getnframes()), dtype="<i2").astype(np.float32) / 32768.0
+
+    for operation in operations:
+        if operation[0] == "relabel":
+            rate = operation[1]
+        elif operation[0] == "resample":
+            samples = _resample(samples, rate, operation[1])
+            rate = operation[1]
+        elif operation[0] == "gain":
+            samples = samples * operation[1]
+        elif operation[0] == "tremolo":
+            samples = _tremolo(samples, rate, operation[1], operation[2])
+
+    pcm = np.clip(np.round(samples * 32768.0), -32768, 32767).astype("<i2")
+    return pcm.tobytes(), int(round(rate))
+
+
+async def render_effect(input_path, output_path, filter_chain, progress_callback=None):
+    """
+    Render an effect with NumPy and encode it with FFmpeg.
+
+    Args:
+        input_path (str): Canonical WAV file
+        output_path (str): Path where the processed file will be saved
+        filter_chain (str): Canonical filter chain
+        progress_callback (callable): Optional callback (sync or async)
+            receiving the completed fraction between 0 and 1
+
+    Returns:
+        bool: True if successful, False otherwise
+        str: Error message if unsuccessful, empty string otherwise
+    """
+    from render_engine import run_ffmpeg
+
+    try:
+        pcm, rate = await asyncio.to_thread(process, input_path, filter_chain)
+    except Exception as e:
+        return False, f"NumPy render failed: {str(e)}"
+    metrics.increment("numpy_renders_total")
+    return await run_ffmpeg(
+        ["ffmpeg", "-y", "-f", "s16le", "-ar", str(rate), "-ac", "1", "-i", "pipe:0", "-c:a", "libopus", output_path],
+        progress_callback, len(pcm) / 2 / rate, input_data=pcm
+    )
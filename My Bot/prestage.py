@@ -0,0 +1,151 @@
+"""
+Silence trimming and loudness normalization applied before the effect chain.
+
+Voice notes often start and end with seconds of silence that every effect
+would otherwise process, encode and upload (and 'areverse' moves to the
+front). This stage runs once on the decoded canonical PCM: an energy-based
+VAD over short frames drops leading and trailing silence and shortens long
+internal pauses, and a single gain brings the speech to a target level
+without clipping.
+
+The analysis is vectorized with NumPy. NumPy is optional; without it the
+stage is skipped and the audio is rendered as decoded.
+"""
+
+import os
+import time
+import wave
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import metrics
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+AVAILABLE = np is not None
+
+# Set to 0 to render uploads untouched
+ENABLED = os.environ.get('RENDER_PRESTAGE', '1') != '0'
+
+# Frames quieter than this are silence (dBFS RMS)
+SILENCE_THRESHOLD_DB = float(os.environ.get('RENDER_SILENCE_THRESHOLD_DB', '-40'))
+
+# Internal pauses are shortened to this many seconds
+MAX_PAUSE = float(os.environ.get('RENDER_MAX_PAUSE', '0.6'))
+
+# Speech level targeted by the loudness normalization (dBFS RMS, empty disables)
+LOUDNESS_TARGET_DB = os.environ.get('RENDER_LOUDNESS_TARGET_DB', '-20')
+
+# Analysis frame length and the silence kept around speech (seconds)
+FRAME_SECONDS = 0.02
+PAD_SECONDS = 0.1
+
+# Limits of the normalization gain (dB) and the highest allowed peak (dBFS)
+MAX_GAIN_DB = 20.0
+PEAK_CEILING_DB = -1.0
+
+
+def process_pcm(samples, sample_rate):
+    """
+    Trim silence from and normalize the loudness of mono PCM.
+
+    Args:
+        samples (numpy.ndarray): int16 mono samples
+        sample_rate (int): Sample rate in Hz
+
+    Returns:
+        numpy.ndarray: Processed int16 samples
+        float: Seconds of audio removed
+        float: Gain applied in dB
+    """
+    frame = max(1, int(sample_rate * FRAME_SECONDS))
+    count = len(samples) // frame
+    if count == 0:
+        return samples, 0.0, 0.0
+
+    audio = samples.astype(np.float32) / 32768.0
+    frames = audio[:count * frame].reshape(count, frame)
+    power = np.mean(frames * frames, axis=1)
+    level_db = 10.0 * np.log10(power + 1e-12)
+    voiced = level_db > SILENCE_THRESHOLD_DB
+    if not voiced.any():
+        # Nothing but silence (or a very quiet recording): leave it alone
+        return samples, 0.0, 0.0
+
+    # Keep a little silence around speech so word onsets and tails survive
+    pad = int(round(PAD_SECONDS / FRAME_SECONDS))
+    speech = np.convolve(voiced, np.ones(2 * pad + 1), mode="same") > 0
+
+    # Unvoiced runs [start, end): drop the edges, shorten long internal pauses
+    keep = np.ones(count, dtype=bool)
+    edges = np.diff(np.concatenate(([1], speech.astype(np.int8), [1])))
+    max_pause = int(round(MAX_PAUSE / FRAME_SECONDS))
+    for start, end in zip(np.flatnonzero(edges == -1), np.flatnonzero(edges == 1)):
+        if start == 0 or end == count:
+            keep[start:end] = False
+        elif end - start > max_pause:
+            keep[start + max_pause // 2:end - (max_pause - max_pause // 2)] = False
+
+    mask = np.repeat(keep, frame)
+    # Samples after the last whole frame follow that frame's decision
+    mask = np.concatenate((mask, np.full(len(audio) - len(mask), keep[-1])))
+    trimmed = audio[mask]
+
+    gain_db = 0.0
+    if LOUDNESS_TARGET_DB:
+        speech_db = 10.0 * np.log10(np.mean(power[voiced]) + 1e-12)
+        gain_db = min(float(LOUDNESS_TARGET_DB) - speech_db, MAX_GAIN_DB)
+        peak = float(np.max(np.abs(trimmed))) if len(trimmed) else 0.0
+        if peak > 0:
+            gain_db = min(gain_db, PEAK_CEILING_DB - 20.0 * np.log10(peak))
+        trimmed = trimmed * (10.0 ** (gain_db / 20.0))
+
+    result = np.clip(np.round(trimmed * 32768.0), -32768, 32767).astype(np.int16)
+    return result, (len(samples) - len(result)) / sample_rate, gain_db
+
+
+def process_file(wav_path):
+    """
+    Run the pre-stage in place on a mono 16-bit WAV file.
+
+    Args:
+        wav_path (str): Decoded canonical WAV file
+
+    Returns:
+        float: Seconds of audio removed (0.0 if the stage did not run)
+    """
+    if not (ENABLED and AVAILABLE):
+        return 0.0
+    started = time.perf_counter()
+    with wave.open(wav_path, "rb") as source:
+        if source.getnchannels() != 1 or source.getsampwidth() != 2:
+            logger.warning(f"Pre-stage expects mono 16-bit PCM, skipping {wav_path}")
+            return 0.0
+        sample_rate = source.getframerate()
+        samples = np.frombuffer(source.readframes(source.getnframes()), dtype="<i2")
+
+    processed, saved, gain_db = process_pcm(samples, sample_rate)
+
+    temp_path = f"{wav_path}.tmp"
+    with wave.open(temp_path, "wb") as target:
+        target.setnchannels(1)
+        target.setsampwidth(2)
+        target.setframerate(sample_rate)
+        target.writeframes(processed.astype("<i2").tobytes())
+    os.replace(temp_path, wav_path)
+
+    metrics.observe("prestage_seconds_saved", saved)
+    metrics.increment("prestage_seconds_saved_total", saved)
+    metrics.observe("prestage_gain_db", gain_db)
+    metrics.observe("prestage_run_seconds", time.perf_counter() - started)
+    logger.debug(f"Pre-stage removed {saved:.2f}s and applied {gain_db:+.1f} dB to {wav_path}")
+    return saved
@@ -0,0 +1,834 @@
+"""
+Asynchronous FFmpeg render engine used by the Telegram bot handlers.
+
+Short clips are rendered with a single FFmpeg process. Long clips whose
+filter chain only has short memory are split into overlapping segments that
+are rendered in parallel on separate cores and concatenated back together.
+"""
+
+import os
+import re
+import math
+import time
+import shutil
+import asyncio
+import inspect
+import logging
+import tempfile
+from fractions import Fraction
+
+import metrics
+import tracing
+import ffmpeg_limits
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Clips shorter than this are always rendered serially (seconds)
+PARALLEL_MIN_DURATION = float(os.environ.get('RENDER_PARALLEL_MIN_DURATION', '30'))
+
+# Smallest amount of new audio a single segment should carry (seconds)
+MIN_SEGMENT_DURATION = float(os.environ.get('RENDER_MIN_SEGMENT_DURATION', '10'))
+
+# Maximum number of segments rendered at the same time
+MAX_SEGMENTS = int(os.environ.get('RENDER_MAX_SEGMENTS', str(os.cpu_count() or 1)))
+
+# Seconds without FFmpeg progress output before a job is considered stalled
+STALL_TIMEOUT = float(os.environ.get('RENDER_STALL_TIMEOUT', '30'))
+
+# "auto" (fastest measured backend per effect, see backend_selector),
+# "subprocess" (FFmpeg CLI per job) or "pyav" (in-process libav, see av_backend)
+RENDER_BACKEND = os.environ.get('RENDER_BACKEND', 'auto')
+
+# Canonical internal format: every render first downmixes to mono at this
+# rate, and the effect chains are written relative to it. Voice needs no
+# more than 16-24 kHz; 24000 is also a native Opus rate.
+CANONICAL_SAMPLE_RATE = int(os.environ.get('RENDER_SAMPLE_RATE', '24000'))
+
+# Preview renders: input seconds (0 disables previews; shorter clips are
+# rendered in full at once, so most voice notes need a single tap), internal
+# sample rate and Opus bitrate
+PREVIEW_SECONDS = float(os.environ.get('RENDER_PREVIEW_SECONDS', '15'))
+PREVIEW_SAMPLE_RATE = int(os.environ.get('RENDER_PREVIEW_SAMPLE_RATE', '16000'))
+PREVIEW_BITRATE = os.environ.get('RENDER_PREVIEW_BITRATE', '16k')
+
+# Upper bound for -threads/-filter_threads of a single job
+MAX_THREADS = int(os.environ.get('RENDER_MAX_THREADS', str(os.cpu_count() or 1)))
+
+# Prefix of the error message returned for stalled jobs
+STALLED_ERROR = "FFmpeg stalled"
+
+# Echoes longer than this are treated as global filters (seconds)
+LONG_ECHO_LIMIT = 2.0
+
+# Pre-roll (seconds of input) each filter needs to settle its internal state.
+# Filters missing from this table are considered stateful and force the
+# serial path.
+FILTER_MEMORY = {
+    "aformat": 0.0,
+    "volume": 0.0,
+    "acrusher": 0.0,
+    "aresample": 0.01,
+    "asetrate": 0.0,
+    "atempo": 0.1,
+    "highpass": 0.05,
+    "lowpass": 0.05,
+    "bandpass": 0.05,
+    "equalizer": 0.05,
+    "afftfilt": 0.1,
+    "aeval": 0.0,
+    "acompressor": 0.5,
+    "compand": 1.0,
+    "tremolo": 0.0,
+    "vibrato": 0.05,
+    "flanger": 0.05,
+    "aphaser": 0.05,
+    "aecho": 0.0,
+}
+
+# Matches the time variable 't' in aeval/afftfilt expressions
+_TIME_VARIABLE = re.compile(r"(?<![A-Za-z_])t(?![A-Za-z_(])")
+
+# LFO based filters: option name and default frequency (Hz)
+LFO_FILTERS = {
+    "tremolo": ("f", "5"),
+    "vibrato": ("f", "5"),
+    "flanger": ("speed", "0.5"),
+    "aphaser": ("speed", "0.5"),
+}
+
+
+def _split_outside_quotes(text, separator):
+    """Split text on a separator, ignoring separators inside single quotes."""
+    parts = []
+    current = []
+    quoted = False
+    for char in text:
+        if char == "'":
+            quoted = not quoted
+        if char == separator and not quoted:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append("".join(current))
+    return parts
+
+
+def parse_filter_chain(filter_chain):
+    """
+    Parse an FFmpeg audio filter chain into its individual filters.
+
+    Args:
+        filter_chain (str): Comma separated FFmpeg filter chain
+
+    Returns:
+        list: (name, positional_args, keyword_args) tuples in chain order
+    """
+    filters = []
+    for item in _split_outside_quotes(filter_chain, ","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, arg_text = item.partition("=")
+        positional = []
+        options = {}
+        if arg_text:
+            for arg in _split_outside_quotes(arg_text, ":"):
+                key, sep, value = arg.partition("=")
+                if sep and key.isidentifier():
+                    options[key] = value
+                else:
+                    positional.append(arg)
+        filters.append((name.strip(), positional, options))
+    return filters
+
+
+def _sample_rate(expression):
+    """Evaluate an 'asetrate=44100*1.5' style rate expression."""
+    try:
+        rate = Fraction(1)
+        for factor in expression.split("*"):
+            rate *= Fraction(factor.strip())
+        return rate
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def analyze_filter_chain(filter_chain, sample_rate=48000):
+    """
+    Decide whether a filter chain can be rendered in independent segments.
+
+    Args:
+        filter_chain (str): FFmpeg filter chain
+        sample_rate (int): Sample rate of the decoded input
+
+    Returns:
+        dict: 'parallel' (bool), 'preroll' (input seconds of overlap needed),
+              'scale' (output duration / input duration as a Fraction),
+              'grid' (segment start alignment in input seconds, Fraction)
+              and 'reason' (why the chain must run serially, if it must)
+    """
+    reason = ""
+    scale = Fraction(1)
+    rate = Fraction(sample_rate)
+    preroll = 0.0
+    periods = []
+
+    for name, positional, options in parse_filter_chain(filter_chain):
+        # Keep walking after the first problem so 'scale' stays accurate
+        if name not in FILTER_MEMORY:
+            reason = reason or f"stateful filter '{name}'"
+            continue
+
+        if name == "aecho":
+            delays = options.get("delays") or (positional[2] if len(positional) > 2 else "1000")
+            try:
+                longest = max(float(d) for d in delays.split("|")) / 1000.0
+            except ValueError:
+                reason = reason or "unparseable aecho delays"
+                continue
+            if longest > LONG_ECHO_LIMIT:
+                reason = reason or f"long aecho ({longest:.1f}s)"
+            preroll += longest * float(1 / scale)
+        elif name in ("aeval", "afftfilt"):
+            expressions = " ".join(positional + list(options.values()))
+            if _TIME_VARIABLE.search(expressions):
+                reason = reason or f"time dependent expression in '{name}'"
+        elif name in LFO_FILTERS:
+            key, default = LFO_FILTERS[name]
+            try:
+                frequency = Fraction(options.get(key, default))
+            except (ValueError, ZeroDivisionError):
+                reason = reason or f"unparseable {name} frequency"
+                continue
+            # The LFO sees output time, so its period in input time shrinks
+            # or grows with the tempo changes applied before it.
+            periods.append(1 / (frequency * scale))
+
+        if name in ("asetrate", "aresample"):
+            new_rate = _sample_rate(positional[0] if positional else options.get("r", options.get("sample_rate", "")))
+            if not new_rate:
+                reason = reason or f"unparseable {name} rate"
+                continue
+            if name == "asetrate":
+                # Reinterpreting samples at a new rate stretches time
+                scale *= rate / new_rate
+            rate = new_rate
+        elif name == "atempo":
+            try:
+                scale /= Fraction(positional[0] if positional else options.get("tempo", "1"))
+            except (ValueError, ZeroDivisionError, IndexError):
+                reason = reason or "unparseable atempo"
+                continue
+
+        preroll += FILTER_MEMORY[name] * float(1 / scale)
+
+    grid = Fraction(0)
+    for period in periods:
+        if grid == 0:
+            grid = period
+        else:
+            # Least common multiple of two fractions
+            grid = Fraction(
+                math.lcm(grid.numerator, period.numerator),
+                math.gcd(grid.denominator, period.denominator)
+            )
+
+    if grid > MIN_SEGMENT_DURATION:
+        reason = reason or "LFO periods do not align with segment size"
+
+    return {"parallel": not reason, "preroll": preroll, "scale": scale, "grid": grid, "reason": reason}
+
+
+def plan_segments(duration, analysis, max_segments=None):
+    """
+    Split an input duration into segments for parallel rendering.
+
+    Args:
+        duration (float): Input duration in seconds
+        analysis (dict): Result of analyze_filter_chain
+        max_segments (int): Upper bound on the number of segments
+
+    Returns:
+        list: (input_start, preroll, length) tuples in input seconds, or an
+              empty list when the clip should be rendered serially
+    """
+    max_segments = max_segments or MAX_SEGMENTS
+    if not analysis["parallel"] or duration < PARALLEL_MIN_DURATION or max_segments < 2:
+        return []
+
+    count = min(max_segments, int(duration // MIN_SEGMENT_DURATION))
+    if count < 2:
+        return []
+
+    grid = float(analysis["grid"]) or 0.0
+    boundaries = [0.0]
+    for index in range(1, count):
+        boundary = duration * index / count
+        boundaries.append(boundary)
+    boundaries.append(duration)
+
+    segments = []
+    for index in range(count):
+        start = boundaries[index]
+        end = boundaries[index + 1]
+        preroll = min(analysis["preroll"], start)
+        read_start = start - preroll
+        if grid:
+            # Snap the read position down so LFO phases match the serial render
+            read_start = math.floor(read_start / grid) * grid
+            preroll = start - read_start
+        segments.append((read_start, preroll, end - start))
+    return segments
+
+
+# FFmpeg processes currently started by this process
+_active_jobs = 0
+
+
+def choose_threads(starting=1):
+    """
+    Pick the thread count for new FFmpeg jobs from the current occupancy.
+
+    A quiet machine gives a job several cores; once the running jobs cover
+    every core each job gets a single thread, so concurrent renders don't
+    oversubscribe the CPU. Load from other processes (e.g. the other bot
+    workers) is taken from the one-minute load average.
+
+    Args:
+        starting (int): Number of jobs about to start together
+
+    Returns:
+        int: Threads per job
+    """
+    cores = os.cpu_count() or 1
+    busy = _active_jobs
+    if hasattr(os, "getloadavg"):
+        busy = max(busy, int(os.getloadavg()[0]))
+    threads = max(1, min(MAX_THREADS, cores // (busy + starting)))
+    metrics.set_gauge("ffmpeg_pool_occupancy", busy)
+    metrics.set_gauge("ffmpeg_threads_per_job", threads)
+    metrics.observe("ffmpeg_threads_chosen", threads)
+    return threads
+
+
+async def _notify(progress_callback, fraction):
+    """Invoke a progress callback, awaiting it if it is a coroutine function."""
+    try:
+        result = progress_callback(min(max(fraction, 0.0), 1.0))
+        if inspect.isawaitable(result):
+            await result
+    except Exception as e:
+        logger.warning(f"Progress callback failed: {str(e)}")
+
+
+async def _feed_stdin(process, data, chunk_size=1 << 16):
+    """Write data to a process's stdin in chunks, then close it."""
+    view = memoryview(data)
+    try:
+        for offset in range(0, len(view), chunk_size):
+            process.stdin.write(view[offset:offset + chunk_size])
+            await process.stdin.drain()
+        process.stdin.close()
+    except (BrokenPipeError, ConnectionResetError):
+        # FFmpeg exited early; its exit status tells why
+        pass
+
+
+async def run_ffmpeg(cmd, progress_callback=None, expected_duration=None, stall_timeout=None, output_limit_mb=None,
+                     threads=None, input_data=None):
+    """
+    Run an FFmpeg command without blocking the event loop.
+
+    FFmpeg reports its position through '-progress pipe:1'. The position is
+    forwarded to progress_callback as a fraction of expected_duration, and a
+    process that reports nothing for stall_timeout seconds is killed. The
+    process runs under the limits of ffmpeg_limits and its watchdog.
+    The last element of cmd must be the output file.
+
+    Args:
+        cmd (list): Command line to execute
+        progress_callback (callable): Optional callback receiving a 0..1 fraction
+        expected_duration (float): Expected output duration in seconds
+        stall_timeout (float): Seconds without progress before the job is killed
+        output_limit_mb (int): Output size cap in MB, 0 for intermediate files
+        threads (int): Threads for decoding, filtering and encoding, chosen
+            from the current occupancy when omitted
+        input_data (bytes): Fed to FFmpeg's stdin, for commands reading "pipe:0"
+
+    Returns:
+        bool: True if successful, False otherwise
+        str: Error message if unsuccessful, empty string otherwise
+    """
+    global _active_jobs
+
+    stall_timeout = stall_timeout or STALL_TIMEOUT
+    threads = threads or choose_threads()
+    cmd = (
+        [cmd[0], "-progress", "pipe:1", "-nostats", "-filter_threads", str(threads)]
+        + list(cmd[1:-1]) + ["-threads", str(threads), cmd[-1]]
+    )
+    process = None
+    watch = None
+    stdin_task = None
+    _active_jobs += 1
+    with tracing.span("ffmpeg", threads=threads):
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *ffmpeg_limits.wrap_command(cmd, output_limit_mb),
+                stdin=asyncio.subprocess.PIPE if input_data is not None else None,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            ffmpeg_limits.apply_limits(process.pid, output_limit_mb)
+            watch = ffmpeg_limits.watchdog.watch(process.pid, cmd)
+            if input_data is not None:
+                stdin_task = asyncio.ensure_future(_feed_stdin(process, input_data))
+            # Drain stderr concurrently so a chatty FFmpeg can't fill the pipe
+            stderr_task = asyncio.ensure_future(process.stderr.read())
+
+            while True:
+                try:
+                    line = await asyncio.wait_for(process.stdout.readline(), stall_timeout)
+                except asyncio.TimeoutError:
+                    # Recorded so the watchdog leaves the process to us
+                    watch["killed"] = f"stalled for {stall_timeout:.0f}s"
+                    process.kill()
+                    await process.wait()
+                    stderr_task.cancel()
+                    error_msg = f"{STALLED_ERROR}: no progress for {stall_timeout:.0f}s"
+                    logger.error(f"{error_msg} ({' '.join(cmd)})")
+                    return False, error_msg
+                if not line:
+                    break
+                key, _, value = line.decode(errors="replace").strip().partition("=")
+                if key == "out_time_us" and progress_callback and expected_duration:
+                    try:
+                        position = int(value) / 1_000_000
+                    except ValueError:
+                        continue
+                    await _notify(progress_callback, position / expected_duration)
+
+            stderr = await stderr_task
+            await process.wait()
+            reason = ffmpeg_limits.exit_reason(process.returncode, watch["killed"])
+            if reason:
+                ffmpeg_limits.record_violation(reason, cmd)
+                return False, f"FFmpeg {reason}"
+            if process.returncode != 0:
+                error_msg = stderr.decode(errors="replace")
+                logger.error(f"FFmpeg error: {error_msg}")
+                return False, error_msg
+            return True, ""
+        except asyncio.CancelledError:
+            # A cancelled render (e.g. superseded by a newer one) must not leave FFmpeg running
+            if process is not None and process.returncode is None:
+                if watch is not None:
+                    watch["killed"] = "cancelled"
+                process.kill()
+                await asyncio.shield(process.wait())
+            raise
+        except Exception as e:
+            error_msg = str(e)
+            logger.error(f"Error running FFmpeg: {error_msg}")
+            return False, error_msg
+        finally:
+            _active_jobs -= 1
+            if stdin_task is not None:
+                stdin_task.cancel()
+            if process is not None:
+                ffmpeg_limits.watchdog.unwatch(process.pid)
+
+
+async def probe_audio(input_path):
+    """
+    Read the duration and sample rate of an audio file with ffprobe.
+
+    Args:
+        input_path (str): Path to the media file
+
+    Returns:
+        float: Duration in seconds, or 0.0 if it could not be determined
+        int: Sample rate of the first audio stream, or 48000 if unknown
+    """
+    duration, sample_rate = 0.0, 48000
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *ffmpeg_limits.wrap_command([
+                "ffprobe", "-v", "error", "-select_streams", "a:0",
+                "-show_entries", "stream=sample_rate:format=duration",
+                "-of", "default=noprint_wrappers=1", input_path
+            ]),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        ffmpeg_limits.apply_limits(process.pid)
+        stdout, _ = await process.communicate()
+        for line in stdout.decode().splitlines():
+            key, _, value = line.partition("=")
+            if key == "duration" and value not in ("", "N/A"):
+                duration = float(value)
+            elif key == "sample_rate" and value not in ("", "N/A"):
+                sample_rate = int(value)
+    except Exception as e:
+        logger.warning(f"Could not probe {input_path}: {str(e)}")
+    return duration, sample_rate
+
+
+def canonical_chain(filter_chain, sample_rate=None):
+    """
+    Prefix a filter chain with the conversion to the canonical format.
+
+    On input that is already canonical (e.g. the decoded WAV) the added
+    filters pass audio through unchanged.
+
+    Args:
+        filter_chain (str): Effect chain written for the canonical rate
+        sample_rate (int): Internal rate, CANONICAL_SAMPLE_RATE by default
+
+    Returns:
+        str: The chain preceded by a mono downmix and resample
+    """
+    prefix = f"aformat=channel_layouts=mono,aresample={sample_rate or CANONICAL_SAMPLE_RATE}"
+    return f"{prefix},{filter_chain}" if filter_chain else prefix
+
+
+def retarget_chain(filter_chain, source_rate, target_rate):
+    """
+    Rewrite a filter chain so it sounds the same on audio at another rate.
+
+    'asetrate' takes an absolute sample rate, so a chain written for
+    source_rate input shifts pitch by a different amount on target_rate
+    input. Scaling its rates by target_rate/source_rate keeps every pitch
+    and speed ratio, and an 'aresample' back to source_rate (the end of a
+    pitch shift) becomes one to target_rate. Other resample targets are
+    deliberate (e.g. the 8 kHz of lo-fi effects) and kept, as are the other
+    filters, which work in Hz or seconds.
+
+    Args:
+        filter_chain (str): Comma separated FFmpeg filter chain
+        source_rate (int): Sample rate the chain was applied to
+        target_rate (int): Sample rate the chain will be applied to
+
+    Returns:
+        str: The rewritten filter chain
+    """
+    ratio = Fraction(target_rate) / Fraction(source_rate)
+    if ratio == 1:
+        return filter_chain
+    items = []
+    for item in _split_outside_quotes(filter_chain, ","):
+        name, sep, args = item.strip().partition("=")
+        rate = None
+        if name in ("asetrate", "aresample") and args:
+            first, _, rest = args.partition(":")
+            key, _, value = first.rpartition("=")
+            rate = _sample_rate(value)
+            if name == "aresample" and rate != source_rate:
+                rate = None
+        if rate is None:
+            items.append(item.strip())
+            continue
+        scaled = rate * ratio
+        value = str(round(scaled)) if scaled.denominator != 1 else str(scaled.numerator)
+        first = f"{key}={value}" if key else value
+        items.append(f"{name}={first}" + (f":{rest}" if rest else ""))
+    return ",".join(items)
+
+
+def build_ffmpeg_command(input_path, output_path, filter_chain, codec="libopus", seek=None, length=None,
+                         bitrate=None):
+    """
+    Build the FFmpeg command line for one render.
+
+    Args:
+        input_path (str): Path to the input audio file
+        output_path (str): Path where the processed file will be saved
+        filter_chain (str): FFmpeg filter chain to apply
+        codec (str): Output audio codec
+        seek (float): Optional input start position in seconds
+        length (float): Optional amount of input to read in seconds
+        bitrate (str): Optional output bitrate, e.g. '16k'
+
+    Returns:
+        list: FFmpeg command line
+    """
+    cmd = ["ffmpeg", "-y"]
+    if seek is not None:
+        cmd += ["-ss", f"{seek:.6f}"]
+    if length is not None:
+        cmd += ["-t", f"{length:.6f}"]
+    cmd += ["-i", input_path]
+    if filter_chain:
+        cmd += ["-af", filter_chain]
+    cmd += ["-c:a", codec]
+    if bitrate:
+        cmd += ["-b:a", bitrate]
+    cmd.append(output_path)
+    return cmd
+
+
+async def _render_segmented(input_path, output_path, filter_chain, analysis, segments, progress_callback=None):
+    """Render segments in parallel and concatenate them into the output file."""
+    work_dir = tempfile.mkdtemp(prefix="segments_", dir=os.path.dirname(output_path) or ".")
+    try:
+        scale = float(analysis["scale"])
+        commands = []
+        segment_paths = []
+        for index, (read_start, preroll, length) in enumerate(segments):
+            segment_path = os.path.join(work_dir, f"segment_{index}.wav")
+            trim = f"atrim=start={preroll * scale:.6f}"
+            last = index == len(segments) - 1
+            if not last:
+                trim += f":duration={length * scale:.6f}"
+            segment_chain = f"{filter_chain},{trim},asetpts=PTS-STARTPTS"
+            commands.append(build_ffmpeg_command(
+                input_path, segment_path, segment_chain, codec="pcm_s16le",
+                seek=read_start, length=None if last else preroll + length
+            ))
+            segment_paths.append(segment_path)
+
+        # Segment rendering covers the first 90% of the reported progress
+        done = [0.0] * len(segments)
+
+        def segment_progress(index):
+            async def report(fraction):
+                done[index] = fraction
+                if progress_callback:
+                    await _notify(progress_callback, 0.9 * sum(done) / len(done))
+            return report
+
+        # The segments start together, so they share the free cores
+        threads = choose_threads(len(commands))
+        results = await asyncio.gather(*(
+            # Intermediate WAV segments are not capped; the final output is
+            run_ffmpeg(cmd, segment_progress(index), segments[index][2] * scale, output_limit_mb=0, threads=threads)
+            for index, cmd in enumerate(commands)
+        ))
+        for success, error_msg in results:
+            if not success:
+                return False, error_msg
+
+        cmd = ["ffmpeg", "-y"]
+        for segment_path in segment_paths:
+            cmd += ["-i", segment_path]
+        inputs = "".join(f"[{index}:a]" for index in range(len(segment_paths)))
+        cmd += [
+            "-filter_complex", f"{inputs}concat=n={len(segment_paths)}:v=0:a=1",
+            "-c:a", "libopus", output_path
+        ]
+        total = sum(length for _, _, length in segments) * scale
+
+        async def concat_progress(fraction):
+            if progress_callback:
+                await _notify(progress_callback, 0.9 + 0.1 * fraction)
+
+        return await run_ffmpeg(cmd, concat_progress, total)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# Set once the missing PyAV warning was logged
+_pyav_missing_logged = False
+
+
+async def _render_pyav(input_path, output_path, filter_chain, progress_callback=None):
+    """
+    Render with the in-process backend.
+
+    Returns:
+        bool: True if successful
+        str: Error message, or None if PyAV is not installed
+    """
+    global _pyav_missing_logged
+    import av_backend
+
+    if not av_backend.AVAILABLE:
+        # Only this call falls back; RENDER_BACKEND stays as configured
+        if not _pyav_missing_logged:
+            logger.warning("RENDER_BACKEND=pyav but PyAV is not installed; using FFmpeg subprocesses")
+            _pyav_missing_logged = True
+        return False, None
+    return await av_backend.render_effect(input_path, output_path, filter_chain, progress_callback)
+
+
+async def _render_in_process(backend, input_path, output_path, filter_chain, progress_callback=None):
+    """Render on the "pyav" or "numpy" backend."""
+    if backend == "pyav":
+        import av_backend
+        return await av_backend.render_effect(input_path, output_path, filter_chain, progress_callback)
+    import numpy_backend
+    return await numpy_backend.render_effect(input_path, output_path, filter_chain, progress_callback)
+
+
+async def render_effect(input_path, output_path, filter_chain, duration=None, progress_callback=None, effect=None):
+    """
+    Apply an FFmpeg filter chain to an audio file.
+
+    Long inputs with parallel-safe filter chains are rendered in segments on
+    several cores; everything else goes through a single FFmpeg process, or
+    in-process through PyAV when RENDER_BACKEND is "pyav". With "auto" the
+    backend selector picks whichever has been fastest for this effect and
+    clip length, and failed in-process renders are retried on FFmpeg.
+
+    Args:
+        input_path (str): Path to the input audio file
+        output_path (str): Path where the processed file will be saved
+        filter_chain (str): FFmpeg filter chain to apply, written for
+            CANONICAL_SAMPLE_RATE mono audio
+        duration (float): Input duration in seconds, probed when omitted
+        progress_callback (callable): Optional callback (sync or async)
+            receiving the completed fraction between 0 and 1
+        effect (str): Effect name the selector keeps timings under,
+            the chain itself when omitted
+
+    Returns:
+        bool: True if successful, False otherwise
+        str: Error message if unsuccessful, empty string otherwise
+    """
+    if not os.path.exists(input_path):
+        return False, f"Input file not found: {input_path}"
+
+    filter_chain = canonical_chain(filter_chain)
+    analysis = analyze_filter_chain(filter_chain)
+    selector = None
+    probed = None  # (duration, sample_rate) once the input was probed
+    if RENDER_BACKEND == "auto":
+        from backend_selector import selector as backend_selector, BASELINE
+
+        candidates = backend_selector.candidates(input_path, filter_chain)
+        if len(candidates) > 1:
+            selector = backend_selector
+            effect = effect or filter_chain
+            if duration is None:
+                probed = await probe_audio(input_path)
+                duration = probed[0]
+            backend = selector.choose(effect, duration, candidates)
+            if backend != BASELINE:
+                started = time.perf_counter()
+                success, error_msg = await _render_in_process(
+                    backend, input_path, output_path, filter_chain, progress_callback
+                )
+                selector.record(effect, duration, backend, time.perf_counter() - started, success)
+                if success:
+                    return True, ""
+                logger.warning(f"{backend} render failed ({error_msg}); falling back to FFmpeg")
+    elif RENDER_BACKEND == "pyav" and not (analysis["parallel"] and (duration or 0.0) >= PARALLEL_MIN_DURATION):
+        success, error_msg = await _render_pyav(input_path, output_path, filter_chain, progress_callback)
+        if success:
+            return True, ""
+        if error_msg is not None:
+            logger.warning(f"PyAV render failed ({error_msg}); falling back to FFmpeg")
+    started = time.perf_counter()
+    if analysis["parallel"] or progress_callback:
+        if probed is None:
+            probed = await probe_audio(input_path)
+        probed_duration, sample_rate = probed
+        if duration is None:
+            duration = probed_duration
+        analysis = analyze_filter_chain(filter_chain, sample_rate)
+    if analysis["reason"]:
+        logger.debug(f"Serial render: {analysis['reason']}")
+
+    segments = plan_segments(duration or 0.0, analysis)
+    if segments:
+        logger.info(f"Rendering {duration:.1f}s of audio in {len(segments)} parallel segments")
+        result = await _render_segmented(input_path, output_path, filter_chain, analysis, segments, progress_callback)
+    else:
+        expected_duration = (duration or 0.0) * float(analysis["scale"])
+        result = await run_ffmpeg(
+            build_ffmpeg_command(input_path, output_path, filter_chain),
+            progress_callback, expected_duration
+        )
+    if selector is not None:
+        selector.record(effect, duration, BASELINE, time.perf_counter() - started, result[0])
+    return result
+
+
+async def render_preview(input_path, output_path, filter_chain, seconds=None, input_data=None):
+    """
+    Render a quick, low-fidelity preview of an effect.
+
+    Works on the decoded WAV or straight on the upload (with -t, so only the
+    first seconds are read). Only the first seconds of input are decoded, the chain runs at
+    PREVIEW_SAMPLE_RATE instead of CANONICAL_SAMPLE_RATE (re-expressed so
+    pitch effects sound the same as the full render) and the result is
+    encoded at PREVIEW_BITRATE.
+
+    Args:
+        input_path (str): Path to the input audio file, or "pipe:0"
+        output_path (str): Path where the preview will be saved
+        filter_chain (str): FFmpeg filter chain written for CANONICAL_SAMPLE_RATE
+        seconds (float): Input seconds to preview, PREVIEW_SECONDS by default
+        input_data (bytes): The upload itself when input_path is "pipe:0"
+
+    Returns:
+        bool: True if successful, False otherwise
+        str: Error message if unsuccessful, empty string otherwise
+    """
+    if input_data is None and not os.path.exists(input_path):
+        return False, f"Input file not found: {input_path}"
+    seconds = seconds or PREVIEW_SECONDS
+    chain = canonical_chain(
+        retarget_chain(filter_chain, CANONICAL_SAMPLE_RATE, PREVIEW_SAMPLE_RATE) if filter_chain else "",
+        PREVIEW_SAMPLE_RATE
+    )
+    metrics.increment("preview_renders_total")
+    return await run_ffmpeg(
+        build_ffmpeg_command(input_path, output_path, chain, length=seconds, bitrate=PREVIEW_BITRATE),
+        expected_duration=seconds, input_data=input_data
+    )
+
+
+async def decode_to_pcm(input_path, output_path, input_data=None):
+    """
+    Decode an upload once to canonical mono WAV at CANONICAL_SAMPLE_RATE, so
+    later renders skip the Opus/MP3 decode and the format conversion.
+
+    Args:
+        input_path (str): Path to the uploaded audio file, or "pipe:0"
+        output_path (str): Path of the WAV file to write
+        input_data (bytes): The upload itself when input_path is "pipe:0"
+
+    Returns:
+        bool: True if successful, False otherwise
+        str: Error message if unsuccessful, empty string otherwise
+    """
+    return await run_ffmpeg(
+        ["ffmpeg", "-y", "-i", input_path, "-ac", "1", "-ar", str(CANONICAL_SAMPLE_RATE),
+         "-c:a", "pcm_s16le", output_path],
+        output_limit_mb=0, threads=1, input_data=input_data
+    )
+
+
+async def prepare_input(input_path, wav_path, input_data=None):
+    """
+    Decode an upload to canonical WAV and run the silence/loudness pre-stage.
+
+    Args:
+        input_path (str): Path to the uploaded audio file, or "pipe:0"
+        wav_path (str): Path of the WAV file to write
+        input_data (bytes): The upload itself when input_path is "pipe:0"
+
+    Returns:
+        bool: True if successful, False otherwise
+        str: Error message if unsuccessful, empty string otherwise
+    """
+    import prestage
+
+    with tracing.span("decode"):
+        success, error_msg = await decode_to_pcm(input_path, wav_path, input_data)
+    if not success:
+        return success, error_msg
+    try:
+        with tracing.span("prestage"):
+            await asyncio.to_thread(prestage.process_file, wav_path)
+    except Exception as e:
+        # The untrimmed decode is still a valid input
+        logger.warning(f"Pre-stage failed for {wav_path}: {str(e)}")
+    return True, ""
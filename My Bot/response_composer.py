@@ -0,0 +1,126 @@
+"""
+Compose the Bot API calls that answer a rendered effect.
+
+A rendered effect used to cost three sequential round trips: a status edit,
+the voice upload and a follow-up message carrying the "Apply another effect"
+keyboard. The composer attaches the keyboard to the voice message itself,
+sends independent calls concurrently and skips the "Processing" status edit
+when the render finishes quickly.
+"""
+
+import os
+import asyncio
+import logging
+
+import metrics
+import send_queue
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Renders finishing faster than this never show a "Processing" status (seconds)
+FAST_RENDER_THRESHOLD = float(os.environ.get('FAST_RENDER_THRESHOLD', '1.0'))
+
+
+class ResponseComposer:
+    """Sends and counts the Bot API calls for one callback query."""
+
+    def __init__(self, query, bot, chat_id, fast_threshold=None):
+        """
+        Args:
+            query (CallbackQuery): The callback query being answered
+            bot (Bot): Bot used for sending new messages
+            chat_id (int): Chat receiving the rendered audio
+            fast_threshold (float): Seconds a render may take before the
+                status message is edited
+        """
+        self.query = query
+        self.bot = bot
+        self.chat_id = chat_id
+        self.fast_threshold = FAST_RENDER_THRESHOLD if fast_threshold is None else fast_threshold
+        self.api_calls = 0
+        self.status_shown = False
+
+    async def call(self, method, *args, **kwargs):
+        """Invoke one queued Bot API helper from send_queue and count it."""
+        self.api_calls += 1
+        return await method(*args, **kwargs)
+
+    async def edit(self, text, **kwargs):
+        """Edit the message the callback query belongs to (its caption for voice messages)."""
+        message = self.query.message
+        if message is not None and message.text is None and message.caption is not None:
+            return await self.call(send_queue.edit_message_caption, self.query, caption=text, **kwargs)
+        return await self.call(send_queue.edit_message_text, self.query, text, **kwargs)
+
+    async def edit_progress(self, text, **kwargs):
+        """Cosmetic progress edit: lowest priority, dropped if it goes stale."""
+        return await self.edit(
+            text, priority=send_queue.PRIORITY_PROGRESS,
+            max_wait=send_queue.PROGRESS_MAX_WAIT, **kwargs
+        )
+
+    async def render(self, status_text, render_coro):
+        """
+        Await a render, showing status_text only if it is not fast.
+
+        Args:
+            status_text (str): Markdown status shown while rendering
+            render_coro (coroutine): The render to run
+
+        Returns:
+            The result of render_coro
+        """
+        task = asyncio.ensure_future(render_coro)
+        done, _ = await asyncio.wait({task}, timeout=self.fast_threshold)
+        if not done:
+            self.status_shown = True
+            try:
+                await self.edit(status_text, parse_mode="Markdown")
+            except Exception as e:
+                logger.warning(f"Could not show processing status: {str(e)}")
+        return await task
+
+    async def deliver(self, done_text, voice_path, caption, reply_markup=None):
+        """
+        Send the rendered voice and the final status edit concurrently.
+
+        Args:
+            done_text (str): Markdown text replacing the effect menu
+            voice_path (str): Path to the rendered audio
+            caption (str): Markdown caption of the voice message
+            reply_markup (InlineKeyboardMarkup): Keyboard attached to the voice
+
+        Returns:
+            Message: The sent voice message
+        """
+        with open(voice_path, 'rb') as audio_file:
+            edit_result, send_result = await asyncio.gather(
+                self.edit(done_text, parse_mode="Markdown"),
+                self.call(
+                    send_queue.send_voice,
+                    self.bot,
+                    self.chat_id,
+                    voice=audio_file,
+                    caption=caption,
+                    parse_mode="Markdown",
+                    reply_markup=reply_markup
+                ),
+                return_exceptions=True
+            )
+        if isinstance(edit_result, Exception):
+            logger.warning(f"Could not update status message: {str(edit_result)}")
+        if isinstance(send_result, Exception):
+            raise send_result
+        return send_result
+
+    def finish(self):
+        """Record the number of API calls this request needed."""
+        metrics.observe("bot_api_calls_per_request", self.api_calls)
+        metrics.increment("bot_api_calls_total", self.api_calls)
+        if not self.status_shown:
+            metrics.increment("status_edits_skipped_total")
@@ -0,0 +1,397 @@
+"""
+Multi-process bot runtime: one update ingester, N worker processes.
+
+The ingester (long polling or the Flask webhook) routes every update to a
+worker process chosen by a consistent hash of the user id, so all updates
+of one user land on the same worker together with that user's in-memory
+state. A supervisor restarts crashed or hung workers and drains them
+gracefully on shutdown.
+
+Usage:
+    python runtime.py --workers 4 --mode polling
+"""
+
+import os
+import sys
+import time
+import queue
+import signal
+import asyncio
+import hashlib
+import logging
+import argparse
+import threading
+import multiprocessing
+
+import metrics
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Number of worker processes
+WORKERS = int(os.environ.get('BOT_WORKERS', str(os.cpu_count() or 1)))
+
+# Workers refresh their heartbeat this often (seconds)
+HEARTBEAT_INTERVAL = 1.0
+
+# A worker whose heartbeat is older than this is considered hung (seconds)
+HEARTBEAT_TIMEOUT = float(os.environ.get('BOT_WORKER_HEARTBEAT_TIMEOUT', '30'))
+
+# Seconds a worker may spend finishing queued updates on shutdown
+DRAIN_TIMEOUT = float(os.environ.get('BOT_DRAIN_TIMEOUT', '60'))
+
+# Restart back-off bounds for crash-looping workers (seconds)
+RESTART_BACKOFF_MIN = 1.0
+RESTART_BACKOFF_MAX = 30.0
+
+
+def jump_hash(key, buckets):
+    """
+    Jump consistent hash (Lamping & Veach) of a key onto a bucket.
+
+    Args:
+        key (int): Key to place, e.g. a user id
+        buckets (int): Number of buckets
+
+    Returns:
+        int: Bucket index in range(buckets)
+    """
+    # Spread small sequential ids over the 64-bit space first
+    key = int.from_bytes(hashlib.blake2b(str(key).encode(), digest_size=8).digest(), "big")
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return b
+
+
+def routing_key(payload):
+    """
+    Extract the user (or chat) id from a raw update payload.
+
+    Args:
+        payload (dict): Update JSON
+
+    Returns:
+        int: Routing key, 0 for updates without a user or chat
+    """
+    for field in ("message", "edited_message", "callback_query", "inline_query", "chosen_inline_result"):
+        item = payload.get(field)
+        if item:
+            sender = item.get("from") or item.get("chat") or {}
+            return sender.get("id", 0)
+    return 0
+
+
+def _worker_main(index, update_queue, heartbeat, load):
+    """Entry point of a worker process."""
+    # Ctrl-C reaches the whole process group; workers drain on the sentinel instead
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.getLogger(__name__).info(f"Worker {index} starting (pid {os.getpid()})")
+    asyncio.run(_worker_loop(index, update_queue, heartbeat, load))
+
+
+async def _worker_loop(index, update_queue, heartbeat, load):
+    from telegram import Update
+    from inflight import renders
+    from simple_bot import create_application
+
+    application = create_application()
+    await application.initialize()
+    await application.start()
+    # run_polling/run_webhook would call post_init; do it by hand here
+    if application.post_init:
+        await application.post_init(application)
+    loop = asyncio.get_running_loop()
+
+    async def beat():
+        while True:
+            heartbeat.value = time.time()
+            # The renders happen here, so the ingester's readiness reads them from us
+            gauges = metrics.snapshot()["gauges"]
+            load[0] = gauges.get("ffmpeg_jobs_running", 0)
+            load[1] = renders.count()
+            load[2] = gauges.get("event_loop_lag_current_seconds", 0.0)
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    beat_task = asyncio.ensure_future(beat())
+    try:
+        while True:
+            try:
+                payload = await loop.run_in_executor(None, update_queue.get, True, HEARTBEAT_INTERVAL)
+            except queue.Empty:
+                continue
+            if payload is None:
+                break
+            await application.update_queue.put(Update.de_json(payload, application.bot))
+
+        # Drain: wait for queued and in-flight updates to finish
+        processor = application.update_processor
+        deadline = time.monotonic() + DRAIN_TIMEOUT
+        while time.monotonic() < deadline:
+            active = getattr(processor, "active_updates", 0)
+            if application.update_queue.empty() and active == 0:
+                break
+            await asyncio.sleep(0.2)
+        else:
+            logger.warning(f"Worker {index} drain timed out")
+    finally:
+        beat_task.cancel()
+        await application.stop()
+        await application.shutdown()
+        logger.info(f"Worker {index} stopped")
+
+
+class WorkerPool:
+    """Supervises the worker processes and routes updates to them."""
+
+    def __init__(self, workers=None):
+        self.size = workers or WORKERS
+        self.context = multiprocessing.get_context("spawn")
+        self.queues = [self.context.Queue() for _ in range(self.size)]
+        self.heartbeats = [self.context.Value("d", 0.0) for _ in range(self.size)]
+        # Per worker: FFmpeg jobs running, renders in flight, event-loop lag
+        self.loads = [self.context.Array("d", 3) for _ in range(self.size)]
+        self.processes = [None] * self.size
+        self.restarts = [0] * self.size
+        # When a dead worker is due to be respawned (None: no restart pending)
+        self.next_start = [None] * self.size
+        self.stopping = False
+        self._monitor = None
+
+    def _spawn(self, index):
+        self.heartbeats[index].value = time.time()
+        self.loads[index][:] = [0.0, 0.0, 0.0]
+        process = self.context.Process(
+            target=_worker_main,
+            args=(index, self.queues[index], self.heartbeats[index], self.loads[index]),
+            name=f"bot-worker-{index}",
+            daemon=False
+        )
+        process.start()
+        self.processes[index] = process
+
+    def start(self):
+        """Start all workers and the health monitor."""
+        for index in range(self.size):
+            self._spawn(index)
+        self._monitor = threading.Thread(target=self._monitor_loop, name="worker-monitor", daemon=True)
+        self._monitor.start()
+        logger.info(f"Started {self.size} bot workers")
+
+    def dispatch(self, payload):
+        """
+        Route a raw update to its worker.
+
+        Args:
+            payload (dict): Update JSON
+
+        Returns:
+            bool: True if the update was queued
+        """
+        if self.stopping:
+            return False
+        index = jump_hash(routing_key(payload), self.size)
+        # The queue outlives worker restarts, so nothing is lost while one restarts
+        self.queues[index].put(payload)
+        metrics.increment("runtime_updates_routed_total")
+        return True
+
+    def status(self):
+        """
+        Report worker health.
+
+        Returns:
+            list: One dict per worker with pid, alive, heartbeat_age, restarts
+        """
+        now = time.time()
+        report = []
+        for index, process in enumerate(self.processes):
+            report.append({
+                "worker": index,
+                "pid": process.pid if process else None,
+                "alive": bool(process and process.is_alive()),
+                "heartbeat_age": round(now - self.heartbeats[index].value, 1),
+                "restarts": self.restarts[index],
+            })
+        return report
+
+    def liveness(self):
+        """Health check: at least one worker is alive with a fresh heartbeat."""
+        workers = self.status()
+        alive = sum(1 for worker in workers if worker["alive"] and worker["heartbeat_age"] <= HEARTBEAT_TIMEOUT)
+        return alive > 0, f"{alive}/{len(workers)} workers alive"
+
+    def load(self):
+        """
+        Combine the render load the workers report with their heartbeats.
+
+        Returns:
+            dict: "processes", "busy" (FFmpeg jobs running), "renders" (in
+                flight) and "loop_lag_seconds" (the worst worker's), as
+                health.set_load_source expects
+        """
+        busy = renders = lag = 0.0
+        for index, process in enumerate(self.processes):
+            if not (process and process.is_alive()):
+                continue
+            values = self.loads[index][:]
+            busy += values[0]
+            renders += values[1]
+            lag = max(lag, values[2])
+        return {"processes": self.size, "busy": int(busy), "renders": int(renders), "loop_lag_seconds": lag}
+
+    def _monitor_loop(self):
+        while not self.stopping:
+            now = time.time()
+            alive = 0
+            for index, process in enumerate(self.processes):
+                if self.stopping:
+                    break
+                hung = now - self.heartbeats[index].value > HEARTBEAT_TIMEOUT
+                if process.is_alive() and not hung:
+                    alive += 1
+                    continue
+                if self.next_start[index] is None:
+                    if hung and process.is_alive():
+                        logger.error(f"Worker {index} (pid {process.pid}) missed heartbeats; killing it")
+                        process.kill()
+                        process.join(5)
+                    else:
+                        logger.error(f"Worker {index} (pid {process.pid}) exited with code {process.exitcode}")
+                    self.restarts[index] += 1
+                    backoff = min(RESTART_BACKOFF_MAX, RESTART_BACKOFF_MIN * 2 ** min(self.restarts[index] - 1, 5))
+                    # Even the first restart waits, so a worker crashing on start-up can't spin
+                    self.next_start[index] = now + backoff
+                    logger.info(f"Restarting worker {index} in {backoff:.0f}s")
+                if now < self.next_start[index]:
+                    continue
+                self.next_start[index] = None
+                metrics.increment("runtime_worker_restarts_total")
+                self._spawn(index)
+            metrics.set_gauge("runtime_workers_alive", alive)
+            time.sleep(HEARTBEAT_INTERVAL)
+
+    def drain(self):
+        """Stop routing, let every worker finish its queue, then wait for exit."""
+        self.stopping = True
+        for worker_queue in self.queues:
+            worker_queue.put(None)
+        deadline = time.monotonic() + DRAIN_TIMEOUT + 10
+        for index, process in enumerate(self.processes):
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Worker {index} did not drain in time; terminating")
+                process.terminate()
+                process.join(5)
+        logger.info("All bot workers stopped")
+
+
+async def run_polling_ingester(pool, stop_event):
+    """
+    Long-poll Telegram and route each update to the worker pool.
+
+    Updates are acknowledged (by advancing the offset) only after they were
+    handed to a worker queue.
+    """
+    from dispatcher import build_application
+    from simple_bot import BOT_TOKEN
+
+    bot = build_application(BOT_TOKEN, concurrent_updates=0).bot
+    await bot.initialize()
+    await bot.delete_webhook()
+    offset = None
+    try:
+        while not stop_event.is_set():
+            try:
+                updates = await bot.get_updates(
+                    offset=offset, timeout=10, allowed_updates=["message", "callback_query", "inline_query"]
+                )
+            except Exception as e:
+                logger.error(f"getUpdates failed: {str(e)}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                pool.dispatch(update.to_dict())
+                offset = update.update_id + 1
+    finally:
+        await bot.shutdown()
+
+
+async def run_webhook_registration(stop_event):
+    """
+    Register the webhook with Telegram, then wait for shutdown.
+
+    The Flask thread receives the updates; this only tells Telegram where to
+    send them, as WebhookBot does in single-process webhook mode.
+    """
+    from dispatcher import build_application
+    from simple_bot import BOT_TOKEN
+    import webhook
+
+    bot = build_application(BOT_TOKEN, concurrent_updates=0).bot
+    try:
+        await bot.initialize()
+        await webhook.register_webhook(bot)
+    except Exception as e:
+        logger.error(f"setWebhook failed; no updates will arrive until the webhook is registered: {str(e)}")
+    finally:
+        await bot.shutdown()
+    await stop_event.wait()
+
+
+def run(workers=None, mode=None):
+    """
+    Run the ingester and worker pool until SIGINT/SIGTERM.
+
+    Args:
+        workers (int): Number of worker processes
+        mode (str): "polling" or "webhook"
+    """
+    import health
+    import webhook
+
+    mode = mode or webhook.BOT_MODE
+    pool = WorkerPool(workers)
+    pool.start()
+    health.register_liveness("workers", pool.liveness)
+    health.set_load_source(pool.load)
+
+    if mode == "webhook":
+        # Flask receives the webhooks in this process and forwards them
+        webhook.set_update_sink(pool.dispatch)
+        from main import run_flask
+        threading.Thread(target=run_flask, name="flask", daemon=True).start()
+
+    async def ingest():
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+        if mode == "webhook":
+            await run_webhook_registration(stop_event)
+        else:
+            await run_polling_ingester(pool, stop_event)
+
+    try:
+        asyncio.run(ingest())
+    finally:
+        logger.info("Shutting down: draining workers")
+        pool.drain()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the bot with one ingester and N worker processes")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--mode", choices=["polling", "webhook"], default=None, help="update ingestion mode")
+    args = parser.parse_args()
+
+    if not os.environ.get('TELEGRAM_BOT_TOKEN'):
+        logger.error("TELEGRAM_BOT_TOKEN environment variable not set!")
+        sys.exit(1)
+    run(args.workers, args.mode)
@@ -0,0 +1,309 @@
+"""
+Outbound Bot API send queue with Telegram-aware rate limiting.
+
+Every outgoing call passes through a priority queue. Token buckets enforce
+Telegram's global and per-chat message rates, RetryAfter flood errors are
+re-sent once the requested wait is over, and voice uploads are dispatched
+ahead of cosmetic status edits.
+"""
+
+import os
+import time
+import asyncio
+import itertools
+import logging
+from collections import OrderedDict
+
+from telegram.error import RetryAfter
+
+import metrics
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Telegram limits: ~30 messages/s overall, ~1 message/s per private chat
+# and 20 messages/minute per group.
+GLOBAL_RATE = float(os.environ.get('SEND_GLOBAL_RATE', '30'))
+PRIVATE_CHAT_RATE = float(os.environ.get('SEND_PRIVATE_CHAT_RATE', '1'))
+GROUP_CHAT_RATE = float(os.environ.get('SEND_GROUP_CHAT_RATE', str(20 / 60)))
+
+# Maximum Bot API requests in flight at the same time
+MAX_IN_FLIGHT = int(os.environ.get('SEND_MAX_IN_FLIGHT', '8'))
+
+# How many RetryAfter errors a single call may hit before giving up
+MAX_RETRIES = int(os.environ.get('SEND_MAX_RETRIES', '5'))
+
+# Progress edits not sent within this many seconds are dropped
+PROGRESS_MAX_WAIT = float(os.environ.get('SEND_PROGRESS_MAX_WAIT', '5'))
+
+# Priorities (lower is sent first)
+PRIORITY_VOICE = 0
+PRIORITY_MESSAGE = 1
+PRIORITY_EDIT = 2
+PRIORITY_PROGRESS = 3
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at a fixed rate."""
+
+    def __init__(self, rate, capacity=None):
+        """
+        Args:
+            rate (float): Tokens added per second
+            capacity (float): Maximum burst size, defaults to max(rate, 1)
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now=None):
+        """Return the seconds until one token is available."""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def consume(self):
+        """Take one token."""
+        self._refill(time.monotonic())
+        self.tokens -= 1
+
+    def block(self, seconds):
+        """Refuse tokens for the given number of seconds."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def idle(self, now=None):
+        """Return True if the bucket is full and not blocked, i.e. no different from a new one."""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+def _retry_after_seconds(error):
+    """Return RetryAfter.retry_after as float seconds (int or timedelta)."""
+    retry_after = getattr(error, "retry_after", 1)
+    if hasattr(retry_after, "total_seconds"):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class SendQueue:
+    """Priority queue dispatching Bot API calls under rate limits."""
+
+    def __init__(self, global_rate=None, private_rate=None, group_rate=None,
+                 max_in_flight=None, max_retries=None):
+        self.global_bucket = TokenBucket(global_rate or GLOBAL_RATE)
+        self.private_rate = private_rate or PRIVATE_CHAT_RATE
+        self.group_rate = group_rate or GROUP_CHAT_RATE
+        self.max_in_flight = max_in_flight or MAX_IN_FLIGHT
+        self.max_retries = MAX_RETRIES if max_retries is None else max_retries
+        self.chat_buckets = OrderedDict()  # chat_id: TokenBucket, least recently used first
+        self._sequence = itertools.count()
+        self._loop = None
+        self._queue = None
+        self._slots = None
+        self._worker = None
+
+    def _ensure_started(self):
+        """Start the dispatcher on the running event loop if needed."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.PriorityQueue()
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+            self._worker = loop.create_task(self._run())
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is not None:
+            self.chat_buckets.move_to_end(chat_id)
+            return bucket
+        self._evict_idle()
+        # Negative ids are groups and channels
+        rate = self.group_rate if chat_id is not None and chat_id < 0 else self.private_rate
+        bucket = self.chat_buckets[chat_id] = TokenBucket(rate, capacity=max(rate * 3, 1.0))
+        return bucket
+
+    def _evict_idle(self):
+        """Drop least recently used chat buckets that have refilled, so the table stays bounded."""
+        now = time.monotonic()
+        while self.chat_buckets:
+            chat_id, bucket = next(iter(self.chat_buckets.items()))
+            if not bucket.idle(now):
+                break
+            del self.chat_buckets[chat_id]
+        metrics.set_gauge("send_queue_chat_buckets", len(self.chat_buckets))
+
+    def _put(self, job):
+        self._queue.put_nowait((job["priority"], next(self._sequence), job))
+        metrics.set_gauge("send_queue_depth", self._queue.qsize())
+
+    def depth(self):
+        """Return the number of queued calls."""
+        return self._queue.qsize() if self._queue else 0
+
+    async def submit(self, target_chat, priority, method, *args, max_wait=None, **kwargs):
+        """
+        Queue a Bot API call and wait for its result.
+
+        Args:
+            target_chat (int): Chat the call targets, used for per-chat
+                limits; named so it doesn't clash with the method's own
+                chat_id argument
+            priority (int): One of the PRIORITY_* constants
+            method (callable): Bound Bot API coroutine function
+            max_wait (float): Drop the call (returning None) if it could not
+                be sent within this many seconds; for cosmetic updates
+            *args, **kwargs: Arguments for method
+
+        Returns:
+            The result of the Bot API call, or None if it was dropped
+        """
+        self._ensure_started()
+        job = {
+            "chat_id": target_chat,
+            "priority": priority,
+            "method": method,
+            "args": args,
+            "kwargs": kwargs,
+            "attempts": 0,
+            "deadline": time.monotonic() + max_wait if max_wait else None,
+            "future": self._loop.create_future(),
+        }
+        self._put(job)
+        return await job["future"]
+
+    async def _run(self):
+        """Dispatch queued calls as rate limits allow."""
+        while True:
+            _, _, job = await self._queue.get()
+            metrics.set_gauge("send_queue_depth", self._queue.qsize())
+            try:
+                await self._dispatch(job)
+            except Exception as e:
+                # Fail this call only; the dispatcher must keep serving the rest
+                logger.error(f"Could not dispatch call for chat {job['chat_id']!r}: {str(e)}")
+                metrics.increment("send_queue_dispatch_errors_total")
+                if not job["future"].done():
+                    job["future"].set_exception(e)
+
+    async def _dispatch(self, job):
+        """Send one queued call, or park it until its rate limits allow."""
+        if job["future"].done():
+            return
+
+        now = time.monotonic()
+        if job["deadline"] and now > job["deadline"]:
+            metrics.increment("send_queue_dropped_total")
+            job["future"].set_result(None)
+            return
+
+        chat_wait = self._chat_bucket(job["chat_id"]).delay(now)
+        if chat_wait > 0:
+            # Park the call so other chats are not held up
+            self._loop.call_later(chat_wait, self._put, job)
+            return
+
+        global_wait = self.global_bucket.delay(now)
+        if global_wait > 0:
+            self._put(job)
+            await asyncio.sleep(global_wait)
+            return
+
+        self.global_bucket.consume()
+        self._chat_bucket(job["chat_id"]).consume()
+        # The call waits for a free slot in its own task, so slow uploads
+        # holding every slot don't stop the dispatch of other calls
+        self._loop.create_task(self._send(job))
+
+    async def _send(self, job):
+        """Perform one call, scheduling a re-send on RetryAfter."""
+        await self._slots.acquire()
+        try:
+            if job["attempts"]:
+                # Rewind file uploads before sending them again
+                for value in job["kwargs"].values():
+                    if hasattr(value, "seek"):
+                        value.seek(0)
+            result = await job["method"](*job["args"], **job["kwargs"])
+            if not job["future"].done():
+                job["future"].set_result(result)
+        except RetryAfter as e:
+            retry_after = _retry_after_seconds(e)
+            job["attempts"] += 1
+            metrics.increment("bot_api_retry_after_total")
+            if job["attempts"] > self.max_retries:
+                logger.error(f"Giving up on chat {job['chat_id']} after {job['attempts']} flood waits")
+                if not job["future"].done():
+                    job["future"].set_exception(e)
+                return
+            logger.warning(f"Flood limit for chat {job['chat_id']}: retrying in {retry_after:.0f}s")
+            self._chat_bucket(job["chat_id"]).block(retry_after)
+            self._loop.call_later(retry_after, self._put, job)
+        except Exception as e:
+            if not job["future"].done():
+                job["future"].set_exception(e)
+        finally:
+            self._slots.release()
+
+
+# Shared queue used by both bot modules
+outbound = SendQueue()
+
+
+def _query_chat_id(query):
+    """Return the chat id a callback query's message lives in."""
+    if query.message is not None:
+        return query.message.chat_id
+    return query.from_user.id
+
+
+async def reply_text(message, *args, **kwargs):
+    """Queue Message.reply_text."""
+    return await outbound.submit(message.chat_id, PRIORITY_MESSAGE, message.reply_text, *args, **kwargs)
+
+
+async def reply_voice(message, *args, **kwargs):
+    """Queue Message.reply_voice."""
+    return await outbound.submit(message.chat_id, PRIORITY_VOICE, message.reply_voice, *args, **kwargs)
+
+
+async def edit_message_text(query, *args, priority=PRIORITY_EDIT, max_wait=None, **kwargs):
+    """Queue CallbackQuery.edit_message_text."""
+    return await outbound.submit(
+        _query_chat_id(query), priority, query.edit_message_text, *args, max_wait=max_wait, **kwargs
+    )
+
+
+async def edit_message_caption(query, *args, priority=PRIORITY_EDIT, max_wait=None, **kwargs):
+    """Queue CallbackQuery.edit_message_caption."""
+    return await outbound.submit(
+        _query_chat_id(query), priority, query.edit_message_caption, *args, max_wait=max_wait, **kwargs
+    )
+
+
+async def send_voice(bot, chat_id, **kwargs):
+    """Queue Bot.send_voice."""
+    return await outbound.submit(chat_id, PRIORITY_VOICE, bot.send_voice, chat_id=chat_id, **kwargs)
+
+
+async def send_message(bot, chat_id, **kwargs):
+    """Queue Bot.send_message."""
+    return await outbound.submit(chat_id, PRIORITY_MESSAGE, bot.send_message, chat_id=chat_id, **kwargs)
+
+
+async def bot_edit_message_text(bot, chat_id, **kwargs):
+    """Queue Bot.edit_message_text."""
+    return await outbound.submit(chat_id, PRIORITY_EDIT, bot.edit_message_text, chat_id=chat_id, **kwargs)
@@ -0,0 +1,256 @@
+"""
+Decoded PCM in shared memory, fanned out to worker processes.
+
+When several effects are rendered from one input, every worker used to
+decode its own copy. A SharedPCM holds the canonical mono samples once in
+multiprocessing.shared_memory; workers attach by name and read zero-copy
+views (NumPy arrays when NumPy is installed, memoryviews otherwise). The
+buffer is reference counted by its owner: every task holds a reference until
+it finishes, and the memory is unlinked when the last one is released.
+
+This is a batch tool and is deliberately not used by the bot. The bot
+already decodes each upload once (simple_bot.decoded_source) and renders
+from that file. Its renders, inline pre-renders included, go through
+render_effect, which runs them in-process or segmented as the backend
+selector picks. Starting a spawned process pool for each upload would cost
+more than the few pre-rendered variants it would serve.
+
+Usage (render a catalog of every effect from one decode):
+    python shared_pcm.py input.ogg --out catalog/ --workers 4
+"""
+
+import os
+import sys
+import logging
+import argparse
+import threading
+import subprocess
+import multiprocessing
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import metrics
+import ffmpeg_limits
+from render_engine import CANONICAL_SAMPLE_RATE
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Bytes per canonical sample (mono s16le)
+SAMPLE_WIDTH = 2
+
+_live_lock = threading.Lock()
+_live_bytes = 0
+_live_buffers = 0
+
+
+def _account(delta_bytes, delta_buffers):
+    global _live_bytes, _live_buffers
+    with _live_lock:
+        _live_bytes += delta_bytes
+        _live_buffers += delta_buffers
+        metrics.set_gauge("shared_pcm_bytes", _live_bytes)
+        metrics.set_gauge("shared_pcm_buffers", _live_buffers)
+
+
+class SharedPCM:
+    """Canonical PCM samples in shared memory with owner-side reference counting."""
+
+    def __init__(self, data, sample_rate=None):
+        """
+        Args:
+            data (bytes): Mono s16le samples
+            sample_rate (int): Sample rate, CANONICAL_SAMPLE_RATE by default
+        """
+        self.sample_rate = sample_rate or CANONICAL_SAMPLE_RATE
+        self.nbytes = len(data)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, self.nbytes))
+        self.shm.buf[:self.nbytes] = data
+        self.refs = 1  # the creator's reference
+        self.lock = threading.Lock()
+        _account(self.nbytes, 1)
+
+    @classmethod
+    def decode(cls, input_path, sample_rate=None):
+        """
+        Decode an audio file once into shared memory.
+
+        Args:
+            input_path (str): Audio file to decode
+            sample_rate (int): Target rate, CANONICAL_SAMPLE_RATE by default
+
+        Returns:
+            SharedPCM: The decoded buffer, holding one reference for the caller
+        """
+        sample_rate = sample_rate or CANONICAL_SAMPLE_RATE
+        process = ffmpeg_limits.run(
+            ["ffmpeg", "-v", "error", "-i", input_path, "-ac", "1", "-ar", str(sample_rate),
+             "-f", "s16le", "pipe:1"],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, output_limit_mb=0
+        )
+        if process.returncode != 0:
+            raise RuntimeError(process.stderr.decode(errors="replace"))
+        return cls(process.stdout, sample_rate)
+
+    @property
+    def handle(self):
+        """Picklable description workers use to attach."""
+        return {"name": self.shm.name, "nbytes": self.nbytes, "sample_rate": self.sample_rate}
+
+    @property
+    def duration(self):
+        return self.nbytes / SAMPLE_WIDTH / self.sample_rate
+
+    def acquire(self):
+        """
+        Take a reference for a task.
+
+        Returns:
+            dict: The handle to pass to the task
+        """
+        with self.lock:
+            if self.refs == 0:
+                raise RuntimeError("SharedPCM already released")
+            self.refs += 1
+        return self.handle
+
+    def release(self):
+        """Drop a reference; the shared memory is unlinked with the last one."""
+        with self.lock:
+            self.refs -= 1
+            last = self.refs == 0
+        if last:
+            self.shm.close()
+            self.shm.unlink()
+            _account(-self.nbytes, -1)
+
+
+@contextmanager
+def attach(handle, raw=False):
+    """
+    Attach to a shared buffer from any process.
+
+    Views must not be used after the block ends.
+
+    Args:
+        handle (dict): SharedPCM.handle
+        raw (bool): Yield the bytes instead of samples
+
+    Yields:
+        numpy.ndarray or memoryview: Zero-copy int16 samples (a memoryview
+            when NumPy is missing), or bytes when raw is set
+    """
+    # Workers are children of the owner and share its resource tracker, so
+    # attaching doesn't hand the segment's lifetime to this process
+    shm = shared_memory.SharedMemory(name=handle["name"])
+    view = shm.buf[:handle["nbytes"]]
+    try:
+        if raw:
+            yield view
+        elif np is not None:
+            yield np.frombuffer(view, dtype="<i2")
+        else:
+            yield view.cast("h")
+    finally:
+        try:
+            view.release()
+            shm.close()
+        except BufferError:
+            # A caller still holds a view; the mapping goes away with it
+            pass
+
+
+def render_from_shared(handle, filter_chain, output_path):
+    """
+    Render one effect from shared PCM (runs in a worker process).
+
+    Args:
+        handle (dict): SharedPCM.handle
+        filter_chain (str): Effect chain written for the canonical rate
+        output_path (str): Ogg/Opus file to write
+
+    Returns:
+        bool: True if successful, False otherwise
+        str: Error message if unsuccessful, empty string otherwise
+    """
+    cmd = [
+        "ffmpeg", "-y", "-f", "s16le", "-ar", str(handle["sample_rate"]), "-ac", "1", "-i", "pipe:0"
+    ]
+    if filter_chain:
+        cmd += ["-af", filter_chain]
+    cmd += ["-c:a", "libopus", output_path]
+    with attach(handle, raw=True) as data:
+        # Pipe straight from the shared pages; no private copy of the samples
+        process = ffmpeg_limits.run(cmd, input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        del data
+    if process.returncode != 0:
+        return False, process.stderr.decode(errors="replace")
+    return True, ""
+
+
+def fan_out(pcm, jobs, workers=None):
+    """
+    Render several effects from one shared decode in worker processes.
+
+    Args:
+        pcm (SharedPCM): Decoded input
+        jobs (list): (filter_chain, output_path) tuples
+        workers (int): Worker processes, CPU count by default
+
+    Returns:
+        list: (success, error_msg) per job, in order
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, mp_context=context) as pool:
+        futures = []
+        for filter_chain, output_path in jobs:
+            future = pool.submit(render_from_shared, pcm.acquire(), filter_chain, output_path)
+            # Released even if the worker crashes, so the segment can't leak
+            future.add_done_callback(lambda _: pcm.release())
+            futures.append(future)
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append((False, str(e)))
+    metrics.increment("shared_pcm_fanout_jobs_total", len(jobs))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render every effect from one shared decode")
+    parser.add_argument("input", help="audio file to render")
+    parser.add_argument("--out", default="catalog", help="output directory")
+    parser.add_argument("--effects", default=None, help="comma separated effect names (default: all)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes")
+    args = parser.parse_args()
+
+    from voice_effects import VOICE_EFFECTS
+
+    names = [name.strip() for name in args.effects.split(",")] if args.effects else list(VOICE_EFFECTS)
+    unknown = [name for name in names if name not in VOICE_EFFECTS]
+    if unknown:
+        print(f"Unknown effects: {', '.join(unknown)}", file=sys.stderr)
+        sys.exit(1)
+    os.makedirs(args.out, exist_ok=True)
+
+    pcm = SharedPCM.decode(args.input)
+    try:
+        print(f"Decoded {pcm.duration:.1f}s once ({pcm.nbytes} bytes shared), rendering {len(names)} effects")
+        jobs = [(VOICE_EFFECTS[name], os.path.join(args.out, f"{name}.ogg")) for name in names]
+        for name, (success, error_msg) in zip(names, fan_out(pcm, jobs, args.workers)):
+            status = "ok" if success else f"failed: {error_msg.strip().splitlines()[-1:]}"
+            print(f"  {name:<14} {status}")
+    finally:
+        pcm.release()
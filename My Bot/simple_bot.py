@@ -1,11 +1,26 @@
 import os
-import subprocess
+import time
+import asyncio
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import threading
+from telegram import (
+    Update, InlineKeyboardButton, InlineKeyboardMarkup,
+    InlineQueryResultCachedVoice, InlineQueryResultsButton
+)
 from telegram.ext import (
-    ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler,
+    CommandHandler, MessageHandler, CallbackQueryHandler, InlineQueryHandler,
     ContextTypes, filters
 )
+from utils import make_progress_editor
+from response_composer import ResponseComposer
+import send_queue
+from dispatcher import build_application
+import metrics
+from inflight import renders, supersedes
+
+# The render engine, job queue, audio budget, inline cache, monitoring and
+# FFmpeg catalog modules are imported where they are used, so the bot gets
+# to its first poll sooner (see bench_startup.py)
 
 # Configure logging
 logging.basicConfig(
@@ -21,27 +36,38 @@ BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
 TEMP_DIR = 'temp_audio'
 
 # In-memory storage
-user_audio = {}         # user_id: uploaded audio file
+user_audio = {}         # user_id: uploaded audio (audio_memory.AudioBuffer)
+user_audio_ids = {}     # user_id: Telegram file_id of the uploaded audio
+user_audio_durations = {}  # user_id: duration of the uploaded audio (seconds)
+user_decoded = {}       # user_id: (task decoding the upload to WAV, WAV path)
+user_prerenders = {}    # user_id: task pre-rendering inline variants
 user_voices = {}        # user_id: cloned voice path
 user_states = {}        # user_id: awaiting_clone
 user_voice_names = {}   # user_id: voice name
+effect_validation = None  # task checking VOICE_EFFECTS against the installed FFmpeg
+
+# Effects run on mono audio at the canonical internal rate; pitch shifts are
+# written relative to it so they are sample-rate correct. Same setting as
+# render_engine.CANONICAL_SAMPLE_RATE, read here so the effect table doesn't
+# import the render engine.
+SR = int(os.environ.get('RENDER_SAMPLE_RATE', '24000'))
 
 # Voice effects with 100 options
 VOICE_EFFECTS = {
     # Standard effects
-    "chipmunk": "asetrate=44100*1.5,aresample=44100",
-    "deep": "asetrate=44100*0.7,aresample=44100",
+    "chipmunk": f"asetrate={SR}*1.5,aresample={SR}",
+    "deep": f"asetrate={SR}*0.7,aresample={SR}",
     "robot": "afftfilt=real='hypot(re,im)':imag='0'",
     "echo": "aecho=0.8:0.9:1000:0.3",
     "radio": "highpass=f=300, lowpass=f=3400",
     "slowmo": "atempo=0.6",
     "fast": "atempo=1.5",
     "reverse": "areverse",
-    "alien": "asetrate=44100*0.5,aresample=44100",
+    "alien": f"asetrate={SR}*0.5,aresample={SR}",
     "cave": "aecho=0.8:0.88:60:0.4",
     
     # Additional effects (expanding to 100)
-    "helium": "asetrate=44100*1.7,aresample=44100",
+    "helium": f"asetrate={SR}*1.7,aresample={SR}",
     "underwater": "equalizer=f=10:width_type=o:width=1:g=-10,equalizer=f=100:width_type=o:width=1:g=2,aecho=0.8:0.9:500:0.4",
     "telephone": "highpass=f=500,lowpass=f=2000",
     "robot2": "afftfilt=real='cos(2*PI*t)*hypot(re,im)':imag='sin(2*PI*t)*hypot(re,im)'",
@@ -53,12 +79,12 @@ VOICE_EFFECTS = {
     "phaser": "aphaser=in_gain=0.6:out_gain=0.6:delay=3:speed=2",
     
     # Pitch effects
-    "pitch_up_small": "asetrate=44100*1.1,aresample=44100",
-    "pitch_up_medium": "asetrate=44100*1.2,aresample=44100",
-    "pitch_up_high": "asetrate=44100*1.4,aresample=44100",
-    "pitch_down_small": "asetrate=44100*0.9,aresample=44100",
-    "pitch_down_medium": "asetrate=44100*0.8,aresample=44100",
-    "pitch_down_high": "asetrate=44100*0.6,aresample=44100",
+    "pitch_up_small": f"asetrate={SR}*1.1,aresample={SR}",
+    "pitch_up_medium": f"asetrate={SR}*1.2,aresample={SR}",
+    "pitch_up_high": f"asetrate={SR}*1.4,aresample={SR}",
+    "pitch_down_small": f"asetrate={SR}*0.9,aresample={SR}",
+    "pitch_down_medium": f"asetrate={SR}*0.8,aresample={SR}",
+    "pitch_down_high": f"asetrate={SR}*0.6,aresample={SR}",
     
     # Speed effects
     "speed_x0.5": "atempo=0.5",
@@ -74,18 +100,18 @@ VOICE_EFFECTS = {
     "echo_reverse": "areverse,aecho=0.8:0.8:500:0.5,areverse",
     
     # Combination effects
-    "chipmunk_echo": "asetrate=44100*1.5,aresample=44100,aecho=0.8:0.9:500:0.3",
-    "deep_echo": "asetrate=44100*0.7,aresample=44100,aecho=0.8:0.9:1000:0.3",
+    "chipmunk_echo": f"asetrate={SR}*1.5,aresample={SR},aecho=0.8:0.9:500:0.3",
+    "deep_echo": f"asetrate={SR}*0.7,aresample={SR},aecho=0.8:0.9:1000:0.3",
     "robot_reverb": "afftfilt=real='hypot(re,im)':imag='0',aecho=0.8:0.9:1000:0.3",
-    "alien_chorus": "asetrate=44100*0.5,aresample=44100,chorus=0.7:0.9:55:0.4:0.25:2",
+    "alien_chorus": f"asetrate={SR}*0.5,aresample={SR},chorus=0.7:0.9:55:0.4:0.25:2",
     "fast_reverb": "atempo=1.5,aecho=0.8:0.9:500:0.3",
     
     # Animal-like effects
-    "duck": "asetrate=44100*1.8,aresample=44100,atempo=0.7",
-    "squirrel": "asetrate=44100*1.9,aresample=44100,atempo=0.8",
-    "monster": "asetrate=44100*0.6,aresample=44100,atempo=1.3",
-    "demon": "asetrate=44100*0.55,aresample=44100,aecho=0.8:0.8:1000:0.5",
-    "ghost": "asetrate=44100*0.85,aresample=44100,aphaser,aecho=0.8:0.8:1800:0.8",
+    "duck": f"asetrate={SR}*1.8,aresample={SR},atempo=0.7",
+    "squirrel": f"asetrate={SR}*1.9,aresample={SR},atempo=0.8",
+    "monster": f"asetrate={SR}*0.6,aresample={SR},atempo=1.3",
+    "demon": f"asetrate={SR}*0.55,aresample={SR},aecho=0.8:0.8:1000:0.5",
+    "ghost": f"asetrate={SR}*0.85,aresample={SR},aphaser,aecho=0.8:0.8:1800:0.8",
     
     # Multiple transformations
     "whisper": "highpass=f=1000,lowpass=f=6000,volume=2.0",
@@ -95,22 +121,22 @@ VOICE_EFFECTS = {
     "old_radio": "bandpass=f=1500:width_type=h:width=600,volume=1.5",
     
     # Quality variations
-    "low_quality": "highpass=f=500,lowpass=f=2000,aresample=8000,aresample=44100",
+    "low_quality": f"highpass=f=500,lowpass=f=2000,aresample=8000,aresample={SR}",
     "am_radio": "highpass=f=300,lowpass=f=3400,aeval=s+0.003*sin(2*PI*t*20)",
-    "walkie_talkie": "highpass=f=500,lowpass=f=2000,aeval=s*atan(3*s)/PI,aresample=8000,aresample=44100",
+    "walkie_talkie": f"highpass=f=500,lowpass=f=2000,aeval=s*atan(3*s)/PI,aresample=8000,aresample={SR}",
     "cell_phone": "highpass=f=800,lowpass=f=3000,aeval=s*0.8",
     
     # Futuristic effects
-    "computer": "asetrate=44100*1.1,aresample=44100,flanger,vibrato=f=10:d=0.5",
-    "cyborg": "asetrate=44100*0.8,aresample=44100,afftfilt=real='hypot(re,im)':imag='0'",
-    "android": "asetrate=44100*1.2,aresample=44100,aphaser,flanger",
-    "matrix": "afftfilt=real='cos(PI*t)*sin(PI/3)',asetrate=44100*0.9,aresample=44100",
+    "computer": f"asetrate={SR}*1.1,aresample={SR},flanger,vibrato=f=10:d=0.5",
+    "cyborg": f"asetrate={SR}*0.8,aresample={SR},afftfilt=real='hypot(re,im)':imag='0'",
+    "android": f"asetrate={SR}*1.2,aresample={SR},aphaser,flanger",
+    "matrix": f"afftfilt=real='cos(PI*t)*sin(PI/3)',asetrate={SR}*0.9,aresample={SR}",
     
     # Emotional effects
-    "sad": "asetrate=44100*0.9,aresample=44100,aecho=0.8:0.8:1000:0.8",
-    "happy": "asetrate=44100*1.1,aresample=44100,vibrato=f=5:d=0.1",
-    "angry": "asetrate=44100*0.95,aresample=44100,vibrato=f=10:d=0.3,highpass=f=300",
-    "scared": "asetrate=44100*1.05,aresample=44100,tremolo=f=5:d=0.5",
+    "sad": f"asetrate={SR}*0.9,aresample={SR},aecho=0.8:0.8:1000:0.8",
+    "happy": f"asetrate={SR}*1.1,aresample={SR},vibrato=f=5:d=0.1",
+    "angry": f"asetrate={SR}*0.95,aresample={SR},vibrato=f=10:d=0.3,highpass=f=300",
+    "scared": f"asetrate={SR}*1.05,aresample={SR},tremolo=f=5:d=0.5",
     
     # Environmental effects
     "underwater2": "lowpass=f=800,aecho=0.9:0.9:1000:0.7",
@@ -121,27 +147,27 @@ VOICE_EFFECTS = {
     "church": "aecho=0.9:0.9:500:0.8,aecho=0.9:0.9:1000:0.6,aecho=0.9:0.9:1500:0.4,lowpass=f=4000",
     
     # Movie-inspired effects
-    "darth_vader": "asetrate=44100*0.65,aresample=44100,aeval=s*atan(3*s)/PI",
-    "zombie": "asetrate=44100*0.75,aresample=44100,atempo=0.9,aecho=0.8:0.8:500:0.5",
-    "minion": "asetrate=44100*1.6,aresample=44100,vibrato=f=15:d=0.2",
-    "giant": "asetrate=44100*0.6,aresample=44100,atempo=0.9,aecho=0.8:0.8:500:0.3",
-    "chipmunk_helium": "asetrate=44100*2.0,aresample=44100,atempo=0.5",
+    "darth_vader": f"asetrate={SR}*0.65,aresample={SR},aeval=s*atan(3*s)/PI",
+    "zombie": f"asetrate={SR}*0.75,aresample={SR},atempo=0.9,aecho=0.8:0.8:500:0.5",
+    "minion": f"asetrate={SR}*1.6,aresample={SR},vibrato=f=15:d=0.2",
+    "giant": f"asetrate={SR}*0.6,aresample={SR},atempo=0.9,aecho=0.8:0.8:500:0.3",
+    "chipmunk_helium": f"asetrate={SR}*2.0,aresample={SR},atempo=0.5",
     
     # Musical effects
-    "autotune": "asetrate=44100*1.0,aresample=44100,vibrato=f=8:d=0.1",
+    "autotune": f"asetrate={SR}*1.0,aresample={SR},vibrato=f=8:d=0.1",
     "choir": "aecho=0.8:0.9:50:0.5,aecho=0.8:0.9:150:0.4,aecho=0.8:0.9:300:0.3",
     "instrument": "highpass=f=400,aecho=0.8:0.9:50:0.6,aecho=0.8:0.9:150:0.4",
     "dubstep": "equalizer=f=40:width_type=h:width=50:g=6,vibrato=f=6:d=0.2,tremolo=f=6:d=0.3",
     
     # More extreme effects
-    "tiny": "asetrate=44100*2.5,aresample=44100,atempo=0.4",
-    "giant_monster": "asetrate=44100*0.4,aresample=44100,atempo=2.0",
+    "tiny": f"asetrate={SR}*2.5,aresample={SR},atempo=0.4",
+    "giant_monster": f"asetrate={SR}*0.4,aresample={SR},atempo=2.0",
     "double_voice": "acrusher=level_in=1:level_out=1:bits=8:mode=log:aa=1,aecho=0.8:0.88:200:0.5",
     "triple_voice": "acrusher=level_in=1:level_out=1:bits=8:mode=log:aa=1,aecho=0.8:0.88:110:0.5,aecho=0.6:0.6:220:0.5",
     
     # Time effects
-    "time_stretch": "atempo=0.8,asetrate=44100*1.25,aresample=44100",
-    "time_compress": "atempo=1.25,asetrate=44100*0.8,aresample=44100",
+    "time_stretch": f"atempo=0.8,asetrate={SR}*1.25,aresample={SR}",
+    "time_compress": f"atempo=1.25,asetrate={SR}*0.8,aresample={SR}",
     "backwards_delay": "areverse,aecho=0.8:0.7:100:0.5,areverse",
     
     # Frequency effects
@@ -151,26 +177,38 @@ VOICE_EFFECTS = {
     
     # More complex effects
     "robot_hall": "afftfilt=real='hypot(re,im)':imag='0',aecho=0.8:0.9:1000:0.5,aecho=0.8:0.9:1500:0.25",
-    "alien_communication": "asetrate=44100*0.5,aresample=44100,tremolo=f=10:d=0.8",
+    "alien_communication": f"asetrate={SR}*0.5,aresample={SR},tremolo=f=10:d=0.8",
     "deep_underwater": "lowpass=f=400,aecho=0.8:0.9:1000:0.8,aecho=0.8:0.9:1500:0.5",
     "far_away": "highpass=f=800,lowpass=f=2500,aecho=0.8:0.9:1000:0.8,volume=0.5",
     
     # Additional effect variations
-    "baby": "asetrate=44100*1.5,aresample=44100,atempo=0.8",
-    "old_person": "asetrate=44100*0.8,aresample=44100,atempo=1.1,tremolo=f=5:d=0.2",
+    "baby": f"asetrate={SR}*1.5,aresample={SR},atempo=0.8",
+    "old_person": f"asetrate={SR}*0.8,aresample={SR},atempo=1.1,tremolo=f=5:d=0.2",
     "whisper_echo": "highpass=f=1000,lowpass=f=6000,volume=2.0,aecho=0.8:0.9:500:0.5",
     "dramatic": "aecho=0.8:0.9:1000:0.5,aecho=0.8:0.9:1800:0.3,vibrato=f=5:d=0.1",
     
     # Custom combined effects
-    "custom_1": "asetrate=44100*1.3,aresample=44100,vibrato=f=8:d=0.3,aecho=0.8:0.9:500:0.3",
-    "custom_2": "asetrate=44100*0.8,aresample=44100,chorus=0.7:0.9:55:0.4:0.25:2,aecho=0.8:0.9:800:0.5",
+    "custom_1": f"asetrate={SR}*1.3,aresample={SR},vibrato=f=8:d=0.3,aecho=0.8:0.9:500:0.3",
+    "custom_2": f"asetrate={SR}*0.8,aresample={SR},chorus=0.7:0.9:55:0.4:0.25:2,aecho=0.8:0.9:800:0.5",
     "custom_3": "afftfilt=real='hypot(re,im)':imag='0',tremolo=f=5:d=0.5,aecho=0.8:0.9:300:0.3",
-    "custom_4": "areverse,atempo=0.8,asetrate=44100*1.2,aresample=44100,areverse",
+    "custom_4": f"areverse,atempo=0.8,asetrate={SR}*1.2,aresample={SR},areverse",
     "custom_5": "highpass=f=500,lowpass=f=3000,vibrato=f=10:d=0.3,aecho=0.8:0.9:500:0.5",
     
     # Cloned voice will be dynamically used when a user has one
 }
 
+# Search index for inline queries; the comment groups above are the categories.
+# Built (or loaded from its cache) on the first inline query.
+_effect_index = None
+
+def get_effect_index():
+    """Return the inline search index over VOICE_EFFECTS, loading it on first use."""
+    global _effect_index
+    if _effect_index is None:
+        from effect_index import load_index
+        _effect_index = load_index(VOICE_EFFECTS, __file__)
+    return _effect_index
+
 # Ensure temp directory exists
 if not os.path.exists(TEMP_DIR):
     os.makedirs(TEMP_DIR)
@@ -179,11 +217,13 @@ if not os.path.exists(TEMP_DIR):
 # /start command
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send a welcome message when the command /start is issued."""
-    await update.message.reply_text(
+    await send_queue.reply_text(
+        update.message,
         "🎙️ *Voice Effects Bot* 🎙️\n\n"
         "Send a voice/audio message to apply effects.\n"
         "🧬 Use */clone* to record your voice for cloning.\n"
-        "🎛️ Your cloned voice will be used when applying effects if available.",
+        "🎛️ Your cloned voice will be used when applying effects if available.\n"
+        f"💬 Type *@{context.bot.username} effect* in any chat to share your latest voice with an effect.",
         parse_mode="Markdown"
     )
 
@@ -192,7 +232,8 @@ async def clone_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start the voice cloning process by requesting a voice sample."""
     user_id = update.message.from_user.id
     user_states[user_id] = "awaiting_clone"
-    await update.message.reply_text(
+    await send_queue.reply_text(
+        update.message,
         "🎤 Send a short voice message (5–10 sec) to clone your voice.",
         parse_mode="Markdown"
     )
@@ -204,7 +245,8 @@ async def rename_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Check if user has a cloned voice
     if user_id not in user_voices:
-        await update.message.reply_text(
+        await send_queue.reply_text(
+            update.message,
             "❌ You haven't cloned your voice yet. Use the /clone command first.",
             parse_mode="Markdown"
         )
@@ -212,7 +254,8 @@ async def rename_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Check if command has arguments
     if not context.args:
-        await update.message.reply_text(
+        await send_queue.reply_text(
+            update.message,
             "Please provide a name for your voice.\n\n"
             "Example: `/rename Cool Voice`",
             parse_mode="Markdown"
@@ -229,7 +272,8 @@ async def rename_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Save the new voice name
     user_voice_names[user_id] = new_name
     
-    await update.message.reply_text(
+    await send_queue.reply_text(
+        update.message,
         f"✅ Voice name updated to *{new_name}*!\n\n"
         "Your cloned voice will be used when applying effects.",
         parse_mode="Markdown"
@@ -255,7 +299,8 @@ async def handle_clone_audio(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if user_id not in user_voice_names:
         user_voice_names[user_id] = "My Voice"
     
-    await update.message.reply_text(
+    await send_queue.reply_text(
+        update.message,
         "✅ Your voice has been cloned!\n\n"
         "Send a new voice message and I'll apply effects using your voice characteristics.\n"
         "You can customize the name with /rename command.",
@@ -267,19 +312,29 @@ async def handle_clone_audio(update: Update, context: ContextTypes.DEFAULT_TYPE)
 # Function to get effects page
 def get_effects_page(page_num=0, effects_per_page=10):
     """Get a subset of effects for the current page"""
-    effects = list(VOICE_EFFECTS.keys())
+    import ffmpeg_catalog
+
+    # Effects the installed FFmpeg can't run are left out of the menu
+    available = ffmpeg_catalog.available(VOICE_EFFECTS)
+    effects = list(available.keys())
     start_idx = page_num * effects_per_page
     end_idx = min(start_idx + effects_per_page, len(effects))
-    return {k: VOICE_EFFECTS[k] for k in effects[start_idx:end_idx]}
+    return {k: available[k] for k in effects[start_idx:end_idx]}
 
 # Function to count total pages
 def get_total_pages(effects_per_page=10):
     """Calculate the total number of pages"""
-    return (len(VOICE_EFFECTS) + effects_per_page - 1) // effects_per_page
+    import ffmpeg_catalog
+
+    return (len(ffmpeg_catalog.available(VOICE_EFFECTS)) + effects_per_page - 1) // effects_per_page
 
 # Handle voice/audio for effects
 async def handle_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Process incoming voice or audio messages."""
+    import audio_memory
+    import inline_cache
+    import tracing
+
     message = update.message
     user_id = message.from_user.id
     
@@ -293,24 +348,51 @@ async def handle_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Check if it's a voice message or an audio file
         if message.voice:
             file_id = message.voice.file_id
+            duration = message.voice.duration
         elif message.audio:
             file_id = message.audio.file_id
+            duration = message.audio.duration
         else:
-            await message.reply_text("❌ Please send a voice message or audio file.")
+            await send_queue.reply_text(message, "❌ Please send a voice message or audio file.")
             return
         
-        # Download the file
-        file = await context.bot.get_file(file_id)
-        input_path = os.path.join(TEMP_DIR, f"input_{user_id}.ogg")
-        await file.download_to_drive(input_path)
-        user_audio[user_id] = input_path
+        # Download the file into memory; the budget spills it to disk under
+        # pressure. Files larger than the whole budget go straight to disk.
+        with tracing.span("get_file"):
+            file = await context.bot.get_file(file_id)
+        with tracing.span("download", duration=duration or 0) as span:
+            if audio_memory.budget.fits(file.file_size or 0):
+                data = await file.download_as_bytearray()
+                span.set(bytes=len(data))
+                audio = audio_memory.budget.put(("input", user_id), data, "input")
+            else:
+                spill_path = audio_memory.budget.spill_file()
+                try:
+                    await file.download_to_drive(spill_path)
+                except Exception:
+                    os.remove(spill_path)
+                    raise
+                audio = audio_memory.budget.put_file(("input", user_id), spill_path, "input")
+                span.set(bytes=audio.size, spilled=True)
+        user_audio[user_id] = audio
+        user_audio_ids[user_id] = file_id
+        user_audio_durations[user_id] = duration or 0
+        
+        # Decode once to the canonical format in the background; renders reuse it
+        discard_decoded(user_id)
+        start_decode(user_id, audio)
+        
+        # Variants of the previous upload no longer apply to inline queries
+        inline_cache.cache.reset(user_id, file_id)
+        start_prerender(context.bot, user_id, file_id)
         
         # Show paginated effects menu (page 0)
-        await show_effects_menu(update, context, user_id, 0)
+        with tracing.span("show_menu"):
+            await show_effects_menu(update, context, user_id, 0)
         
     except Exception as e:
         logger.error(f"Error in handle_audio: {str(e)}")
-        await message.reply_text("❌ An error occurred while processing your audio. Please try again.")
+        await send_queue.reply_text(message, "❌ An error occurred while processing your audio. Please try again.")
 
 # Show paginated effects menu
 async def show_effects_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id, page=0):
@@ -368,25 +450,110 @@ async def show_effects_menu(update: Update, context: ContextTypes.DEFAULT_TYPE,
     # Send message with keyboard
     if update.callback_query:
         # Update existing message
-        await update.callback_query.edit_message_text(
+        await send_queue.edit_message_text(
+            update.callback_query,
             f"🎛️ Choose a voice effect to apply (100+ options):{using_cloned_voice}",
             reply_markup=reply_markup,
             parse_mode="Markdown"
         )
     else:
         # Send new message
-        await update.message.reply_text(
+        await send_queue.reply_text(
+            update.message,
             f"🎛️ Choose a voice effect to apply (100+ options):{using_cloned_voice}",
             reply_markup=reply_markup,
             parse_mode="Markdown"
         )
 
+# Decoded copies of uploads, shared by previews and full renders
+def start_decode(user_id, audio):
+    """Start decoding a user's upload to canonical mono WAV, trimmed and normalized."""
+    from render_engine import prepare_input
+
+    wav_path = os.path.join(TEMP_DIR, f"decoded_{user_id}.wav")
+    # Resident uploads are piped to FFmpeg; spilled ones are read from their file
+    input_arg, input_data = audio.ffmpeg_input()
+    user_decoded[user_id] = (asyncio.ensure_future(prepare_input(input_arg, wav_path, input_data)), wav_path)
+
+def discard_decoded(user_id):
+    """Cancel and delete the decoded copy of a user's upload."""
+    entry = user_decoded.pop(user_id, None)
+    if entry is None:
+        return
+    task, wav_path = entry
+    task.cancel()
+    if os.path.exists(wav_path):
+        os.remove(wav_path)
+
+async def decoded_source(user_id, audio):
+    """Return the path of the decoded WAV of the upload, or of the upload itself."""
+    entry = user_decoded.get(user_id)
+    if entry is None:
+        return audio.path()
+    task, wav_path = entry
+    if task.cancelled():
+        return audio.path()
+    try:
+        success, _ = await asyncio.shield(task)
+    except Exception:
+        success = False
+    return wav_path if success else audio.path()
+
+# Send a quick preview of an effect
+async def send_effect_preview(query, context, user_id, effect_name, audio):
+    """Render the first seconds of the upload cheaply and offer the full version."""
+    import tracing
+    from render_engine import render_preview, PREVIEW_SECONDS
+
+    if user_id not in user_decoded:
+        start_decode(user_id, audio)
+    
+    # Preview the prepared input once it is ready, so leading silence doesn't
+    # eat the preview; until then read the first seconds of the upload itself
+    # rather than waiting for the whole decode and pre-stage
+    task, wav_path = user_decoded[user_id]
+    if task.done() and not task.cancelled() and task.exception() is None and task.result()[0]:
+        input_path, input_data = wav_path, None
+    else:
+        input_path, input_data = audio.ffmpeg_input()
+        metrics.increment("previews_from_upload_total")
+    
+    preview_path = os.path.join(TEMP_DIR, f"preview_{user_id}_{effect_name}.ogg")
+    try:
+        with tracing.span("preview_render", effect=effect_name):
+            success, error_msg = await render_preview(
+                input_path, preview_path, VOICE_EFFECTS.get(effect_name, ""), input_data=input_data
+            )
+        if not success:
+            logger.error(f"Preview error: {error_msg}")
+            await send_queue.send_message(context.bot, query.message.chat_id, text="❌ Error previewing effect. Please try another effect.")
+            return
+        
+        keyboard = [[InlineKeyboardButton("📤 Send full version", callback_data=f"full:{effect_name}")]]
+        with tracing.span("preview_upload"), open(preview_path, 'rb') as audio_file:
+            await send_queue.send_voice(
+                context.bot, query.message.chat_id,
+                voice=audio_file,
+                caption=f"👂 Preview of *{effect_name}* (first {PREVIEW_SECONDS:g}s)",
+                parse_mode="Markdown",
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+    finally:
+        if os.path.exists(preview_path):
+            os.remove(preview_path)
+
 # Apply effect
 async def handle_effect_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle user selecting an effect or navigating pages."""
+    import inline_cache
+    import job_queue
+    import tracing
+    from render_engine import render_effect, STALLED_ERROR, PREVIEW_SECONDS
+
     try:
         query = update.callback_query
-        await query.answer()
+        with tracing.span("answer_callback"):
+            await query.answer()
         
         user_id = query.from_user.id
         callback_data = query.data
@@ -401,17 +568,46 @@ async def handle_effect_selection(update: Update, context: ContextTypes.DEFAULT_
                 logger.error(f"Error parsing page number: {str(e)}")
                 return
         
-        # Handle effect selection
-        elif callback_data.startswith("effect:"):
+        # Handle effect selection ("full:" asks for the full version of a preview)
+        elif callback_data.startswith(("effect:", "full:")):
             effect_name = callback_data.split(":")[1]
-            input_path = user_audio.get(user_id)
+            audio = user_audio.get(user_id)
+            
+            if audio is None:
+                if callback_data.startswith("full:"):
+                    await send_queue.edit_message_caption(query, caption="❌ No audio found. Please send or forward a voice message first.")
+                else:
+                    await send_queue.edit_message_text(query, "❌ No audio found. Please send or forward a voice message first.")
+                return
+            
+            # Long clips get a quick preview first; the menu stays for trying more effects
+            if (callback_data.startswith("effect:") and effect_name != "cloned" and PREVIEW_SECONDS
+                    and user_audio_durations.get(user_id, 0) > PREVIEW_SECONDS):
+                await send_effect_preview(query, context, user_id, effect_name, audio)
+                return
             
-            if not input_path:
-                await query.edit_message_text("❌ No audio found. Please send or forward a voice message first.")
+            # Durable mode: any node's render workers may pick the job up and
+            # deliver it to this chat, even if this node goes away
+            if job_queue.RENDER_QUEUE == "durable" and effect_name != "cloned" and user_id in user_audio_ids:
+                # A double tap on the same button maps to the same job
+                with tracing.span("enqueue", effect=effect_name):
+                    job_id, created = await asyncio.to_thread(
+                        job_queue.get_queue().enqueue,
+                        f"{query.message.chat_id}:{query.message.message_id}:{effect_name}",
+                        query.message.chat_id, user_id, effect_name,
+                        VOICE_EFFECTS.get(effect_name, ""), user_audio_ids[user_id],
+                        status_message_id=query.message.message_id
+                    )
+                if created:
+                    if supersedes(effect_name):
+                        await asyncio.to_thread(job_queue.get_queue().supersede, user_id, job_id)
+                    await send_queue.edit_message_text(query, f"⏳ Queued *{effect_name}* effect...", parse_mode="Markdown")
                 return
             
-            # Show processing message
-            await query.edit_message_text(f"⏳ Processing with *{effect_name}* effect...", parse_mode="Markdown")
+            # The processing status is only shown if the render isn't fast
+            status_text = f"⏳ Processing with *{effect_name}* effect..."
+            composer = ResponseComposer(query, context.bot, user_id)
+            composer.api_calls = 1  # answerCallbackQuery above
             
             try:
                 # Determine output path
@@ -420,7 +616,7 @@ async def handle_effect_selection(update: Update, context: ContextTypes.DEFAULT_
                 # Special handling for cloned voice effect
                 if effect_name == "cloned":
                     if user_id not in user_voices:
-                        await query.edit_message_text("❌ You need to clone your voice first. Use /clone command.")
+                        await composer.edit("❌ You need to clone your voice first. Use /clone command.")
                         return
                     
                     cloned_voice_path = user_voices[user_id]
@@ -429,42 +625,49 @@ async def handle_effect_selection(update: Update, context: ContextTypes.DEFAULT_
                     # Create a copy of the input audio for processing 
                     # (so the original input isn't deleted when we need it for further effects)
                     processed_input = os.path.join(TEMP_DIR, f"proc_input_{user_id}.ogg")
-                    os.system(f"cp {input_path} {processed_input}")
+                    audio.write_to(processed_input)
                     
                     # Custom filter for cloned voice (simplified version - in a real app, this would use voice conversion ML)
                     # Here we're just applying some basic audio manipulation to simulate voice cloning
                     # For a more realistic approach, you would use a proper voice conversion model
-                    cmd = [
-                        "ffmpeg", "-y", 
-                        "-i", processed_input,
-                        "-filter_complex", "asetrate=44100*1.1,aresample=44100,atempo=0.9,aecho=0.8:0.9:50:0.4",
-                        "-c:a", "libopus", output_path
-                    ]
+                    source_path = processed_input
+                    filter_cmd = f"asetrate={SR}*1.1,aresample={SR},atempo=0.9,aecho=0.8:0.9:50:0.4"
                     
                     effect_name = f"Clone: {voice_name}"
                     
                 else:
-                    # Regular effect processing
+                    # Regular effect processing, from the decode a preview started if there is one
+                    with tracing.span("decode_wait"):
+                        source_path = await decoded_source(user_id, audio)
                     filter_cmd = VOICE_EFFECTS.get(effect_name, "")
-                    
-                    # Build the FFmpeg command
-                    cmd = [
-                        "ffmpeg", "-y", "-i", input_path, 
-                        "-af", filter_cmd, "-c:a", "libopus", 
-                        output_path
-                    ]
                 
-                # Run the FFmpeg command
-                process = subprocess.run(
-                    cmd, 
-                    stdout=subprocess.PIPE, 
-                    stderr=subprocess.PIPE,
-                    text=True
-                )
+                # Render without blocking the event loop (long clips are split across cores);
+                # a newer selection by the same user may cancel it
+                render_task = asyncio.ensure_future(render_effect(
+                    source_path, output_path, filter_cmd,
+                    progress_callback=make_progress_editor(composer.edit_progress, status_text),
+                    effect=effect_name if effect_name in VOICE_EFFECTS else None
+                ))
+                ticket = renders.register(user_id, callback_data.split(":")[1], render_task)
+                try:
+                    with tracing.span("render", effect=effect_name) as span:
+                        success, error_msg = await composer.render(status_text, render_task)
+                        span.set(ok=success)
+                except asyncio.CancelledError:
+                    if not ticket.superseded:
+                        raise
+                    # Superseded: the newer selection edits the message and uploads its own result
+                    logger.info(f"Skipping upload of superseded {effect_name} render for user {user_id}")
+                    return
+                finally:
+                    renders.done(ticket)
                 
-                if process.returncode != 0:
-                    logger.error(f"FFmpeg error: {process.stderr}")
-                    await query.edit_message_text(f"❌ Error applying effect. Please try again or choose another effect.")
+                if not success:
+                    logger.error(f"FFmpeg error: {error_msg}")
+                    if error_msg.startswith(STALLED_ERROR):
+                        await composer.edit("⚠️ Rendering stalled and was stopped. Please try again or choose another effect.")
+                    else:
+                        await composer.edit(f"❌ Error applying effect. Please try again or choose another effect.")
                     return
                 
                 # Update message and send the processed audio
@@ -473,25 +676,25 @@ async def handle_effect_selection(update: Update, context: ContextTypes.DEFAULT_
                     voice_name = user_voice_names.get(user_id, "your cloned voice")
                     voice_info = f" (using *{voice_name}* characteristics)"
                 
-                await query.edit_message_text(f"✅ Applied *{effect_name}* effect{voice_info}!", parse_mode="Markdown")
-                
-                # Send the processed audio
-                with open(output_path, 'rb') as audio_file:
-                    await context.bot.send_voice(
-                        chat_id=user_id,
-                        voice=audio_file,
-                        caption=f"🎧 Audio with *{effect_name}* effect{voice_info}.",
-                        parse_mode="Markdown"
+                # Update the status and send the processed audio concurrently
+                with tracing.span("upload", bytes=os.path.getsize(output_path)):
+                    message = await composer.deliver(
+                        f"✅ Applied *{effect_name}* effect{voice_info}!",
+                        output_path,
+                        f"🎧 Audio with *{effect_name}* effect{voice_info}."
                     )
                 
+                # The uploaded voice can be reused by inline queries without rendering again
+                if effect_name in VOICE_EFFECTS and message is not None and message.voice and user_id in user_audio_ids:
+                    inline_cache.cache.add(user_id, user_audio_ids[user_id], effect_name, message.voice.file_id)
+                
                 # Clean up files
                 try:
                     if effect_name != f"Clone: {user_voice_names.get(user_id, 'My Voice')}":
                         # Don't delete the input if it's a cloned voice
-                        if os.path.exists(input_path):
-                            os.remove(input_path)
                         if user_id in user_audio:
-                            del user_audio[user_id]
+                            user_audio.pop(user_id).release()
+                        discard_decoded(user_id)
                     
                     # Always clean up the output file
                     if os.path.exists(output_path):
@@ -507,42 +710,194 @@ async def handle_effect_selection(update: Update, context: ContextTypes.DEFAULT_
                 
             except Exception as e:
                 logger.error(f"Error applying effect: {str(e)}")
-                await query.edit_message_text("❌ Error applying effect. Please try again or choose another effect.")
+                await composer.edit("❌ Error applying effect. Please try again or choose another effect.")
                 return
+            finally:
+                composer.finish()
     
     except Exception as e:
         logger.error(f"Error in handle_effect_selection: {str(e)}")
         try:
-            await update.callback_query.edit_message_text("❌ An error occurred while processing your audio. Please try again.")
+            await send_queue.edit_message_text(update.callback_query, "❌ An error occurred while processing your audio. Please try again.")
         except Exception:
             pass
 
-# Main function
-def main():
-    """Run the Telegram bot application"""
-    if not BOT_TOKEN:
-        logger.error("TELEGRAM_BOT_TOKEN environment variable not set!")
-        return
-    
-    # Clean up temp directory
+# Pre-render inline variants of the latest upload
+def start_prerender(bot, user_id, source_id):
+    """Replace a user's background pre-render with one for their new upload."""
+    import inline_cache
+
+    task = user_prerenders.pop(user_id, None)
+    if task is not None:
+        task.cancel()
+    if inline_cache.CACHE_CHAT_ID is not None and inline_cache.PRERENDER_EFFECTS:
+        user_prerenders[user_id] = asyncio.ensure_future(prerender_variants(bot, user_id, source_id))
+
+async def prerender_variants(bot, user_id, source_id):
+    """Render the pre-render effects and park them in the cache chat for their file_ids."""
+    import ffmpeg_catalog
+    import inline_cache
+    from render_engine import render_effect
+
+    try:
+        for effect_name in inline_cache.PRERENDER_EFFECTS:
+            audio = user_audio.get(user_id)
+            # Stop once the upload was used up or replaced
+            if audio is None or user_audio_ids.get(user_id) != source_id:
+                return
+            if effect_name not in VOICE_EFFECTS or effect_name in ffmpeg_catalog.failed:
+                continue
+            if inline_cache.cache.has(user_id, source_id, effect_name):
+                continue
+            output_path = os.path.join(TEMP_DIR, f"inline_{user_id}_{effect_name}.ogg")
+            try:
+                success, error_msg = await render_effect(
+                    await decoded_source(user_id, audio), output_path, VOICE_EFFECTS[effect_name], effect=effect_name
+                )
+                if not success:
+                    logger.warning(f"Inline pre-render of {effect_name} failed: {error_msg}")
+                    continue
+                with open(output_path, 'rb') as audio_file:
+                    message = await send_queue.send_voice(
+                        bot, inline_cache.CACHE_CHAT_ID,
+                        voice=audio_file,
+                        caption=f"{user_id} {effect_name}",
+                        disable_notification=True
+                    )
+                inline_cache.cache.add(user_id, source_id, effect_name, message.voice.file_id)
+                metrics.increment("inline_prerenders_total")
+            except Exception as e:
+                logger.error(f"Error pre-rendering {effect_name} for inline mode: {str(e)}")
+            finally:
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+    finally:
+        if user_prerenders.get(user_id) is asyncio.current_task():
+            del user_prerenders[user_id]
+
+# Inline mode: @bot <effect>
+async def handle_inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Answer inline queries from cached variants of the user's latest voice note, never rendering."""
+    import inline_cache
+
+    query = update.inline_query
+    variants = inline_cache.cache.variants(query.from_user.id)
+    
+    results = []
+    if variants:
+        index = get_effect_index()
+        for name in index.search(query.query, limit=len(VOICE_EFFECTS)):
+            if name in variants:
+                results.append(InlineQueryResultCachedVoice(
+                    id=name,
+                    voice_file_id=variants[name],
+                    title=f"{name.title()} ({index.categories.get(name) or 'effect'})",
+                    caption=f"🎧 Audio with *{name}* effect.",
+                    parse_mode="Markdown"
+                ))
+                if len(results) == 50:  # Telegram's limit per answer
+                    break
+    metrics.increment("inline_queries_total")
+    if not results:
+        metrics.increment("inline_queries_empty_total")
+    
+    # Answered directly: inline answers aren't chat messages, so the per-chat send queue doesn't apply
+    await query.answer(
+        results,
+        cache_time=inline_cache.ANSWER_CACHE_TIME,
+        is_personal=True,
+        button=None if variants else InlineQueryResultsButton(
+            text="🎙️ Send me a voice note first", start_parameter="inline"
+        )
+    )
+
+# Cancel stale renders as soon as a newer selection arrives
+def supersede_stale_renders(update):
+    """Dispatcher arrival hook: a new effect selection supersedes older renders."""
+    query = update.callback_query
+    if query is not None and query.data and query.data.startswith(("effect:", "full:")):
+        renders.supersede(query.from_user.id, query.data.split(":")[1])
+
+# Clean up temp directory
+def clean_temp_dir(before=None):
+    """Delete leftover files from previous runs (those modified before `before`, if given)."""
     for filename in os.listdir(TEMP_DIR):
         file_path = os.path.join(TEMP_DIR, filename)
         try:
-            if os.path.isfile(file_path):
+            if os.path.isfile(file_path) and (before is None or os.path.getmtime(file_path) < before):
                 os.unlink(file_path)
         except Exception as e:
             logger.error(f"Error deleting {file_path}: {e}")
+
+def clean_leftovers(before):
+    """Delete temp and spill files of previous runs, keeping those created since `before`."""
+    import audio_memory
+
+    clean_temp_dir(before)
+    audio_memory.clean_spill_dir(before=before)
+
+# Background services started with the application
+async def post_init(application):
+    """Start the event loop monitor, effect validation and the durable render workers."""
+    import ffmpeg_catalog
+    import health
+    import job_queue
+    import loop_monitor
+
+    global effect_validation
+    loop_monitor.start()
+    if ffmpeg_catalog.VALIDATE:
+        # Dry runs take a few seconds on a cold cache; the menu shows every
+        # effect until they finish
+        effect_validation = asyncio.ensure_future(asyncio.to_thread(ffmpeg_catalog.validate, VOICE_EFFECTS))
+    if loop_monitor.ENABLED:
+        # /healthz reports the bot dead once the loop stops beating
+        health.register_liveness("event_loop", health.event_loop_check)
+    else:
+        health.register_liveness(
+            "application", lambda: (application.running, "running" if application.running else "stopped")
+        )
+    await job_queue.start_workers(application)
+
+# Build the application with all handlers
+def create_application(token=None):
+    """
+    Create the bot Application and register the handlers.
     
-    # Create application
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    Args:
+        token (str): Bot token, defaults to TELEGRAM_BOT_TOKEN
+        
+    Returns:
+        Application: The configured application (not yet running)
+    """
+    # Create application (updates run concurrently across users, in order per user)
+    app = build_application(token or BOT_TOKEN, on_arrival=supersede_stale_renders)
     
     # Add handlers
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("clone", clone_voice))
     app.add_handler(CommandHandler("rename", rename_voice))
     app.add_handler(CallbackQueryHandler(handle_effect_selection))
+    app.add_handler(InlineQueryHandler(handle_inline_query))
     app.add_handler(MessageHandler(filters.VOICE | filters.AUDIO, handle_audio))
     
+    # Start the loop monitor and durable render workers once the application runs
+    app.post_init = post_init
+    return app
+
+# Main function
+def main():
+    """Run the Telegram bot application"""
+    if not BOT_TOKEN:
+        logger.error("TELEGRAM_BOT_TOKEN environment variable not set!")
+        return
+    
+    # Leftovers of previous runs are deleted in the background so the first
+    # update doesn't wait on the disk; files of this run are newer than the cutoff
+    started = time.time()
+    threading.Thread(target=clean_leftovers, args=(started,), name="temp-cleanup", daemon=True).start()
+    app = create_application()
+    
     # Start the bot
     logger.info("🤖 Voice Effects Bot is running...")
     app.run_polling()
@@ -0,0 +1,133 @@
+import pytest
+
+import backend_selector
+from backend_selector import BackendSelector, BASELINE, EWMA_ALPHA, FAILURE_COOLDOWN, FAILURE_LIMIT, MIN_SAMPLES
+
+BACKENDS = [BASELINE, "pyav", "numpy"]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Random:
+    """Stands in for the random module: a fixed draw, choice takes the last item."""
+
+    def __init__(self, value=0.99):
+        self.value = value
+        self.choices = []
+
+    def random(self):
+        return self.value
+
+    def choice(self, items):
+        self.choices.append(list(items))
+        return items[-1]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = Clock()
+    monkeypatch.setattr(backend_selector.time, "monotonic", fake)
+    return fake
+
+
+@pytest.fixture
+def rand(monkeypatch):
+    fake = Random()
+    monkeypatch.setattr(backend_selector, "random", fake)
+    return fake
+
+
+@pytest.fixture
+def selector(clock, rand):
+    return BackendSelector(BACKENDS, explore_rate=0.1)
+
+
+def warm_up(selector, costs, duration=10.0):
+    """Give every backend MIN_SAMPLES successful renders at the given cost per audio second."""
+    for backend, cost in costs.items():
+        for _ in range(MIN_SAMPLES):
+            selector.record("robot", duration, backend, cost * duration, ok=True)
+
+
+def test_untried_backends_are_explored_first(selector):
+    chosen = []
+    for _ in range(MIN_SAMPLES * len(BACKENDS)):
+        backend = selector.choose("robot", 10.0, BACKENDS)
+        chosen.append(backend)
+        selector.record("robot", 10.0, backend, 5.0, ok=True)
+    # Every backend got exactly MIN_SAMPLES renders, the least tried going first
+    assert chosen[:len(BACKENDS)] == BACKENDS
+    assert sorted(chosen) == sorted(BACKENDS * MIN_SAMPLES)
+
+
+def test_cheapest_backend_wins_once_measured(selector):
+    warm_up(selector, {BASELINE: 0.5, "pyav": 0.2, "numpy": 0.3})
+    assert selector.choose("robot", 10.0, BACKENDS) == "pyav"
+    # Timings are kept per duration bucket
+    assert selector.choose("robot", 100.0, BACKENDS) == BASELINE
+
+
+def test_exploration_picks_a_random_usable_backend(selector, rand):
+    warm_up(selector, {BASELINE: 0.5, "pyav": 0.2, "numpy": 0.3})
+    rand.value = 0.05
+    assert selector.choose("robot", 10.0, BACKENDS) == "numpy"
+    assert rand.choices == [BACKENDS]
+
+
+def test_cost_is_an_ewma_per_audio_second(selector):
+    selector.record("robot", 10.0, "pyav", 2.0, ok=True)
+    cell = selector.cells[("robot", "5-15s", "pyav")]
+    assert cell.cost == pytest.approx(0.2)
+    selector.record("robot", 10.0, "pyav", 7.0, ok=True)
+    assert cell.cost == pytest.approx((1 - EWMA_ALPHA) * 0.2 + EWMA_ALPHA * 0.7)
+    assert cell.samples == 2
+
+
+def test_failed_runs_do_not_count_as_samples(selector):
+    warm_up(selector, {BASELINE: 0.5, "numpy": 0.3})
+    selector.record("robot", 10.0, "pyav", 1.0, ok=False)
+    cell = selector.cells[("robot", "5-15s", "pyav")]
+    assert cell.samples == 0 and cell.cost is None and cell.failures == 1
+    # Still unmeasured, so it is explored rather than compared on cost
+    assert selector.choose("robot", 10.0, BACKENDS) == "pyav"
+
+
+def test_failing_backend_is_left_out_for_the_cooldown(selector, clock):
+    warm_up(selector, {BASELINE: 0.5, "pyav": 0.1, "numpy": 0.3})
+    for _ in range(FAILURE_LIMIT - 1):
+        selector.record("robot", 10.0, "pyav", 1.0, ok=False)
+    assert selector.choose("robot", 10.0, BACKENDS) == "pyav"
+
+    selector.record("robot", 10.0, "pyav", 1.0, ok=False)
+    assert selector.choose("robot", 10.0, BACKENDS) == "numpy"
+    assert selector.table()["effects"]["robot"]["5-15s"]["choice"] == "numpy"
+
+    clock.now += FAILURE_COOLDOWN
+    assert selector.choose("robot", 10.0, BACKENDS) == "pyav"
+
+
+def test_success_resets_the_failure_run(selector):
+    warm_up(selector, {BASELINE: 0.5, "pyav": 0.1})
+    for _ in range(FAILURE_LIMIT - 1):
+        selector.record("robot", 10.0, "pyav", 1.0, ok=False)
+    selector.record("robot", 10.0, "pyav", 1.0, ok=True)
+    selector.record("robot", 10.0, "pyav", 1.0, ok=False)
+    assert selector.choose("robot", 10.0, [BASELINE, "pyav"]) == "pyav"
+
+
+def test_baseline_is_never_left_out(selector):
+    warm_up(selector, {BASELINE: 0.5, "pyav": 0.8})
+    for _ in range(FAILURE_LIMIT * 2):
+        selector.record("robot", 10.0, BASELINE, 1.0, ok=False)
+    assert selector.cells[("robot", "5-15s", BASELINE)].disabled_until == 0.0
+    assert selector.choose("robot", 10.0, [BASELINE, "pyav"]) == BASELINE
+
+
+def test_baseline_is_added_when_not_configured(clock, rand):
+    assert BackendSelector(["pyav"]).backends == [BASELINE, "pyav"]
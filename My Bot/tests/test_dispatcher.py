@@ -0,0 +1,55 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from dispatcher import PerUserUpdateProcessor
+
+
+def update(user_id):
+    return SimpleNamespace(inline_query=None, effective_user=SimpleNamespace(id=user_id), effective_chat=None)
+
+
+def test_updates_waiting_for_their_user_hold_no_slot():
+    async def main():
+        processor = PerUserUpdateProcessor(2)
+        release = asyncio.Event()
+        order = []
+
+        async def handler(label, wait=False):
+            order.append(label)
+            if wait:
+                await release.wait()
+
+        busy = [asyncio.ensure_future(processor.process_update(update(1), handler(f"a{i}", wait=True)))
+                for i in range(5)]
+        await asyncio.sleep(0.01)
+        # User 1 runs one update; the other four queue behind it without slots
+        await asyncio.wait_for(processor.process_update(update(2), handler("b")), 1)
+        release.set()
+        await asyncio.gather(*busy)
+        return order
+
+    order = asyncio.run(main())
+    assert order[:2] == ["a0", "b"]
+    assert order[2:] == ["a1", "a2", "a3", "a4"]
+
+
+def test_arrival_hook_runs_before_the_wait():
+    async def main():
+        arrived = []
+        processor = PerUserUpdateProcessor(1, on_arrival=lambda u: arrived.append(u.effective_user.id))
+        release = asyncio.Event()
+        first = asyncio.ensure_future(processor.process_update(update(1), release.wait()))
+        await asyncio.sleep(0.01)
+        second = asyncio.ensure_future(processor.process_update(update(2), asyncio.sleep(0)))
+        await asyncio.sleep(0.01)
+        # The only slot is taken, yet user 2's update was already seen
+        seen = list(arrived)
+        release.set()
+        await asyncio.gather(first, second)
+        return seen
+
+    assert asyncio.run(main()) == [1, 2]
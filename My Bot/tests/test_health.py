@@ -0,0 +1,44 @@
+import pytest
+
+import health
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    monkeypatch.setattr(health, "_checks", {})
+    monkeypatch.setattr(health, "_cache", {"ffmpeg": (float("inf"), True)})
+    # Past the start-up grace period
+    monkeypatch.setattr(health, "_started", health.time.monotonic() - health.STARTUP_GRACE - 1)
+
+
+def test_no_registered_bot_is_not_alive():
+    status, report = health.healthz()
+    assert status == 503
+    assert report["alive"] is False and report["bot"] is False
+    assert report["status"] == "no bot in this process"
+
+
+def test_no_registered_bot_counts_as_starting_during_grace(monkeypatch):
+    monkeypatch.setattr(health, "_started", health.time.monotonic())
+    status, report = health.healthz()
+    assert status == 200 and report["status"] == "starting"
+
+
+def test_registered_checks_decide():
+    health.register_liveness("event_loop", lambda: (True, "beating"))
+    assert health.healthz()[0] == 200
+
+    health.register_liveness("dispatcher", lambda: (False, "thread died"))
+    status, report = health.healthz()
+    assert status == 503 and report["status"] == "unhealthy"
+    assert report["checks"]["dispatcher"] == {"ok": False, "detail": "thread died"}
+
+
+def test_failing_check_counts_as_dead():
+    def broken():
+        raise RuntimeError("boom")
+
+    health.register_liveness("workers", broken)
+    report = health.liveness()
+    assert report["alive"] is False
+    assert report["checks"]["workers"]["detail"] == "check failed: boom"
@@ -0,0 +1,117 @@
+import pytest
+
+import job_queue
+from job_queue import JobQueue
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = Clock()
+    monkeypatch.setattr(job_queue.time, "time", fake)
+    return fake
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    return JobQueue(database_url="", sqlite_path=str(tmp_path / "jobs.db"))
+
+
+def enqueue(queue, key="1:2:robot", **kwargs):
+    job_id, created = queue.enqueue(key, 1, 2, "robot", "asetrate=30000", "file-id", **kwargs)
+    assert created
+    return job_id
+
+
+def status(queue, job_id):
+    return queue._execute("SELECT * FROM render_jobs WHERE id = ?", (job_id,), fetch="one")
+
+
+def test_enqueue_is_idempotent(queue):
+    job_id = enqueue(queue)
+    assert queue.enqueue("1:2:robot", 1, 2, "robot", "asetrate=30000", "file-id") == (job_id, False)
+    assert queue.depth() == 1
+
+
+def test_expired_lease_is_leased_again(queue, clock):
+    job_id = enqueue(queue)
+    first = queue.lease("node-a", visibility_timeout=10)
+    assert first["id"] == job_id and first["attempts"] == 1
+    assert queue.lease("node-b", visibility_timeout=10) is None
+
+    clock.now += 11
+    second = queue.lease("node-b", visibility_timeout=10)
+    assert second["id"] == job_id
+    assert second["lease_owner"] == "node-b"
+    assert second["attempts"] == 2
+    # The first worker notices it lost the lease
+    assert not queue.extend(job_id, "node-a")
+    assert queue.extend(job_id, "node-b")
+
+
+def test_extended_lease_is_not_taken(queue, clock):
+    job_id = enqueue(queue)
+    queue.lease("node-a", visibility_timeout=10)
+    clock.now += 8
+    assert queue.extend(job_id, "node-a", visibility_timeout=10)
+    clock.now += 8
+    assert queue.lease("node-b") is None
+
+
+def test_complete_from_stale_owner_is_rejected(queue, clock):
+    job_id = enqueue(queue)
+    queue.lease("node-a", visibility_timeout=10)
+    clock.now += 11
+    queue.lease("node-b", visibility_timeout=10)
+
+    assert not queue.complete(job_id, "node-a", "stale-result")
+    assert status(queue, job_id)["status"] == "leased"
+    assert queue.complete(job_id, "node-b", "result")
+    row = status(queue, job_id)
+    assert row["status"] == "done" and row["result_file_id"] == "result"
+    assert queue.depth() == 0
+
+
+def test_fail_retries_then_gives_up(queue, clock):
+    job_id = enqueue(queue, max_attempts=2)
+    job = queue.lease("node-a")
+    assert queue.fail(job, "node-a", "first error", retry_delay=5)
+    row = status(queue, job_id)
+    assert row["status"] == "queued" and row["lease_owner"] is None
+
+    # Not due before the retry delay
+    assert queue.lease("node-a") is None
+    clock.now += 5
+    job = queue.lease("node-b")
+    assert job["id"] == job_id and job["attempts"] == 2
+
+    assert not queue.fail(job, "node-b", "second error")
+    row = status(queue, job_id)
+    assert row["status"] == "failed" and row["error"] == "second error"
+    clock.now += 3600
+    assert queue.lease("node-a") is None
+
+
+def test_fail_backs_off_exponentially(queue, clock):
+    job_id = enqueue(queue, max_attempts=3)
+    queue.fail(queue.lease("node-a"), "node-a", "error")
+    assert status(queue, job_id)["available_at"] == pytest.approx(clock.now + 2)
+
+
+def test_expired_last_attempt_is_reaped(queue, clock):
+    job_id = enqueue(queue, max_attempts=1)
+    queue.lease("node-a", visibility_timeout=10)
+    clock.now += 11
+    assert queue.lease("node-b") is None
+
+    reaped = queue.reap_exhausted()
+    assert [job["id"] for job in reaped] == [job_id]
+    row = status(queue, job_id)
+    assert row["status"] == "failed" and row["error"] == "lease expired"
@@ -0,0 +1,20 @@
+from render_engine import retarget_chain
+
+
+def test_pitch_shift_follows_the_rate():
+    assert retarget_chain("asetrate=24000*1.5,aresample=24000", 24000, 16000) == "asetrate=24000,aresample=16000"
+
+
+def test_explicit_resample_targets_are_kept():
+    chain = "highpass=f=500,lowpass=f=2000,aresample=8000,aresample=24000"
+    assert retarget_chain(chain, 24000, 16000) == "highpass=f=500,lowpass=f=2000,aresample=8000,aresample=16000"
+
+
+def test_named_rates_and_other_filters_are_kept():
+    chain = "asetrate=r=24000*0.8,aresample=24000,aecho=0.8:0.9:1000:0.3"
+    assert retarget_chain(chain, 24000, 16000) == "asetrate=r=12800,aresample=16000,aecho=0.8:0.9:1000:0.3"
+
+
+def test_same_rate_is_unchanged():
+    chain = "asetrate=24000*1.5,aresample=24000"
+    assert retarget_chain(chain, 24000, 24000) is chain
@@ -0,0 +1,108 @@
+from fractions import Fraction
+
+import pytest
+
+from render_engine import analyze_filter_chain, plan_segments, canonical_chain, CANONICAL_SAMPLE_RATE
+from voice_effects import VOICE_EFFECTS
+
+try:
+    from simple_bot import VOICE_EFFECTS as BOT_EFFECTS
+except ImportError:
+    # simple_bot needs python-telegram-bot
+    BOT_EFFECTS = {}
+
+CATALOG = [(f"voice_effects:{name}", chain) for name, chain in VOICE_EFFECTS.items()]
+CATALOG += [(f"simple_bot:{name}", chain) for name, chain in BOT_EFFECTS.items()]
+
+
+def analyze(chain):
+    # As render_effect sees it: behind the conversion to the canonical format
+    return analyze_filter_chain(canonical_chain(chain), CANONICAL_SAMPLE_RATE)
+
+
+# chain, parallel, reason, scale (output / input duration), pre-roll seconds
+CASES = [
+    # Stateful filters that need the whole clip
+    (VOICE_EFFECTS["reverse"], False, "stateful filter 'areverse'", 1, None),
+    (VOICE_EFFECTS["old_radio"], False, "stateful filter 'areverse'", 1, None),
+    ("areverse,aecho=0.8:0.8:500:0.5,areverse", False, "stateful filter 'areverse'", 1, None),
+    ("chorus=0.7:0.9:55:0.4:0.25:2", False, "stateful filter 'chorus'", 1, None),
+    # Echoes: the longest delay becomes pre-roll, very long ones go serial
+    (VOICE_EFFECTS["echo"], True, "", 1, 1.01),
+    (VOICE_EFFECTS["cave"], True, "", 1, 0.07),
+    ("aecho=0.9:0.9:3000:0.7", False, "long aecho (3.0s)", 1, None),
+    # Tempo changes scale the output and shrink or stretch the pre-roll
+    (VOICE_EFFECTS["slowmo"], True, "", Fraction(5, 3), 0.07),
+    (VOICE_EFFECTS["fast"], True, "", Fraction(2, 3), 0.16),
+    ("atempo=0.5,aecho=0.8:0.9:1000:0.3", True, "", 2, 0.56),
+    # Pitch shifts through asetrate stretch time as well
+    (VOICE_EFFECTS["chipmunk"], True, "", Fraction(2, 3), 0.025),
+    (VOICE_EFFECTS["underwater"], True, "", Fraction(5, 4), 0.918),
+    ("asetrate=24000*1.5,aresample=24000,atempo=0.8", True, "", Fraction(5, 6), 0.145),
+    # Time-dependent expressions
+    ("aeval=sin(2*PI*t)*val(0)", False, "time dependent expression in 'aeval'", 1, None),
+]
+
+
+@pytest.mark.parametrize("chain, parallel, reason, scale, preroll", CASES)
+def test_analyze_filter_chain(chain, parallel, reason, scale, preroll):
+    analysis = analyze(chain)
+    assert analysis["parallel"] is parallel
+    assert analysis["reason"] == reason
+    assert analysis["scale"] == scale
+    if preroll is not None:
+        assert analysis["preroll"] == pytest.approx(preroll)
+
+
+@pytest.mark.parametrize("chain, grid", [
+    (VOICE_EFFECTS["tremolo"], Fraction(1, 6)),
+    (VOICE_EFFECTS["vibrato"], Fraction(1, 7)),
+    (VOICE_EFFECTS["telephone"], Fraction(5, 4)),
+    (VOICE_EFFECTS["echo"], 0),
+])
+def test_lfo_grid(chain, grid):
+    assert analyze(chain)["grid"] == grid
+
+
+def test_serial_chains_are_not_split():
+    for chain in (VOICE_EFFECTS["reverse"], "aecho=0.9:0.9:3000:0.7", "atempo=1.5,areverse"):
+        assert plan_segments(600, analyze(chain), max_segments=8) == []
+
+
+def test_short_clips_are_not_split():
+    assert plan_segments(25, analyze(VOICE_EFFECTS["echo"]), max_segments=8) == []
+
+
+def test_echo_segments_carry_preroll():
+    segments = plan_segments(120, analyze(VOICE_EFFECTS["echo"]), max_segments=4)
+    assert [length for _, _, length in segments] == [30, 30, 30, 30]
+    assert segments[0] == (0.0, 0.0, 30.0)
+    for read_start, preroll, _ in segments[1:]:
+        assert preroll == pytest.approx(1.01)
+
+
+def test_lfo_segments_start_on_the_grid():
+    segments = plan_segments(120, analyze(VOICE_EFFECTS["tremolo"]), max_segments=4)
+    for read_start, preroll, _ in segments:
+        phase = read_start * 6  # tremolo at 6 Hz
+        assert phase == pytest.approx(round(phase))
+
+
+@pytest.mark.parametrize("name, chain", CATALOG, ids=[name for name, _ in CATALOG])
+def test_catalog_segments_cover_the_clip(name, chain):
+    duration = 95.0
+    analysis = analyze(chain)
+    segments = plan_segments(duration, analysis, max_segments=4)
+    if not analysis["parallel"]:
+        assert analysis["reason"]
+        assert segments == []
+        return
+    assert analysis["scale"] > 0
+    assert len(segments) == 4
+    position = 0.0
+    for read_start, preroll, length in segments:
+        # Every segment starts where the previous one ended, after its pre-roll
+        assert read_start + preroll == pytest.approx(position)
+        assert read_start >= 0 and preroll >= min(analysis["preroll"], position) - 1e-9
+        position += length
+    assert position == pytest.approx(duration)
@@ -0,0 +1,192 @@
+import time
+import asyncio
+
+import pytest
+
+pytest.importorskip("telegram")
+from telegram.error import RetryAfter
+
+import send_queue
+from send_queue import TokenBucket, SendQueue
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = Clock()
+    monkeypatch.setattr(send_queue.time, "monotonic", fake)
+    return fake
+
+
+def test_bucket_starts_full_and_refills(clock):
+    bucket = TokenBucket(rate=2, capacity=4)
+    for _ in range(4):
+        assert bucket.delay() == 0
+        bucket.consume()
+    assert bucket.delay() == pytest.approx(0.5)
+
+    clock.now += 0.25
+    assert bucket.delay() == pytest.approx(0.25)
+    clock.now += 0.25
+    assert bucket.delay() == 0
+
+
+def test_bucket_refill_is_capped_at_capacity(clock):
+    bucket = TokenBucket(rate=1, capacity=3)
+    bucket.consume()
+    clock.now += 60
+    bucket.delay()
+    assert bucket.tokens == 3
+    assert bucket.idle()
+
+
+def test_bucket_block_overrides_tokens(clock):
+    bucket = TokenBucket(rate=10)
+    bucket.block(5)
+    assert bucket.delay() == pytest.approx(5)
+    assert not bucket.idle()
+    clock.now += 5
+    assert bucket.delay() == 0
+
+
+class Recorder:
+    """Stands in for a bound Bot API method and records when it was called."""
+
+    def __init__(self, failures=()):
+        self.calls = []
+        self.failures = list(failures)
+
+    async def __call__(self, label):
+        self.calls.append((label, time.monotonic()))
+        if self.failures:
+            raise self.failures.pop(0)
+        return label
+
+
+def test_per_chat_limit_does_not_hold_up_other_chats():
+    recorder = Recorder()
+
+    async def main():
+        queue = SendQueue(global_rate=1000, private_rate=5)  # per chat: burst of 15, then 5/s
+        calls = [queue.submit(1, send_queue.PRIORITY_MESSAGE, recorder, f"a{i}") for i in range(17)]
+        calls.append(queue.submit(2, send_queue.PRIORITY_MESSAGE, recorder, "b"))
+        return await asyncio.gather(*calls)
+
+    results = asyncio.run(main())
+    assert results[-1] == "b"
+    order = [label for label, _ in recorder.calls]
+    times = dict(recorder.calls)
+    # Chat 1's burst is spent after 15 calls; chat 2 goes out before chat 1's 16th
+    assert order.index("b") < order.index("a15")
+    assert times["a15"] - times["a0"] >= 0.15
+    assert times["b"] - times["a0"] < 0.1
+
+
+def test_global_limit_applies_across_chats():
+    recorder = Recorder()
+
+    async def main():
+        queue = SendQueue(global_rate=10, private_rate=100)  # global: burst of 10, then 10/s
+        await asyncio.gather(*(
+            queue.submit(chat_id, send_queue.PRIORITY_MESSAGE, recorder, chat_id) for chat_id in range(12)
+        ))
+
+    asyncio.run(main())
+    times = [at for _, at in recorder.calls]
+    assert times[9] - times[0] < 0.05
+    assert times[11] - times[0] >= 0.15
+
+
+def test_retry_after_waits_then_resends():
+    recorder = Recorder(failures=[RetryAfter(1)])
+
+    async def main():
+        queue = SendQueue()
+        result = await queue.submit(7, send_queue.PRIORITY_VOICE, recorder, "voice")
+        return result, queue
+
+    result, queue = asyncio.run(main())
+    assert result == "voice"
+    assert len(recorder.calls) == 2
+    assert recorder.calls[1][1] - recorder.calls[0][1] >= 0.9
+    assert queue.chat_buckets[7].blocked_until > 0
+
+
+def test_retry_after_gives_up_after_max_retries():
+    recorder = Recorder(failures=[RetryAfter(1)])
+
+    async def main():
+        queue = SendQueue(max_retries=0)
+        await queue.submit(7, send_queue.PRIORITY_MESSAGE, recorder, "text")
+
+    with pytest.raises(RetryAfter):
+        asyncio.run(main())
+    assert len(recorder.calls) == 1
+
+
+def test_idle_chat_buckets_are_evicted(clock):
+    queue = SendQueue(private_rate=1)
+    for chat_id in range(100):
+        queue._chat_bucket(chat_id).consume()
+    clock.now += 60
+    queue._chat_bucket(1000)
+    assert list(queue.chat_buckets) == [1000]
+
+
+class FakeBot:
+    """Bot API methods with the real keyword signatures, recording their calls."""
+
+    def __init__(self):
+        self.calls = []
+
+    async def send_voice(self, chat_id, voice, **kwargs):
+        self.calls.append(("send_voice", chat_id, voice))
+        return "voice-sent"
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls.append(("send_message", chat_id, text))
+        return "message-sent"
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        self.calls.append(("edit_message_text", chat_id, text))
+        return "edited"
+
+
+def test_bot_wrappers_pass_chat_id_to_the_method(monkeypatch):
+    bot = FakeBot()
+
+    async def main():
+        monkeypatch.setattr(send_queue, "outbound", SendQueue())
+        return (
+            await send_queue.send_voice(bot, 42, voice=b"ogg", caption="done"),
+            await send_queue.send_message(bot, -100, text="hello"),
+            await send_queue.bot_edit_message_text(bot, 42, message_id=7, text="50%"),
+        )
+
+    assert asyncio.run(main()) == ("voice-sent", "message-sent", "edited")
+    assert bot.calls == [("send_voice", 42, b"ogg"), ("send_message", -100, "hello"), ("edit_message_text", 42, "50%")]
+    assert set(send_queue.outbound.chat_buckets) == {42, -100}
+
+
+def test_dispatch_error_fails_only_that_call():
+    recorder = Recorder()
+
+    async def main():
+        queue = SendQueue()
+        # A chat id the bucket table can't handle makes dispatching that call fail
+        bad = asyncio.ensure_future(queue.submit("not-a-chat", send_queue.PRIORITY_MESSAGE, recorder, "bad"))
+        good = asyncio.ensure_future(queue.submit(5, send_queue.PRIORITY_MESSAGE, recorder, "good"))
+        results = await asyncio.gather(bad, good, return_exceptions=True)
+        return results, queue._worker.done()
+
+    (bad, good), worker_done = asyncio.run(main())
+    assert isinstance(bad, TypeError)
+    assert good == "good"
+    assert not worker_done
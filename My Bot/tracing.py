@@ -0,0 +1,363 @@
+"""
+Lightweight per-update tracing.
+
+Every update processed by the dispatcher starts a trace; handlers wrap their
+stages (get_file, download, decode, render, upload, ...) in spans, which
+nest through contextvars, so spans opened in tasks spawned by a handler
+join its trace. Tracing is off until TRACE_FILE is set; whether a trace is
+recorded is then decided once, when it starts, by TRACE_SAMPLE_RATE.
+Finished spans of sampled traces are handed to a background thread that
+appends them to TRACE_FILE, so the event loop never waits on the disk.
+
+Two file formats are supported: "jsonl", one span per line, and "otlp",
+OTLP/JSON ExportTraceServiceRequest lines as written by the OpenTelemetry
+collector's file exporter.
+
+Usage (per-stage latency percentiles from trace files):
+    python tracing.py traces.jsonl [more.jsonl ...]
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import argparse
+import threading
+import contextvars
+
+import metrics
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Fraction of updates traced (0 disables tracing)
+SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.1'))
+
+# File the spans are appended to; tracing is opt-in (empty disables it).
+# It isn't rotated here, but it is reopened per batch, so logrotate can move it.
+TRACE_FILE = os.environ.get('TRACE_FILE', '')
+
+# "jsonl" or "otlp"
+TRACE_FORMAT = os.environ.get('TRACE_FORMAT', 'jsonl')
+
+# Spans waiting for the writer; more are dropped rather than slowing the bot down
+QUEUE_SIZE = 10000
+
+# Spans written per batch (one OTLP line per batch)
+BATCH_SIZE = 512
+
+SERVICE_NAME = "voice-effects-bot"
+
+_current = contextvars.ContextVar("tracing_span", default=None)
+
+
+class Span:
+    """A timed stage of a trace; use as a context manager."""
+
+    def __init__(self, name, trace_id, parent_id, sampled, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex() if sampled else None
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.attributes = attributes
+        self.error = None
+        self.start = None
+        self.duration = None
+        self._started = None
+        self._token = None
+
+    def set(self, **attributes):
+        """Add attributes to the span."""
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        self.start = time.time()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._started
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.error = exc_type.__name__ if not str(exc) else f"{exc_type.__name__}: {exc}"
+        if self.sampled:
+            exporter.submit(self)
+        return False
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration": self.duration,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+def trace(name, sample_rate=None, **attributes):
+    """
+    Start a new trace with its root span.
+
+    Args:
+        name (str): Root span name, e.g. the update type
+        sample_rate (float): Overrides TRACE_SAMPLE_RATE
+        **attributes: Attributes of the root span
+
+    Returns:
+        Span: The root span (a context manager)
+    """
+    rate = SAMPLE_RATE if sample_rate is None else sample_rate
+    sampled = bool(TRACE_FILE) and rate > 0 and random.random() < rate
+    return Span(name, os.urandom(16).hex() if sampled else None, None, sampled, attributes)
+
+
+def span(name, **attributes):
+    """
+    Open a span inside the current trace (a no-op outside of sampled traces).
+
+    Args:
+        name (str): Stage name, e.g. "download"
+        **attributes: Attributes of the span
+
+    Returns:
+        Span: The span (a context manager)
+    """
+    parent = _current.get()
+    if parent is None or not parent.sampled:
+        return Span(name, None, None, False, attributes)
+    return Span(name, parent.trace_id, parent.span_id, True, attributes)
+
+
+def current_trace_id():
+    """Return the trace id of the current sampled trace, or None."""
+    current = _current.get()
+    return current.trace_id if current is not None else None
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(spans):
+    """
+    Convert spans to one OTLP/JSON ExportTraceServiceRequest.
+
+    Args:
+        spans (list): Span.to_dict() values
+
+    Returns:
+        dict: The request body
+    """
+    otlp_spans = []
+    for record in spans:
+        start_ns = int(record["start"] * 1e9)
+        otlp_span = {
+            "traceId": record["trace_id"],
+            "spanId": record["span_id"],
+            "name": record["name"],
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(start_ns),
+            "endTimeUnixNano": str(start_ns + int(record["duration"] * 1e9)),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in record["attributes"].items()],
+            "status": {"code": 2, "message": record["error"]} if record["error"] else {"code": 1},
+        }
+        if record["parent_id"]:
+            otlp_span["parentSpanId"] = record["parent_id"]
+        otlp_spans.append(otlp_span)
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": "tracing"}, "spans": otlp_spans}],
+    }]}
+
+
+def from_otlp(line):
+    """Yield Span.to_dict()-like records from one OTLP/JSON line."""
+    for resource_spans in line.get("resourceSpans", []):
+        for scope_spans in resource_spans.get("scopeSpans", []):
+            for otlp_span in scope_spans.get("spans", []):
+                start = int(otlp_span["startTimeUnixNano"])
+                status = otlp_span.get("status", {})
+                yield {
+                    "trace_id": otlp_span.get("traceId"),
+                    "span_id": otlp_span.get("spanId"),
+                    "parent_id": otlp_span.get("parentSpanId"),
+                    "name": otlp_span["name"],
+                    "start": start / 1e9,
+                    "duration": (int(otlp_span["endTimeUnixNano"]) - start) / 1e9,
+                    "attributes": {
+                        item["key"]: next(iter(item["value"].values()), None)
+                        for item in otlp_span.get("attributes", [])
+                    },
+                    "error": status.get("message") if status.get("code") == 2 else None,
+                }
+
+
+class FileExporter:
+    """Appends finished spans to a file from a background thread."""
+
+    def __init__(self, path=None, file_format=None):
+        self.path = path if path is not None else TRACE_FILE
+        self.format = file_format or TRACE_FORMAT
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, finished_span):
+        """Queue a finished span without blocking."""
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                    self.thread.start()
+        try:
+            self.queue.put_nowait(finished_span.to_dict())
+            metrics.increment("trace_spans_total")
+        except queue.Full:
+            metrics.increment("trace_spans_dropped_total")
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            batch = [record for record in batch if record is not None]
+            try:
+                self._write(batch)
+            except Exception as e:
+                logger.error(f"Could not write {len(batch)} spans to {self.path}: {str(e)}")
+            for _ in range(len(batch) + (1 if stop else 0)):
+                self.queue.task_done()
+            if stop:
+                return
+
+    def _write(self, batch):
+        if not batch:
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            if self.format == "otlp":
+                f.write(json.dumps(to_otlp(batch)) + "\n")
+            else:
+                for record in batch:
+                    f.write(json.dumps(record) + "\n")
+
+    def close(self, timeout=2.0):
+        """Write out the queued spans and stop the writer."""
+        if self.thread is None or not self.thread.is_alive():
+            return
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self.thread.join(timeout)
+
+
+# Process-wide exporter
+exporter = FileExporter()
+atexit.register(exporter.close)
+
+
+def read_spans(paths):
+    """
+    Read spans from JSONL or OTLP/JSON trace files.
+
+    Args:
+        paths (list): Trace files
+
+    Returns:
+        list: Span.to_dict()-like records
+    """
+    spans = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "resourceSpans" in record:
+                    spans.extend(from_otlp(record))
+                else:
+                    spans.append(record)
+    return spans
+
+
+def summarize(spans):
+    """
+    Compute latency percentiles per span name.
+
+    Args:
+        spans (list): Records from read_spans
+
+    Returns:
+        dict: name: {"count", "errors", "p50", "p90", "p99", "max"} in seconds
+    """
+    durations = {}
+    errors = {}
+    for record in spans:
+        durations.setdefault(record["name"], []).append(record["duration"])
+        if record.get("error"):
+            errors[record["name"]] = errors.get(record["name"], 0) + 1
+    return {
+        name: {
+            "count": len(values),
+            "errors": errors.get(name, 0),
+            "p50": metrics.percentile(values, 0.5),
+            "p90": metrics.percentile(values, 0.9),
+            "p99": metrics.percentile(values, 0.99),
+            "max": max(values),
+        }
+        for name, values in durations.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage latency percentiles from trace files")
+    parser.add_argument(
+        "files", nargs="*", default=[TRACE_FILE or "traces.jsonl"], help="JSONL or OTLP/JSON trace files"
+    )
+    parser.add_argument("--stage", action="append", help="only report these span names")
+    args = parser.parse_args()
+
+    spans = read_spans(args.files)
+    if args.stage:
+        spans = [record for record in spans if record["name"] in args.stage]
+    if not spans:
+        print("No spans found", file=sys.stderr)
+        sys.exit(1)
+    traces = len({record["trace_id"] for record in spans})
+    print(f"{len(spans)} spans from {traces} traces\n")
+    print(f"{'stage':<20} {'count':>7} {'errors':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    summary = summarize(spans)
+    for name, row in sorted(summary.items(), key=lambda item: item[1]["p50"], reverse=True):
+        print(f"{name:<20} {row['count']:>7} {row['errors']:>7} {row['p50'] * 1000:>9.1f} "
+              f"{row['p90'] * 1000:>9.1f} {row['p99'] * 1000:>9.1f} {row['max'] * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
 import os
+import time
 import shutil
 import logging
+import threading
+
+import ffmpeg_limits
 
 # Configure logging
 logging.basicConfig(
@@ -9,34 +13,58 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def ensure_temp_dir(directory):
+# Minimum seconds between two progress edits of the same status message.
+# Telegram allows roughly one message edit per second per chat.
+PROGRESS_EDIT_INTERVAL = float(os.environ.get('PROGRESS_EDIT_INTERVAL', '3'))
+
+def ensure_temp_dir(directory, background=False):
     """
     Ensure that the temporary directory exists and is empty.
     
     Args:
         directory (str): Path to the temporary directory
+        background (bool): Delete the old contents in a background thread,
+            so start-up doesn't wait on the disk. Entries created after the
+            call are kept.
     """
     try:
         # Create directory if it doesn't exist
         if not os.path.exists(directory):
             os.makedirs(directory)
             logger.info(f"Created temporary directory: {directory}")
+        elif background:
+            threading.Thread(
+                target=clean_dir, args=(directory, time.time()), name="temp-cleanup", daemon=True
+            ).start()
         else:
-            # Clean up old files
-            for filename in os.listdir(directory):
-                file_path = os.path.join(directory, filename)
-                try:
-                    if os.path.isfile(file_path) or os.path.islink(file_path):
-                        os.unlink(file_path)
-                    elif os.path.isdir(file_path):
-                        shutil.rmtree(file_path)
-                except Exception as e:
-                    logger.error(f"Failed to delete {file_path}: {str(e)}")
-            
-            logger.info(f"Cleaned temporary directory: {directory}")
+            clean_dir(directory)
     except Exception as e:
         logger.error(f"Error ensuring temporary directory: {str(e)}")
 
+def clean_dir(directory, before=None):
+    """
+    Delete the contents of a directory.
+    
+    Args:
+        directory (str): Directory to clean
+        before (float): Only delete entries last modified before this time
+            (seconds since the epoch); everything when None
+    """
+    # Clean up old files
+    for filename in os.listdir(directory):
+        file_path = os.path.join(directory, filename)
+        try:
+            if before is not None and os.path.getmtime(file_path) >= before:
+                continue
+            if os.path.isfile(file_path) or os.path.islink(file_path):
+                os.unlink(file_path)
+            elif os.path.isdir(file_path):
+                shutil.rmtree(file_path)
+        except Exception as e:
+            logger.error(f"Failed to delete {file_path}: {str(e)}")
+    
+    logger.info(f"Cleaned temporary directory: {directory}")
+
 def cleanup_user_files(user_id, temp_dir, user_audio_dict):
     """
     Clean up user audio files and remove from dictionary.
@@ -78,6 +106,18 @@ def apply_audio_effect(input_path, output_path, effect_filter):
     if not os.path.exists(input_path):
         return False, f"Input file not found: {input_path}"
     
+    # Effects are written for the canonical mono format
+    import av_backend
+    from render_engine import RENDER_BACKEND, canonical_chain
+    effect_filter = canonical_chain(effect_filter)
+    
+    # In-process rendering when the deployment selected the PyAV backend
+    if RENDER_BACKEND == "pyav" and av_backend.AVAILABLE:
+        success, error_msg = av_backend.render_file(input_path, output_path, effect_filter)
+        if success:
+            return True, ""
+        logger.warning(f"PyAV render failed ({error_msg}); falling back to FFmpeg")
+    
     try:
         import subprocess
         cmd = [
@@ -86,7 +126,7 @@ def apply_audio_effect(input_path, output_path, effect_filter):
             output_path
         ]
         
-        process = subprocess.run(
+        process = ffmpeg_limits.run(
             cmd, 
             stdout=subprocess.PIPE, 
             stderr=subprocess.PIPE,
@@ -141,7 +181,9 @@ def apply_voice_clone_effect(input_path, output_path, cloned_voice_path):
         
         # 2. Apply a transformation based on the cloned voice characteristics
         # Here we're just using a simple formant shift filter as a demonstration
-        filter_cmd = "asetrate=44100*1.1,aresample=44100,atempo=0.9"
+        from render_engine import CANONICAL_SAMPLE_RATE, canonical_chain
+        sample_rate = CANONICAL_SAMPLE_RATE
+        filter_cmd = canonical_chain(f"asetrate={sample_rate}*1.1,aresample={sample_rate},atempo=0.9")
         
         cmd = [
             "ffmpeg", "-y", "-i", input_path, 
@@ -149,7 +191,7 @@ def apply_voice_clone_effect(input_path, output_path, cloned_voice_path):
             output_path
         ]
         
-        process = subprocess.run(
+        process = ffmpeg_limits.run(
             cmd, 
             stdout=subprocess.PIPE, 
             stderr=subprocess.PIPE,
@@ -181,3 +223,55 @@ def check_ffmpeg_installed():
         return result.returncode == 0
     except Exception:
         return False
+
+def format_progress(label, fraction):
+    """
+    Format a status line with a text progress bar.
+    
+    Args:
+        label (str): Status text shown above the bar
+        fraction (float): Completed fraction between 0 and 1
+        
+    Returns:
+        str: Status text with progress bar and percentage
+    """
+    filled = int(fraction * 10)
+    bar = "▓" * filled + "░" * (10 - filled)
+    return f"{label}\n{bar} {int(fraction * 100)}%"
+
+def make_progress_editor(edit_message, label, min_interval=None, min_step=0.05):
+    """
+    Create a throttled progress callback that edits a status message.
+    
+    Edits are skipped when the previous one happened less than min_interval
+    seconds ago or the percentage moved by less than min_step, which keeps
+    us within Telegram's edit rate limits and avoids "message is not
+    modified" errors.
+    
+    Args:
+        edit_message (callable): Coroutine function taking the new text
+            and keyword arguments for edit_message_text
+        label (str): Status text shown above the progress bar
+        min_interval (float): Minimum seconds between edits
+        min_step (float): Minimum progress change between edits
+        
+    Returns:
+        callable: Async callback accepting the completed fraction
+    """
+    min_interval = PROGRESS_EDIT_INTERVAL if min_interval is None else min_interval
+    state = {"last_edit": time.monotonic(), "last_fraction": 0.0}
+    
+    async def on_progress(fraction):
+        now = time.monotonic()
+        if now - state["last_edit"] < min_interval:
+            return
+        if fraction - state["last_fraction"] < min_step or fraction >= 1.0:
+            return
+        state["last_edit"] = now
+        state["last_fraction"] = fraction
+        try:
+            await edit_message(format_progress(label, fraction), parse_mode="Markdown")
+        except Exception as e:
+            logger.warning(f"Could not update progress message: {str(e)}")
+    
+    return on_progress
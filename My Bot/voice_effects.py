@@ -3,26 +3,32 @@ This module contains the available voice effects for the Telegram bot.
 Each effect is mapped to its corresponding FFmpeg filter command.
 """
 
+from render_engine import CANONICAL_SAMPLE_RATE
+
+# Effects run on mono audio at the canonical internal rate; pitch shifts are
+# written relative to it so they are sample-rate correct
+SR = CANONICAL_SAMPLE_RATE
+
 # Basic voice effects
 VOICE_EFFECTS = {
-    "chipmunk": "asetrate=44100*1.5,aresample=44100",
-    "deep": "asetrate=44100*0.7,aresample=44100",
+    "chipmunk": f"asetrate={SR}*1.5,aresample={SR}",
+    "deep": f"asetrate={SR}*0.7,aresample={SR}",
     "robot": "afftfilt=real='hypot(re,im)':imag='0'",
     "echo": "aecho=0.8:0.9:1000:0.3",
     "radio": "highpass=f=300, lowpass=f=3400",
     "slowmo": "atempo=0.6",
     "fast": "atempo=1.5",
     "reverse": "areverse",
-    "alien": "asetrate=44100*0.5,aresample=44100",
+    "alien": f"asetrate={SR}*0.5,aresample={SR}",
     "cave": "aecho=0.8:0.88:60:0.4",
-    "underwater": "aecho=0.6:0.9:900:0.3,asetrate=48000*0.8,aresample=48000",
+    "underwater": f"aecho=0.6:0.9:900:0.3,asetrate={SR}*0.8,aresample={SR}",
     "telephone": "highpass=f=500,lowpass=f=2000,aphaser=type=t:speed=0.8:decay=0.6",
     "megaphone": "highpass=f=400,lowpass=f=4000,compand=0.4:0.8:0:-7:-14:-90:5:5",
     "tremolo": "tremolo=f=6:d=0.8",
     "vibrato": "vibrato=f=7:d=0.5",
     "whisper": "highpass=f=200,lowpass=f=3000,acompressor=threshold=0.1:ratio=4",
-    "evil": "asetrate=44100*0.75,aresample=44100,aecho=0.8:0.88:30:0.5",
-    "helium": "asetrate=44100*1.8,aresample=44100",
+    "evil": f"asetrate={SR}*0.75,aresample={SR},aecho=0.8:0.88:30:0.5",
+    "helium": f"asetrate={SR}*1.8,aresample={SR}",
     "old_radio": "highpass=f=500,lowpass=f=3000,aphaser=speed=0.5:decay=0.3,areverse",
     "metallic": "afftfilt=real='hypot(re,im)*sin(0)':imag='hypot(re,im)*cos(0)',aecho=0.8:0.88:6:0.4"
 }
@@ -0,0 +1,303 @@
+"""
+Webhook ingestion for the Telegram bot.
+
+In webhook mode the Flask app receives updates from Telegram on a secret
+path and hands them to the bot dispatcher, which runs on its own event loop
+in a background thread of the same process.
+
+Per-user state (uploads, decodes, clone state) lives in the dispatcher's
+process memory, and a voice note and the button press that follows must
+reach the same process. Only one process per deployment may therefore run
+a dispatcher: a second one on the same host refuses to start (see
+DISPATCHER_LOCK_FILE), and exactly one instance may be registered as the
+webhook. To use more cores, run runtime.py, whose ingester routes every
+user to a fixed worker process.
+"""
+
+import os
+import hmac
+import asyncio
+import hashlib
+import logging
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Configure logging
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# "polling" (default) or "webhook"
+BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+
+# Public base URL of this deployment, e.g. https://voice-bot.example.com
+WEBHOOK_BASE_URL = os.environ.get('WEBHOOK_BASE_URL', '')
+
+# Maximum simultaneous webhook connections Telegram may open
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get('WEBHOOK_MAX_CONNECTIONS', '40'))
+
+# Lock file ensuring a single dispatcher per host (empty disables the check)
+DISPATCHER_LOCK_FILE = os.environ.get('WEBHOOK_DISPATCHER_LOCK', 'webhook_dispatcher.lock')
+
+# Updates held while the dispatcher starts; beyond this they are refused (and retried by Telegram)
+WEBHOOK_STARTUP_BUFFER = int(os.environ.get('WEBHOOK_STARTUP_BUFFER', '1000'))
+
+
+def webhook_secret(token=None):
+    """
+    Return the secret used in the webhook path and secret-token header.
+
+    Defaults to a digest of the bot token so every process derives the same
+    value without extra configuration.
+
+    Args:
+        token (str): Bot token, defaults to TELEGRAM_BOT_TOKEN
+
+    Returns:
+        str: Secret made of characters Telegram accepts ([A-Za-z0-9_-])
+    """
+    configured = os.environ.get('WEBHOOK_SECRET')
+    if configured:
+        return configured
+    token = token or os.environ.get('TELEGRAM_BOT_TOKEN', '')
+    return hashlib.sha256(f"webhook:{token}".encode()).hexdigest()[:32]
+
+
+async def register_webhook(bot):
+    """
+    Point Telegram at this deployment's webhook path.
+
+    setWebhook is idempotent, so it is called on every start. Without
+    WEBHOOK_BASE_URL nothing is registered and a warning says so.
+
+    Args:
+        bot (telegram.Bot): Initialized bot to register with
+
+    Returns:
+        bool: True if the webhook was registered
+    """
+    if not WEBHOOK_BASE_URL:
+        logger.warning(
+            "WEBHOOK_BASE_URL not set; the webhook must be registered elsewhere "
+            "(setWebhook to <base url>/telegram/<secret>) or no updates will arrive"
+        )
+        return False
+    url = f"{WEBHOOK_BASE_URL.rstrip('/')}/telegram/{webhook_secret()}"
+    await bot.set_webhook(
+        url=url,
+        secret_token=webhook_secret(),
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=["message", "callback_query", "inline_query"]
+    )
+    logger.info(f"Webhook registered at {WEBHOOK_BASE_URL.rstrip('/')}/telegram/…")
+    return True
+
+
+def is_valid_request(path_secret, header_secret):
+    """
+    Check both the secret path segment and Telegram's secret-token header.
+
+    Args:
+        path_secret (str): Secret taken from the request path
+        header_secret (str): X-Telegram-Bot-Api-Secret-Token header value
+
+    Returns:
+        bool: True if the request comes from Telegram
+    """
+    secret = webhook_secret()
+    return hmac.compare_digest(path_secret or "", secret) and hmac.compare_digest(header_secret or "", secret)
+
+
+class WebhookBot:
+    """Runs the bot Application on a background event loop fed by webhooks."""
+
+    def __init__(self, application_factory):
+        """
+        Args:
+            application_factory (callable): Returns a configured Application
+        """
+        self.application_factory = application_factory
+        self.application = None
+        self.loop = None
+        self.ready = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.pending = []  # payloads received before the dispatcher was ready
+
+    def start(self, wait=True):
+        """
+        Start the dispatcher thread.
+
+        Args:
+            wait (bool): Wait until it accepts updates; otherwise updates
+                arriving meanwhile are buffered and handled once it does
+        """
+        import health
+
+        self.thread = threading.Thread(target=self._run, name="webhook-bot", daemon=True)
+        self.thread.start()
+        health.register_liveness("dispatcher", self.liveness)
+        if wait and not self.ready.wait(timeout=30):
+            logger.error("Bot dispatcher did not start within 30 seconds")
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._startup())
+            self.loop.run_forever()
+        finally:
+            self.loop.run_until_complete(self._shutdown())
+            self.loop.close()
+
+    async def _startup(self):
+        self.application = self.application_factory()
+        await self.application.initialize()
+        await self.application.start()
+        # run_polling/run_webhook would call post_init; do it by hand here
+        if self.application.post_init:
+            await self.application.post_init(self.application)
+        await register_webhook(self.application.bot)
+        with self.lock:
+            self.ready.set()
+            pending, self.pending = self.pending, []
+        if pending:
+            logger.info(f"Handling {len(pending)} updates received during start-up")
+        for payload in pending:
+            await self._put(payload)
+
+    async def _shutdown(self):
+        if self.application is not None:
+            await self.application.stop()
+            await self.application.shutdown()
+
+    def liveness(self):
+        """Health check: the dispatcher thread runs and accepts updates."""
+        if not self.thread.is_alive():
+            return False, "dispatcher thread died"
+        return self.ready.is_set(), "accepting updates" if self.ready.is_set() else "starting"
+
+    def enqueue(self, payload):
+        """
+        Hand a raw webhook payload to the dispatcher.
+
+        Args:
+            payload (dict): Update JSON as sent by Telegram
+
+        Returns:
+            bool: True if the update was queued
+        """
+        if payload is None:
+            return False
+        if not self.ready.is_set():
+            with self.lock:
+                if not self.ready.is_set():
+                    if not self.thread.is_alive() or len(self.pending) >= WEBHOOK_STARTUP_BUFFER:
+                        return False
+                    self.pending.append(payload)
+                    return True
+        asyncio.run_coroutine_threadsafe(self._put(payload), self.loop)
+        return True
+
+    async def _put(self, payload):
+        from telegram import Update
+
+        await self.application.update_queue.put(Update.de_json(payload, self.application.bot))
+
+    def stop(self):
+        """Stop the dispatcher loop."""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+_bot = None
+_bot_lock = threading.Lock()
+_dispatcher_lock = None  # open lock file held by the dispatcher process
+_update_sink = None
+
+
+def set_update_sink(sink):
+    """
+    Send webhook payloads to sink instead of an in-process dispatcher.
+
+    Used by the multi-process runtime, whose ingester forwards updates to
+    worker processes.
+
+    Args:
+        sink (callable): Called with each payload dict, returns True if queued
+    """
+    global _update_sink
+    _update_sink = sink
+
+
+def start_webhook_bot():
+    """
+    Start the process-wide webhook dispatcher once.
+
+    Returns:
+        WebhookBot: The running dispatcher, or None when an update sink is set
+    """
+    global _bot
+    if _update_sink is not None:
+        return None
+    with _bot_lock:
+        if _bot is None:
+            _claim_dispatcher()
+            # Don't block the web worker's import on the bot: the dispatcher
+            # thread imports it, and updates arriving meanwhile are buffered
+            _bot = WebhookBot(_create_application)
+            _bot.start(wait=False)
+    return _bot
+
+
+def _claim_dispatcher():
+    """
+    Hold an exclusive lock for the lifetime of the process.
+
+    Raises:
+        RuntimeError: If another process on this host runs a dispatcher
+            (e.g. a second gunicorn worker)
+    """
+    global _dispatcher_lock
+    if not DISPATCHER_LOCK_FILE or fcntl is None:
+        return
+    lock = open(DISPATCHER_LOCK_FILE, "a")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        raise RuntimeError(
+            "Another process already runs the webhook dispatcher. Per-user state is kept in memory, "
+            "so run a single web worker (gunicorn -w 1) or scale with runtime.py --mode webhook"
+        )
+    _dispatcher_lock = lock
+
+
+def _create_application():
+    # Temp files are shared between workers, so they are not wiped here
+    from simple_bot import create_application
+
+    return create_application()
+
+
+def enqueue_update(payload):
+    """
+    Queue a webhook payload for the process-wide dispatcher.
+
+    Args:
+        payload (dict): Update JSON as sent by Telegram
+
+    Returns:
+        bool: True if the update was queued
+    """
+    if _update_sink is not None:
+        return payload is not None and _update_sink(payload)
+    if _bot is None:
+        return False
+    return _bot.enqueue(payload)